@@ -0,0 +1,247 @@
+"""
+Opt-in request instrumentation, enabled with INSTRUMENTATION = True.
+
+Every request served with it records the tenant schema, the view name, the
+wall time, the number and time of the database queries, the time spent
+rendering templates and PDF reports, and the SQL statements executed
+INSTRUMENTATION_REPEATED_QUERIES times or more (N+1 patterns). Every
+process buffers its samples and appends them to the RequestSample table
+every INSTRUMENTATION_FLUSH_SIZE samples or INSTRUMENTATION_FLUSH_INTERVAL
+seconds, so a measured request makes no query of its own. The last
+INSTRUMENTATION_SAMPLES requests of every (schema, view) are kept and
+summarized as percentiles by summary().
+"""
+import json
+import math
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import groupby
+
+from django.conf import settings
+from django.utils import timezone as tz
+
+PERCENTILES = (50, 90, 99)
+
+_local = threading.local()
+_buffer = []
+_buffer_lock = threading.Lock()
+_flushed = time.monotonic()
+
+
+def is_enabled():
+    return getattr(settings, 'INSTRUMENTATION', False)
+
+
+class RequestRecord(object):
+    """
+    Measures of the request being served, also used as the execute wrapper
+    of the database connection.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.statements = Counter()
+        self.timers = {}
+        self._running = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_local, 'paused', False):
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_time += time.perf_counter() - start
+            self.queries += 1
+            # the statement with its placeholders, the same one run in a loop is a N+1
+            self.statements[sql] += 1
+
+    def repeated(self):
+        threshold = getattr(settings, 'INSTRUMENTATION_REPEATED_QUERIES', 5)
+        return {sql: count for sql, count in self.statements.items() if count >= threshold}
+
+    def sample(self, schema_name, view_name, wall):
+        return {
+            'schema': schema_name,
+            'view': view_name,
+            'time': time.time(),
+            'wall': wall,
+            'queries': self.queries,
+            'query_time': self.query_time,
+            'template_time': self.timers.get('template', 0.0),
+            'pdf_time': self.timers.get('pdf', 0.0),
+            'repeated': self.repeated(),
+        }
+
+
+def current_record():
+    return getattr(_local, 'record', None)
+
+
+@contextmanager
+def recording():
+    """Makes a new RequestRecord the record of the current thread for the block"""
+    previous = current_record()
+    _local.record = record = RequestRecord()
+    try:
+        yield record
+    finally:
+        _local.record = previous
+
+
+@contextmanager
+def timer(name):
+    """Adds the time spent in the block to the timer name of the request being
+    recorded, a block nested in another one of the same name is not counted twice"""
+    record = current_record()
+    if record is None or name in record._running:
+        yield
+        return
+    record._running.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record._running.discard(name)
+        record.timers[name] = record.timers.get(name, 0.0) + time.perf_counter() - start
+
+
+@contextmanager
+def paused():
+    """The queries of the block are not recorded, for the own ones of the instrumentation"""
+    previous = getattr(_local, 'paused', False)
+    _local.paused = True
+    try:
+        yield
+    finally:
+        _local.paused = previous
+
+
+def store(sample):
+    """Buffers sample, the buffer is written once it is large or old enough"""
+    with _buffer_lock:
+        _buffer.append(sample)
+        due = (len(_buffer) >= getattr(settings, 'INSTRUMENTATION_FLUSH_SIZE', 50)
+            or time.monotonic() - _flushed >= getattr(settings, 'INSTRUMENTATION_FLUSH_INTERVAL', 10))
+    if due:
+        flush()
+
+
+def flush():
+    """Appends the samples buffered by this process to the table and drops the
+    oldest ones of their views, returns how many were written"""
+    global _flushed
+    from main_site.models import RequestSample
+    with _buffer_lock:
+        samples = _buffer[:]
+        del _buffer[:]
+        _flushed = time.monotonic()
+    if not samples:
+        return 0
+    limit = getattr(settings, 'INSTRUMENTATION_SAMPLES', 500)
+    with paused():
+        RequestSample.objects.bulk_create([
+            RequestSample(
+                schema=sample['schema'],
+                view=sample['view'],
+                time=datetime.fromtimestamp(sample['time'], tz.utc),
+                wall=sample['wall'],
+                queries=sample['queries'],
+                query_time=sample['query_time'],
+                template_time=sample['template_time'],
+                pdf_time=sample['pdf_time'],
+                repeated=json.dumps(sample['repeated']))
+            for sample in samples
+        ])
+        for schema, view in {(sample['schema'], sample['view']) for sample in samples}:
+            rows = RequestSample.objects.filter(schema=schema, view=view)
+            oldest = rows.order_by('-pk').values_list('pk', flat=True)[limit - 1:limit]
+            if oldest:
+                rows.filter(pk__lt=oldest[0]).delete()
+    return len(samples)
+
+
+def observe(schema_name, name, **timers):
+    """Records work done outside of a request, e.g. a PDF rendered in the background"""
+    if not is_enabled():
+        return
+    record = RequestRecord()
+    record.timers = timers
+    store(record.sample(schema_name, name, sum(timers.values())))
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of values, already sorted"""
+    if not values:
+        return 0
+    rank = max(math.ceil(p / 100.0 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def _distribution(samples, field):
+    values = sorted(sample[field] for sample in samples)
+    result = {'p{}'.format(p): percentile(values, p) for p in PERCENTILES}
+    result['max'] = values[-1] if values else 0
+    return result
+
+
+def _samples():
+    """Samples of every (schema, view) in the order they were recorded"""
+    from main_site.models import RequestSample
+    fields = ('schema', 'view', 'wall', 'queries', 'query_time', 'template_time', 'pdf_time', 'repeated')
+    rows = RequestSample.objects.order_by('schema', 'view', 'pk').values(*fields)
+    for key, samples in groupby(rows.iterator(), key=lambda row: (row['schema'], row['view'])):
+        samples = list(samples)
+        for sample in samples:
+            sample['repeated'] = json.loads(sample['repeated'])
+        yield samples
+
+
+def summary():
+    """Percentiles of every (schema, view), the slowest first"""
+    flush()
+    rows = []
+    for samples in _samples():
+        repeated = Counter()
+        for sample in samples:
+            for sql, count in sample['repeated'].items():
+                repeated[sql] = max(repeated[sql], count)
+        rows.append({
+            'schema': samples[-1]['schema'],
+            'view': samples[-1]['view'],
+            'requests': len(samples),
+            'wall': _distribution(samples, 'wall'),
+            'queries': _distribution(samples, 'queries'),
+            'query_time': _distribution(samples, 'query_time'),
+            'template_time': _distribution(samples, 'template_time'),
+            'pdf_time': _distribution(samples, 'pdf_time'),
+            'n_plus_one': sum(1 for sample in samples if sample['repeated']),
+            'repeated_queries': [
+                {'sql': sql, 'count': count} for sql, count in repeated.most_common(5)],
+        })
+    rows.sort(key=lambda row: row['wall']['p90'], reverse=True)
+    return rows
+
+
+def reset():
+    from main_site.models import RequestSample
+    with _buffer_lock:
+        del _buffer[:]
+    RequestSample.objects.all().delete()
+
+
+def instrument_templates():
+    """Times the rendering of every Django template, installed once per process"""
+    from django.template.backends.django import Template
+    if getattr(Template.render, 'instrumented', False):
+        return
+    render = Template.render
+
+    def timed_render(self, context=None, request=None):
+        with timer('template'):
+            return render(self, context, request)
+    timed_render.instrumented = True
+    Template.render = timed_render
@@ -1,16 +1,133 @@
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
 from django.contrib.contenttypes.models import ContentType
-from django.db import connection
+from django.db import connection, connections
 from django.http import Http404, HttpResponseForbidden
 from django.utils.deprecation import MiddlewareMixin
 
 from django_tenants.utils import remove_www_and_dev, get_public_schema_name, get_tenant_domain_model
 from django.db import utils
-from datetime import date 
+from datetime import date
 from django.contrib import messages
 from django.utils.translation import ugettext_lazy as _
+from collections import OrderedDict
+from uuid import uuid4
+import threading
+import time
+
+from . import instrumentation
+
+
+TENANT_CACHE_STAMP = 'bitpoint:tenants:stamp'
+
+
+class TenantCache(object):
+    """
+    Process local LRU cache of hostname -> tenant with a time to live.
+    Unknown hostnames are cached as None so they don't hit the public
+    schema on every request either. The entries are dropped when the
+    version stamp shared by the processes in the cache changes, which is
+    read at most every check_interval seconds.
+    """
+    def __init__(self, maxsize, ttl, check_interval):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._checked = None
+
+    def _check_stamp(self):
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < self.check_interval:
+            return
+        stamp = cache.get(TENANT_CACHE_STAMP)
+        if stamp is None:
+            # invalidated, or first use of the cache
+            stamp = uuid4().hex
+            if not cache.add(TENANT_CACHE_STAMP, stamp, None):
+                stamp = cache.get(TENANT_CACHE_STAMP, stamp)
+        with self._lock:
+            self._checked = now
+            if stamp != self._stamp:
+                self._entries.clear()
+                self._stamp = stamp
+
+    def get(self, hostname):
+        """Returns (found, tenant)"""
+        self._check_stamp()
+        with self._lock:
+            entry = self._entries.get(hostname)
+            if entry is None:
+                return False, None
+            expires, tenant = entry
+            if expires < time.monotonic():
+                del self._entries[hostname]
+                return False, None
+            self._entries.move_to_end(hostname)
+            return True, tenant
+
+    def set(self, hostname, tenant):
+        self._check_stamp()
+        with self._lock:
+            self._entries[hostname] = (time.monotonic() + self.ttl, tenant)
+            self._entries.move_to_end(hostname)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+tenant_cache = TenantCache(
+    maxsize=getattr(settings, 'TENANT_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'TENANT_CACHE_TTL', 300),
+    check_interval=getattr(settings, 'TENANT_CACHE_CHECK_INTERVAL', 2))
+
+
+def invalidate_tenant_cache():
+    """Drops every cached hostname in every process, called when a school is
+    added, changed or deleted"""
+    tenant_cache.clear()
+    cache.delete(TENANT_CACHE_STAMP)
+
+
+class SchemaContentTypeCache(dict):
+    """
+    ContentType cache kept per schema instead of being wiped on every request.
+    ContentTypeManager indexes its cache by database alias, which is mapped
+    here to the (alias, schema) of the connection serving the current thread.
+    """
+    def _key(self, using):
+        return (using, getattr(connections[using], 'schema_name', None))
+
+    def __getitem__(self, using):
+        return super().__getitem__(self._key(using))
+
+    def setdefault(self, using, default=None):
+        return super().setdefault(self._key(using), default)
+
 
 class BitpointTenantMiddleware(MiddlewareMixin):
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        if not isinstance(ContentType.objects._cache, SchemaContentTypeCache):
+            ContentType.objects._cache = SchemaContentTypeCache()
+
+    def get_tenant(self, hostname):
+        found, tenant = tenant_cache.get(hostname)
+        if not found:
+            try:
+                domain = get_tenant_domain_model().objects.select_related('tenant').get(domain=hostname)
+                tenant = domain.tenant
+            except get_tenant_domain_model().DoesNotExist:
+                tenant = None
+            tenant_cache.set(hostname, tenant)
+        return tenant
+
     def process_request(self, request):
         request.META['SMS-CONTEXT-EXIST'] = False
         connection.set_schema_to_public()
@@ -29,20 +146,43 @@ class BitpointTenantMiddleware(MiddlewareMixin):
 
         else:
             try:
-                domain = get_tenant_domain_model().objects.select_related('tenant').get(domain=hostname_without_port)
-                request.tenant = domain.tenant
-                if sms_context_processor not in context_processors:
-                    context_processors.append(sms_context_processor)
-                request.META['SMS-CONTEXT-EXIST'] = True
+                tenant = self.get_tenant(hostname_without_port)
             except utils.DatabaseError:
                 request.urlconf = settings.PUBLIC_SCHEMA_URLCONF
                 return
-            except get_tenant_domain_model().DoesNotExist:
+            if tenant is None:
                 request.urlconf = settings.PUBLIC_SCHEMA_URLCONF
                 return
 
+            request.tenant = tenant
+            if sms_context_processor not in context_processors:
+                context_processors.append(sms_context_processor)
+            request.META['SMS-CONTEXT-EXIST'] = True
+
             connection.set_tenant(request.tenant)
-            ContentType.objects.clear_cache()
 
             if hasattr(settings, 'PUBLIC_SCHEMA_URLCONF') and request.tenant.schema_name == get_public_schema_name():
-                request.urlconf = settings.PUBLIC_SCHEMA_URLCONF
\ No newline at end of file
+                request.urlconf = settings.PUBLIC_SCHEMA_URLCONF
+
+
+class InstrumentationMiddleware(object):
+    """
+    Records the queries and timings of every request, see bitpoint.instrumentation.
+    Put it first in MIDDLEWARE so that the other middlewares are measured too,
+    it is removed from the chain unless INSTRUMENTATION is True.
+    """
+    def __init__(self, get_response):
+        if not instrumentation.is_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        instrumentation.instrument_templates()
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with instrumentation.recording() as record, connection.execute_wrapper(record):
+            response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else 'unresolved'
+        instrumentation.store(record.sample(
+            connection.schema_name, view_name, time.perf_counter() - start))
+        return response
@@ -102,6 +102,7 @@ TEST_RUNNER = 'django.test.runner.DiscoverRunner'
 
 
 MIDDLEWARE = (
+    'bitpoint.middleware.InstrumentationMiddleware',
     'bitpoint.middleware.BitpointTenantMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -175,6 +176,59 @@ TENANT_MODEL = "schools.Client"  # app.Model
 
 TENANT_DOMAIN_MODEL = "schools.Domain"  # app.Model
 
+# hostname -> tenant resolution cache of BitpointTenantMiddleware (per process),
+# invalidations reach the other processes within TENANT_CACHE_CHECK_INTERVAL
+TENANT_CACHE_SIZE = 1024
+TENANT_CACHE_TTL = 300  # seconds
+TENANT_CACHE_CHECK_INTERVAL = 2  # seconds
+
+# shared by every worker process, it holds the version stamps through which the
+# invalidations of the per-tenant values kept in memory by sms (grade scale,
+# settings, sessions) reach all of them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.environ.get('MEMCACHED_LOCATION', '127.0.0.1:11211'),
+    }
+}
+
+# lifetime of the per-tenant values cached by sms (grade scale, settings, sessions)
+SMS_CACHE_TIMEOUT = 300  # seconds
+# a process checks that a cached value was not invalidated at most this often
+SMS_CACHE_CHECK_INTERVAL = 2  # seconds
+SMS_CACHE_SIZE = 10000
+# the home page figures are recomputed after this delay, they are not invalidated on writes
+DASHBOARD_CACHE_TIMEOUT = 60  # seconds
+
+# per request query, template and PDF timings shown in the site admin (opt-in),
+# the last INSTRUMENTATION_SAMPLES requests of every school and view are kept
+INSTRUMENTATION = False
+INSTRUMENTATION_SAMPLES = 500
+# every process writes its samples in batches of this size, or this old
+INSTRUMENTATION_FLUSH_SIZE = 50
+INSTRUMENTATION_FLUSH_INTERVAL = 10  # seconds
+# a statement run this many times by one request is reported as a N+1 query
+INSTRUMENTATION_REPEATED_QUERIES = 5
+
+# number of processes rendering the PDF reports in the background,
+# 0 renders them synchronously inside the request
+PDF_WORKERS = 2
+# students per report card document rendered by a worker, the parts are merged
+REPORT_CHUNK_SIZE = 10
+# rows fetched at a time by the server-side cursors of the CSV/XLSX exports
+EXPORT_CHUNK_SIZE = 2000
+
+# outbound text messages, the fake gateway keeps them in memory (sms.sms_sender.FakeGateway)
+SMS_GATEWAY = 'sms.sms_sender.TwilioGateway'
+SMS_SENDER_ID = 'Bitpoint inc.'
+# messages sent at the same time per process
+SMS_WORKERS = 4
+# a failed message is retried after SMS_RETRY_BACKOFF * 2 ** (attempts - 1) seconds
+SMS_MAX_ATTEMPTS = 5
+SMS_RETRY_BACKOFF = 60  # seconds
+# finished report jobs and their files are deleted after this delay
+REPORT_JOB_MAX_AGE = 60 * 60 * 24  # seconds
+
 TEST_RUNNER = 'django.test.runner.DiscoverRunner'
 
 AUTH_USER_MODEL = 'authentication.User'
@@ -231,6 +285,16 @@ PWA_SERVICE_WORKER_PATH = os.path.join(BASE_DIR, 'sms/static/js', 'serviceworker
 
 # Mail CONF
 EMAIL_BACKEND = "sendgrid_backend.SendgridBackend"
+DEFAULT_FROM_EMAIL = "noreply@bitpoint.com"
+
+# mails are sent by a background thread, False sends them inside the request
+MAIL_BACKGROUND = True
+# personalized messages sent over the backend connection at once
+MAIL_BATCH_SIZE = 50
+MAIL_RATE_LIMIT = 10  # messages per second
+# a failed batch is retried after MAIL_RETRY_BACKOFF * 2 ** (attempt - 1) seconds
+MAIL_MAX_ATTEMPTS = 3
+MAIL_RETRY_BACKOFF = 5  # seconds
 
 with open(BASE_DIR + '/key/sendgrid_api_key.txt') as f:
     SENDGRID_API_KEY = f.read().strip()
\ No newline at end of file
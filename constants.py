@@ -120,8 +120,31 @@ NOTIFICATION_TYPE = (
 DRAFT = "D"
 DELIVERED = "S"
 PENDING = "P"
+SENDING = "O"
+FAILED = "F"
 STATUS = (
     (DRAFT, _("Draft")),
     (DELIVERED, _("Delivered")),
     (PENDING, _("Pending")),
-)
\ No newline at end of file
+    (SENDING, _("Sending")),
+    (FAILED, _("Failed")),
+)
+
+DELIVERY_STATUS = (
+    (PENDING, _("Pending")),
+    (SENDING, _("Sending")),
+    (DELIVERED, _("Delivered")),
+    (FAILED, _("Failed")),
+)
+
+MAX_CA_SCORE = 30
+MAX_EXAM_SCORE = 60
+
+JOB_QUEUED = "Queued"
+JOB_DONE = "Done"
+JOB_FAILED = "Failed"
+JOB_STATUS = (
+	(JOB_QUEUED, "Queued"),
+	(JOB_DONE, "Done"),
+	(JOB_FAILED, "Failed"),
+	)
@@ -1,7 +1,8 @@
 from django.shortcuts import render
 from django.core.files.storage import FileSystemStorage
 from .models import OnlineAdmission
-from sms.models import Class, Section, Session, Setting
+from sms.models import Class, Section, Setting
+from sms.school import get_academic_context
 from django.http import HttpResponse
 from .forms import OnlineAdmissionForm
 from django.shortcuts import redirect
@@ -39,7 +40,7 @@ def admissionNumberCodeGen():
 
 def process_online_admission(request):
 	setting = Setting.objects.first()
-	current_session = Session.objects.get(current_session=True)
+	current_session = get_academic_context(request).session
 	if request.method == "POST":
 		form =  OnlineAdmissionForm(request.POST, request.FILES)
 		if form.is_valid():
@@ -105,13 +106,13 @@ def process_online_admission(request):
 def search_admission_status(request):
 	if request.is_ajax():
 		admission_id = request.GET.get('admission_id')
-		current_session = Session.objects.get(current_session=True)
+		current_session = get_academic_context(request).session
 		admission_id = OnlineAdmission.objects.filter(admission_id=admission_id, session=current_session).first()
 		return render(request, 'frontend/search_status.html', {'admission': admission_id})
 
 
 def download_admission(request, admID):
-	current_session = Session.objects.get(current_session=True)
+	current_session = get_academic_context(request).session
 	applicant = OnlineAdmission.objects.filter(admission_id=admID, session=current_session).first()
 	print(admID)
 	setting = Setting.objects.first()
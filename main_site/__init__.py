@@ -0,0 +1 @@
+default_app_config = 'main_site.apps.MainSiteConfig'
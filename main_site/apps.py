@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MainSiteConfig(AppConfig):
     name = 'main_site'
+
+    def ready(self):
+        from . import signals
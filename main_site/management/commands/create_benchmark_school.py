@@ -0,0 +1,53 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django_tenants.utils import schema_context, schema_exists
+
+from bitpoint.middleware import invalidate_tenant_cache
+from main_site.statistics import refresh_statistics
+from schools.models import Client, Domain
+from sms.synthetic import ADMIN_USERNAME, PASSWORD, generate_school
+
+
+class Command(BaseCommand):
+    help = ('Create a school filled with synthetic data of the given volume, to be '
+            'measured with: manage.py tenant_command benchmark --schema=<schema>')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', default='bench', help='Schema name (and subdomain) of the school')
+        parser.add_argument('--classes', type=int, default=12)
+        parser.add_argument('--subjects', type=int, default=10, help='Subjects taken by every class')
+        parser.add_argument('--students', type=int, default=600)
+        parser.add_argument('--terms', type=int, default=3, choices=(1, 2, 3), help='Terms with grades')
+        parser.add_argument('--days', type=int, default=60, help='Attendance days per term')
+        parser.add_argument('--no-payments', action='store_true', help='Do not create payments')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        schema_name = options['schema']
+        if schema_exists(schema_name):
+            raise CommandError('The schema {} already exists, delete the school or use another '
+                               '--schema'.format(schema_name))
+        tenant = Client(
+            schema_name=schema_name,
+            name=schema_name,
+            description='Synthetic school for benchmarks',
+            on_trial=False,
+            active_until=datetime.date.today() + datetime.timedelta(days=365))
+        tenant.save()  # creates and migrates the schema
+        domain = Domain.objects.create(domain='{}.localhost'.format(schema_name), tenant=tenant, is_primary=True)
+        invalidate_tenant_cache()
+
+        with schema_context(schema_name):
+            generate_school(
+                classes=options['classes'],
+                subjects=options['subjects'],
+                students=options['students'],
+                terms=options['terms'],
+                days=options['days'],
+                payments=not options['no_payments'],
+                seed=options['seed'],
+                stdout=self.stdout)
+        refresh_statistics(tenant)
+        self.stdout.write(self.style.SUCCESS('{} is ready at http://{}/app/, sign in as {} / {}'.format(
+            schema_name, domain.domain, ADMIN_USERNAME, PASSWORD)))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from main_site.statistics import refresh_all_statistics
+
+
+class Command(BaseCommand):
+    help = ('Refresh the students, teachers, parents, sms unit and storage figures '
+            'of every school in the public schema, run it periodically (e.g. from cron)')
+
+    def handle(self, *args, **options):
+        count = refresh_all_statistics()
+        self.stdout.write(self.style.SUCCESS('{} schools refreshed'.format(count)))
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.21 on 2026-10-18 12:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('schools', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TenantStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('students', models.PositiveIntegerField(default=0)),
+                ('teachers', models.PositiveIntegerField(default=0)),
+                ('parents', models.PositiveIntegerField(default=0)),
+                ('sms_unit', models.IntegerField(default=0)),
+                ('storage', models.BigIntegerField(default=0)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+                ('tenant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='statistics', to='schools.Client')),
+            ],
+            options={
+                'verbose_name_plural': 'tenant statistics',
+            },
+        ),
+    ]
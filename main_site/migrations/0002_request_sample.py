@@ -0,0 +1,32 @@
+# Generated by Django 2.2.21 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_site', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestSample',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('schema', models.CharField(max_length=63)),
+                ('view', models.CharField(max_length=200)),
+                ('time', models.DateTimeField()),
+                ('wall', models.FloatField()),
+                ('queries', models.PositiveIntegerField()),
+                ('query_time', models.FloatField()),
+                ('template_time', models.FloatField()),
+                ('pdf_time', models.FloatField()),
+                ('repeated', models.TextField(default='{}')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='requestsample',
+            index=models.Index(fields=['schema', 'view'], name='request_sample_view_idx'),
+        ),
+    ]
@@ -1 +1,52 @@
 from django.db import models
+
+from schools.models import Client
+
+
+class TenantStatistics(models.Model):
+    """
+    Figures of a school kept in the public schema, so that the platform
+    pages read them from one table instead of switching to every schema.
+    Counts are updated when users or the school setting change, the whole
+    row is refreshed by the refresh_tenant_statistics command.
+    """
+    tenant = models.OneToOneField(Client, on_delete=models.CASCADE, related_name='statistics')
+    students = models.PositiveIntegerField(default=0)
+    teachers = models.PositiveIntegerField(default=0)
+    parents = models.PositiveIntegerField(default=0)
+    sms_unit = models.IntegerField(default=0)
+    # bytes used by the tables of the schema and the uploaded files of the school
+    storage = models.BigIntegerField(default=0)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'tenant statistics'
+
+    def __str__(self):
+        return str(self.tenant)
+
+
+class RequestSample(models.Model):
+    """
+    Measures of a request recorded by bitpoint.instrumentation. The worker
+    processes buffer them and append them in batches, the last
+    INSTRUMENTATION_SAMPLES of every (schema, view) are kept.
+    """
+    schema = models.CharField(max_length=63)
+    view = models.CharField(max_length=200)
+    time = models.DateTimeField()
+    wall = models.FloatField()
+    queries = models.PositiveIntegerField()
+    query_time = models.FloatField()
+    template_time = models.FloatField()
+    pdf_time = models.FloatField()
+    # {sql: count} of the statements repeated by the request, as JSON
+    repeated = models.TextField(default='{}')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['schema', 'view'], name='request_sample_view_idx'),
+        ]
+
+    def __str__(self):
+        return '{} {}'.format(self.schema, self.view)
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from authentication.models import User
+from sms.models import Setting
+from sms.signals import is_login
+from .statistics import schedule_refresh_counts
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Setting)
+def school_figures_changed(sender, update_fields=None, **kwargs):
+    if not is_login(update_fields):
+        schedule_refresh_counts()
@@ -0,0 +1,115 @@
+import os
+import threading
+
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django_tenants.utils import get_public_schema_name, schema_context
+
+from authentication.models import User
+from schools.models import Client
+from sms.models import Setting
+from .models import TenantStatistics
+
+
+def _counts():
+    """Figures of the current schema, one query for the users and one for the setting"""
+    counts = User.objects.aggregate(
+        students=Count('pk', filter=Q(is_student=True)),
+        teachers=Count('pk', filter=Q(is_teacher=True)),
+        parents=Count('pk', filter=Q(is_parent=True)),
+    )
+    counts['sms_unit'] = Setting.objects.values_list('sms_unit', flat=True).first() or 0
+    return counts
+
+
+def _database_size(schema_name):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COALESCE(SUM(pg_total_relation_size(c.oid)), 0) "
+            "FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE n.nspname = %s AND c.relkind IN ('r', 'm')", [schema_name])
+        return cursor.fetchone()[0]
+
+
+def _media_size():
+    """Size of the uploaded files of the current schema"""
+    try:
+        root = default_storage.path('')
+    except NotImplementedError:
+        return 0
+    size = 0
+    for path, dirs, files in os.walk(root):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(path, name))
+            except OSError:
+                pass
+    return size
+
+
+def refresh_statistics(tenant):
+    """Recompute every figure of tenant, storage included"""
+    with schema_context(tenant.schema_name):
+        values = _counts()
+        values['storage'] = _database_size(tenant.schema_name) + _media_size()
+    statistics, created = TenantStatistics.objects.update_or_create(tenant=tenant, defaults=values)
+    return statistics
+
+
+def refresh_all_statistics():
+    """Refresh the figures of every school, returns how many were refreshed"""
+    count = 0
+    for tenant in Client.objects.exclude(schema_name=get_public_schema_name()):
+        refresh_statistics(tenant)
+        count += 1
+    return count
+
+
+def refresh_counts(schema_name):
+    """Update the user counts and sms unit of a school, the storage is
+    left to refresh_statistics as it is slower to compute"""
+    tenant = Client.objects.filter(schema_name=schema_name).first()
+    if tenant is None:
+        return
+    with schema_context(schema_name):
+        values = _counts()
+    TenantStatistics.objects.update_or_create(tenant=tenant, defaults=values)
+
+
+_scheduled = threading.local()
+
+
+def _pending_counts():
+    """Schools waiting for a commit to refresh their counts, per thread"""
+    if not hasattr(_scheduled, 'schemas'):
+        _scheduled.schemas = set()
+    return _scheduled.schemas
+
+
+def schedule_refresh_counts():
+    """Refresh the counts of the current school once the transaction commits,
+    several changes inside one transaction only trigger one refresh"""
+    schema_name = connection.schema_name
+    if schema_name == get_public_schema_name():
+        return
+    _pending_counts().add(schema_name)
+
+    def refresh():
+        # only the first callback of the school refreshes the counts
+        pending = _pending_counts()
+        if schema_name in pending:
+            pending.discard(schema_name)
+            refresh_counts(schema_name)
+    transaction.on_commit(refresh)
+
+
+def get_platform_totals():
+    """Sums over every school, read from the rollup table"""
+    return TenantStatistics.objects.exclude(
+        tenant__schema_name=get_public_schema_name()).aggregate(
+        students=Sum('students'),
+        teachers=Sum('teachers'),
+        parents=Sum('parents'),
+        storage=Sum('storage'),
+    )
@@ -19,5 +19,6 @@ urlpatterns = [
     path('schools/sms/subscription/manage/', su_view.schools_sms_sub, name="schools_sms_sub"),
     path('schools/sms/subscription/manage/update/', su_view.schools_sms_sub_update, name="schools_sms_sub_update"),
     path('schools/backup/<int:tenant_id>/', su_view.site_backup, name="site_backup"),
+    path('instrumentation/', su_view.instrumentation_view, name="instrumentation"),
     ]
     
\ No newline at end of file
@@ -1,3 +1,5 @@
+import tempfile
+
 from django.conf import settings
 from django.db import utils
 from django.views.generic import TemplateView
@@ -6,7 +8,8 @@ from schools.models import Client, Domain
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, Http404
+from django.utils import timezone
+from django.http import FileResponse, HttpResponse, Http404, JsonResponse
 from django_tenants.utils import schema_context, schema_exists
 from authentication.models import User
 from sms.sms_sender import send_sms
@@ -15,16 +18,17 @@ from django.contrib import messages
 from .forms import UpdateSchoolForm, SchoolDeleteForm, SchoolAddForm
 from django.contrib.auth.hashers import check_password
 from sms.decorators import site_su_required
+from bitpoint import instrumentation
+from bitpoint.middleware import invalidate_tenant_cache
+from .statistics import get_platform_totals
+from sms.exports import write_backup
 
 @login_required(login_url='/login/')
 @site_su_required
 def dashboard(request):
     template = 'authenticated/dashboard.html'
     tenants = Client.objects.exclude(schema_name='public')
-    students_count = 0
-    for tenant in tenants:
-        with schema_context(tenant.schema_name):
-            students_count += User.objects.filter(is_student=True).count()
+    students_count = get_platform_totals()['students'] or 0
     target = 500 * students_count # N500 times Number of students in all tenants
     context = {"tenants_count": tenants.count()}
     context['students_count'] = students_count
@@ -90,6 +94,7 @@ def school_add_save(request):
                     domain.tenant = tenant
                     domain.is_primary = True
                     domain.save()
+                    invalidate_tenant_cache()
 
                     with schema_context(tenant.schema_name):
                         admin = User.objects.create_superuser(
@@ -177,40 +182,39 @@ def schools_sms_sub_update(request):
 def schools_sms_sub(request):
     template = 'authenticated/schools_sms_sub.html'
     context = {}
-    tenants = Client.objects.exclude(schema_name='public')
+    tenants = Client.objects.exclude(schema_name='public').select_related('statistics')
     context['tenants'] = tenants
     return render(request, template, context)
 
 
+@login_required(login_url='/login/')
+@site_su_required
+def instrumentation_view(request):
+    if request.method == "POST":
+        instrumentation.reset()
+        return redirect('instrumentation')
+    views = instrumentation.summary()
+    if request.GET.get('format') == 'json':
+        response = JsonResponse({'enabled': instrumentation.is_enabled(), 'views': views})
+        response['Content-Disposition'] = 'attachment; filename="instrumentation.json"'
+        return response
+    template = 'authenticated/instrumentation.html'
+    context = {'enabled': instrumentation.is_enabled(), 'views': views}
+    return render(request, template, context)
+
+
 @login_required(login_url='/login/')
 @site_su_required
 def site_backup(request, tenant_id):
-    # TODO, Not working yet
-    from django.contrib.contenttypes.models import ContentType
-    import csv
+    """A zip of one CSV file per table of the school, written to a temporary
+    file table by table and streamed"""
     tenant = get_object_or_404(Client, id=tenant_id)
+    backup = tempfile.TemporaryFile()
     with schema_context(tenant.schema_name):
-        # Backup individual table as excel
-        content_types = ContentType.objects.filter(app_label='sms')
-        for model in content_types:
-            model_objects = model.model_class().objects.all() # eg User.objects.all()
-            if model_objects:
-                fields = []
-                print('================================{}=================='.format(model.model))
-                # get list of fields (columns) for each model (table)
-                # eg for class table will data like below 
-                # ['student', 'subjectassign', 'feetype', 'id', 'name', 'section', 'amount_to_pay', 'subjects']
-                fields = [field.name for field in model_objects.first()._meta.get_fields()]
-                values = [value for value in model_objects.all()]
-                print(values)
-                response = HttpResponse(model_objects , content_type='application/vnd.ms-excel;charset=utf-8')
-                response['Content-Disposition'] = 'attachment; filename="{}.xls"'.format(model.model)
-
-                writer = csv.writer(response, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-                writer.writerow(fields[3:])
-                for data in model_objects:
-                    writer.writerow(values)
-        return response
+        write_backup(backup)
+    backup.seek(0)
+    filename = '{}-backup-{}.zip'.format(tenant.schema_name, timezone.now().strftime('%Y%m%d-%H%M'))
+    return FileResponse(backup, as_attachment=True, filename=filename, content_type='application/zip')
 
 
 @login_required(login_url='/login/')
@@ -261,6 +265,7 @@ def school_change_save(request, tenant_id):
                     domain.tenant = tenant
                     domain.is_primary = True
                     domain.save()
+                invalidate_tenant_cache()
                 messages.success(request, 'Updated Successfully !')
                 return redirect('school_change', tenant_id=tenant_id)
             else:
@@ -295,6 +300,7 @@ def school_del(request):
             if check:
                 client = get_object_or_404(Client, id=school_id)
                 client.delete()
+                invalidate_tenant_cache()
                 tenants = Client.objects.exclude(schema_name='public')
                 context = {"tenants_list": tenants}
                 return render(request, template, context)
@@ -20,6 +20,7 @@ admin.site.register(SubjectAssign)
 admin.site.register(SectionAssign)
 admin.site.register(Grade, GradeAdmin)
 admin.site.register(Attendance)
+admin.site.register(TermAttendance)
 admin.site.register(Notification)
 admin.site.register(FeeType)
 admin.site.register(Payment)
@@ -27,5 +28,8 @@ admin.site.register(Expense)
 admin.site.register(Setting)
 admin.site.register(GradeScale)
 admin.site.register(Sms)
+admin.site.register(SmsDelivery)
 admin.site.register(Ranking)
+admin.site.register(SubjectRanking)
+admin.site.register(ReportJob)
 # Register your models here.
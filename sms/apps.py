@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SmsConfig(AppConfig):
     name = 'sms'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,217 @@
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Sum
+
+from constants import TERM
+from .models import Attendance, Student, TermAttendance
+
+
+MAX_LATE_MINUTES = 9999
+
+
+class AttendanceSheet(object):
+	""" Roll call of a class for a day, as submitted from the attendance
+		table: the students of the sheet, the ones marked present and the
+		ones marked late with the minutes they were late for.
+
+		The sheet is validated as a whole, then saved with a single bulk
+		upsert keyed on (student, session, term, date).
+	"""
+
+	def __init__(self, session, term, date, student_ids, present, late, durations):
+		self.session = session
+		self.term = term
+		self.date = date
+		self.student_ids = list(student_ids)
+		self.present = set(present)
+		self.late = set(late)
+		self.durations = list(durations)
+		self.rows = []
+
+	@classmethod
+	def from_post(cls, session, data):
+		return cls(
+			session=session,
+			term=data.get('selected_term'),
+			date=data.get('selected_date'),
+			student_ids=data.getlist('student_id'),
+			present=data.getlist('status'),
+			late=data.getlist('is_late'),
+			durations=data.getlist('duration'))
+
+	def clean(self):
+		if self.term not in dict(TERM):
+			raise ValidationError('Please select a valid term')
+		try:
+			self.date = datetime.strptime(str(self.date), '%Y-%m-%d').date()
+		except ValueError:
+			raise ValidationError('Please select a valid date')
+		count = len(self.student_ids)
+		if not count:
+			raise ValidationError('There is no attendance to record')
+		if count != len(self.durations):
+			raise ValidationError('The attendance sheet is incomplete, please reload it and try again')
+		try:
+			ids = [int(i) for i in self.student_ids]
+			present = {int(i) for i in self.present}
+			late = {int(i) for i in self.late}
+		except ValueError:
+			raise ValidationError('The attendance sheet contains an invalid student')
+		if len(set(ids)) != count:
+			raise ValidationError('A student appears more than once on the attendance sheet')
+		if not (present | late) <= set(ids):
+			raise ValidationError('The attendance sheet contains an invalid student')
+
+		students = Student.objects.filter(session=self.session).in_bulk(ids)
+		if len(students) != count:
+			raise ValidationError('The attendance sheet contains an invalid student')
+		if len({student.in_class_id for student in students.values()}) != 1:
+			raise ValidationError('The attendance sheet contains students of different classes')
+
+		errors = []
+		self.rows = []
+		for i, student_id in enumerate(ids):
+			student = students[student_id]
+			is_present = student_id in present
+			# a student can only be late when present
+			is_late = is_present and student_id in late
+			minutes = (self.durations[i] or '').strip() or '0'
+			if is_late and (not minutes.isdigit() or int(minutes) > MAX_LATE_MINUTES):
+				errors.append('{}: late duration must be between 0 and {} minutes'.format(
+					student.roll_number, MAX_LATE_MINUTES))
+			self.rows.append((student, is_present, is_late, minutes if is_late else '0'))
+		if errors:
+			raise ValidationError(errors)
+		return self.rows
+
+	@transaction.atomic
+	def save(self):
+		if not self.rows:
+			self.clean()
+		existing = {
+			attendance.student_id: attendance for attendance in Attendance.objects.filter(
+				session=self.session,
+				term=self.term,
+				date=self.date,
+				student__in=[row[0] for row in self.rows])
+		}
+		created, updated = [], []
+		for student, is_present, is_late, minutes in self.rows:
+			obj = existing.get(student.pk)
+			if obj is None:
+				obj = Attendance(
+					student=student,
+					session=self.session,
+					term=self.term,
+					date=self.date)
+				created.append(obj)
+			else:
+				updated.append(obj)
+			obj.is_present = is_present
+			obj.is_late = is_late
+			obj.is_late_for = minutes
+		try:
+			Attendance.objects.bulk_create(created)
+			Attendance.objects.bulk_update(updated, ['is_present', 'is_late', 'is_late_for'])
+			# bulk operations do not send signals, update the bitmaps here
+			update_term_attendance(self.session, self.term, [
+				(student.pk, self.date, is_present, is_late)
+				for student, is_present, is_late, minutes in self.rows])
+		except IntegrityError:
+			raise ValidationError('This attendance was saved by someone else meanwhile, please submit it again')
+		return len(self.rows)
+
+
+BITMAP_FIELDS = ['start', 'recorded', 'present', 'late', 'recorded_days', 'present_days', 'late_days']
+
+
+def update_term_attendance(session, term, marks):
+	""" Record (student id, day, is present, is late) marks in the term bitmaps.
+
+		To be called in a transaction: the rows are locked until it commits so
+		that two sheets saved at the same time do not lose each other's marks.
+	"""
+	session_id = getattr(session, 'pk', session)
+	existing = {
+		summary.student_id: summary for summary in TermAttendance.objects.select_for_update().filter(
+			session=session_id,
+			term=term,
+			student__in={mark[0] for mark in marks}).order_by('pk')
+	}
+	created = {}
+	for student_id, day, is_present, is_late in marks:
+		summary = existing.get(student_id) or created.get(student_id)
+		if summary is None:
+			summary = created[student_id] = TermAttendance(
+				student_id=student_id, session_id=session_id, term=term)
+		summary.mark(day, is_present, bool(is_late))
+	TermAttendance.objects.bulk_create(created.values())
+	TermAttendance.objects.bulk_update(existing.values(), BITMAP_FIELDS)
+
+
+@transaction.atomic
+def rebuild_term_attendance(student, session, term):
+	""" Rebuild the bitmaps of a student from the Attendance rows """
+	summary = TermAttendance.objects.select_for_update().filter(
+		student=student, session=session, term=term).first()
+	rows = list(Attendance.objects.filter(
+		student=student, session=session, term=term).values_list('date', 'is_present', 'is_late'))
+	if not rows:
+		if summary is not None:
+			summary.delete()
+		return None
+	if summary is None:
+		summary = TermAttendance(
+			student_id=getattr(student, 'pk', student),
+			session_id=getattr(session, 'pk', session),
+			term=term)
+	summary.start = None
+	summary.set_bitmaps(0, 0, 0)
+	for day, is_present, is_late in rows:
+		summary.mark(day, is_present, bool(is_late))
+	summary.save()
+	return summary
+
+
+def rebuild_all_term_attendance():
+	""" Rebuild the bitmaps of every student of the current tenant """
+	marks = {}
+	rows = Attendance.objects.values_list(
+		'session_id', 'term', 'student_id', 'date', 'is_present', 'is_late').iterator()
+	for session_id, term, student_id, day, is_present, is_late in rows:
+		marks.setdefault((session_id, term), []).append((student_id, day, is_present, is_late))
+	with transaction.atomic():
+		TermAttendance.objects.all().delete()
+		for (session_id, term), term_marks in marks.items():
+			update_term_attendance(session_id, term, term_marks)
+	return sum(len(term_marks) for term_marks in marks.values())
+
+
+def get_term_attendance(student, session, term):
+	""" Attendance bitmaps of a student for a term, None when never called """
+	return TermAttendance.objects.filter(student=student, session=session, term=term).first()
+
+
+def class_attendance(clss, session, term):
+	""" Attendance totals of a class over a term, from the per-student counters """
+	totals = TermAttendance.objects.filter(
+		student__in_class=clss, session=session, term=term).aggregate(
+		students=Count('id'),
+		recorded_days=Sum('recorded_days'),
+		present_days=Sum('present_days'),
+		late_days=Sum('late_days'))
+	for field in ('recorded_days', 'present_days', 'late_days'):
+		totals[field] = totals[field] or 0
+	totals['present_rate'] = None
+	if totals['recorded_days']:
+		totals['present_rate'] = round(totals['present_days'] * 100.0 / totals['recorded_days'], 2)
+	return totals
+
+
+def class_attendance_by_student(clss, session, term):
+	""" Term attendance of every student of a class, best attendance first """
+	return TermAttendance.objects.filter(
+		student__in_class=clss, session=session, term=term).select_related(
+		'student', 'student__user').order_by('-present_days', 'late_days')
@@ -0,0 +1,22 @@
+from functools import wraps
+
+from django.db import connection
+from django_tenants.utils import schema_context
+
+
+def in_tenant(func):
+	""" Bind ``func`` to the schema of the current connection so that it can
+		be called from another thread (executor callbacks, worker threads).
+
+		The thread's own database connection is closed once ``func`` returns.
+	"""
+	schema_name = connection.schema_name
+
+	@wraps(func)
+	def wrapper(*args, **kwargs):
+		try:
+			with schema_context(schema_name):
+				return func(*args, **kwargs)
+		finally:
+			connection.close()
+	return wrapper
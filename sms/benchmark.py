@@ -0,0 +1,157 @@
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from authentication.models import User
+from bitpoint.instrumentation import percentile, recording
+from constants import FIRST
+from .models import Attendance, Class, Grade, Payment, Student
+from .pdf import invalidate_report_version
+from .school import get_current_session
+from .synthetic import ADMIN_USERNAME, school_days
+
+ENDPOINTS = (
+	'home',
+	'score_entry',
+	'score_entry:save',
+	'save_attendance',
+	'load_score_table',
+	'report_student',
+	'broadsheet_report',
+	'mail',
+)
+
+
+def build_requests(term=FIRST):
+	""" (name, method, path, data, headers) of every endpoint, on the first
+		class and subject of the school
+	"""
+	session = get_current_session()
+	clss = Class.objects.filter(student__session=session).order_by('pk').first()
+	subject = clss.subjects.order_by('pk').first()
+	students = list(Student.objects.filter(in_class=clss, session=session).order_by('pk'))
+	grades = {
+		grade.student_id: grade for grade in Grade.objects.filter(
+			session=session, term=term, subject=subject, student__in=students)
+	}
+	ids = [str(student.pk) for student in students]
+
+	def scores(field):
+		values = [getattr(grades[student.pk], field) if student.pk in grades else None for student in students]
+		return ['' if value is None else str(value) for value in values]
+
+	ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+	return {
+		'home': ('get', reverse('home_page'), {}, {}),
+		'score_entry': ('get', reverse('score_entry'), {
+			'class': clss.pk, 'term': term, 'subject': subject.pk}, {}),
+		'score_entry:save': ('post', reverse('score_entry'), {
+			'term': term,
+			'subject': subject.pk,
+			'student_id': ids,
+			'ca1': scores('fca'),
+			'ca2': scores('sca'),
+			'exam': scores('exam')}, {}),
+		'save_attendance': ('post', reverse('save_attendance'), {
+			'selected_term': term,
+			'selected_date': school_days(0, 1)[0].isoformat(),
+			'student_id': ids,
+			'status': ids[::2],
+			'duration': ['0'] * len(ids)}, {}),
+		'load_score_table': ('get', reverse('ajax_load_load_score_table'), {
+			'class': clss.pk, 'subject_id': subject.pk, 'term': term}, ajax),
+		'report_student': ('post', reverse('report_student'), {
+			'class': clss.pk, 'term': term, 'output': 'pdf'}, {}),
+		'broadsheet_report': ('get', reverse('broadsheet_report'), {
+			'session': session.pk, 'term': term, 'class': clss.pk}, {}),
+		'mail': ('get', reverse('mail'), {}, {}),
+	}
+
+
+def _measure(client, method, path, data, headers):
+	start = time.perf_counter()
+	with recording() as record, connection.execute_wrapper(record):
+		response = getattr(client, method)(path, data, **headers)
+	return response.status_code, time.perf_counter() - start, record
+
+
+def _stats(values):
+	values = sorted(values)
+	return {
+		'min': values[0],
+		'median': percentile(values, 50),
+		'p90': percentile(values, 90),
+		'max': values[-1],
+	}
+
+
+def volume():
+	return {
+		'classes': Class.objects.count(),
+		'students': Student.objects.count(),
+		'grades': Grade.objects.count(),
+		'attendance': Attendance.objects.count(),
+		'payments': Payment.objects.count(),
+	}
+
+
+def run(host, repeat=5, endpoints=ENDPOINTS, sync_pdf=False):
+	""" Time every endpoint repeat times on the school served at host,
+		signed in as the benchmark administrator.
+
+		The first request of an endpoint is reported apart as ``cold``, the
+		report caches are dropped before it. Latencies are in seconds and the
+		result only holds plain values, ready to be saved as JSON.
+	"""
+	client = Client(HTTP_HOST=host)
+	client.force_login(User.objects.get(username=ADMIN_USERNAME))
+	requests = build_requests()
+	results = {}
+	# with sync_pdf the reports are rendered inside the timed request
+	with override_settings(PDF_WORKERS=0 if sync_pdf else settings.PDF_WORKERS):
+		for name in endpoints:
+			method, path, data, headers = requests[name]
+			invalidate_report_version()
+			status, cold_time, cold = _measure(client, method, path, data, headers)
+			times, queries, query_times = [], [], []
+			for i in range(repeat):
+				status, elapsed, record = _measure(client, method, path, data, headers)
+				times.append(elapsed)
+				queries.append(record.queries)
+				query_times.append(record.query_time)
+			results[name] = {
+				'status': status,
+				'cold': {'time': cold_time, 'queries': cold.queries},
+				'time': _stats(times),
+				'queries': _stats(queries),
+				'query_time': _stats(query_times),
+				'repeated_queries': max(record.repeated().values() or [0]),
+			}
+	return {
+		'schema': connection.schema_name,
+		'date': datetime.now().isoformat(),
+		'repeat': repeat,
+		'sync_pdf': sync_pdf,
+		'volume': volume(),
+		'endpoints': results,
+	}
+
+
+def compare(current, previous):
+	""" (endpoint, previous median, current median, change in percent,
+		previous queries, current queries) of the endpoints of both runs
+	"""
+	rows = []
+	for name, result in current['endpoints'].items():
+		before = previous.get('endpoints', {}).get(name)
+		if before is None:
+			continue
+		old, new = before['time']['median'], result['time']['median']
+		change = (new - old) / old * 100 if old else 0
+		rows.append((name, old, new, change, before['queries']['median'], result['queries']['median']))
+	return rows
@@ -0,0 +1,101 @@
+""" Per-tenant values (grade scale, settings, sessions...) kept in the memory
+	of the process.
+
+	Invalidations must reach every worker process, so every key has a version
+	stamp in the shared cache (settings.CACHES): invalidating a key deletes
+	its stamp, and a process holding the value computes it again once it
+	sees that the stamp changed. The stamps are read at most every
+	SMS_CACHE_CHECK_INTERVAL seconds per key and process, so a value is
+	served from memory without any query in between.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+# the timeout only bounds the life of unused entries
+DEFAULT_TIMEOUT = getattr(settings, 'SMS_CACHE_TIMEOUT', 300)
+MAX_ENTRIES = getattr(settings, 'SMS_CACHE_SIZE', 10000)
+
+Entry = namedtuple('Entry', 'stamp checked expires value')
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+
+def tenant_key(*parts):
+	""" Cache key scoped to the schema of the current tenant """
+	return ':'.join(('sms', connection.schema_name) + tuple(str(p) for p in parts))
+
+
+def _stamp_key(key):
+	return '{}:stamp'.format(key)
+
+
+def _check_interval():
+	return getattr(settings, 'SMS_CACHE_CHECK_INTERVAL', 2)
+
+
+def _current_stamp(key):
+	""" The shared stamp of key, a new one when it was invalidated or evicted """
+	stamp = cache.get(_stamp_key(key))
+	if stamp is None:
+		stamp = uuid4().hex
+		if not cache.add(_stamp_key(key), stamp, None):
+			stamp = cache.get(_stamp_key(key), stamp)
+	return stamp
+
+
+def _get(key):
+	with _lock:
+		entry = _entries.get(key)
+		if entry is not None:
+			_entries.move_to_end(key)
+		return entry
+
+
+def _set(key, entry):
+	with _lock:
+		_entries[key] = entry
+		_entries.move_to_end(key)
+		while len(_entries) > MAX_ENTRIES:
+			_entries.popitem(last=False)
+
+
+def tenant_cached(key, compute, timeout=DEFAULT_TIMEOUT):
+	""" Return the tenant cached value of key, computing and storing it on a miss """
+	key = tenant_key(key)
+	now = time.monotonic()
+	entry = _get(key)
+	if entry is not None and now < entry.expires:
+		if now - entry.checked < _check_interval():
+			return entry.value
+		stamp = _current_stamp(key)
+		if stamp == entry.stamp:
+			_set(key, entry._replace(checked=now))
+			return entry.value
+	else:
+		stamp = _current_stamp(key)
+	# the stamp is read before computing, a value computed while another
+	# process invalidates it is computed again at the next check
+	value = compute()
+	_set(key, Entry(stamp, now, now + timeout, value))
+	return value
+
+
+def tenant_invalidate(*keys):
+	keys = [tenant_key(key) for key in keys]
+	with _lock:
+		for key in keys:
+			_entries.pop(key, None)
+	cache.delete_many([_stamp_key(key) for key in keys])
+
+
+def clear_process_cache():
+	""" Forget the values of every tenant held by this process """
+	with _lock:
+		_entries.clear()
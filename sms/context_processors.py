@@ -1,27 +1,52 @@
-import datetime
-from sms.models import Setting, Session, Notification
-from django.core.files.storage import FileSystemStorage
-
-date = datetime.datetime.today()
-session = "{} / {}".format(date.year, date.year + 1)
-
-def add_months(sourcedate, months):
-	import datetime
-	import calendar
-	month = sourcedate.month - 1 + months
-	year = sourcedate.year + month // 12
-	month = month % 12 + 1
-	day = min(sourcedate.day, calendar.monthrange(year,month)[1])
-	return datetime.date(year, month, day)
+from django.utils.functional import cached_property
+
+from sms.models import Notification
+from sms.school import get_current_session, get_school_setting, get_all_sessions
+
+# notifications listed in the navbar, the count still covers all of them
+NOTIFICATION_LIMIT = 10
+
+
+class NotificationFeed(object):
+	""" Notifications of a user as shown in the navbar.
+
+		Nothing is queried until the template uses it: the counts are single
+		COUNT queries and only the latest NOTIFICATION_LIMIT notifications,
+		unread first, are fetched when the list is iterated.
+	"""
+
+	def __init__(self, user, limit=NOTIFICATION_LIMIT):
+		self.queryset = Notification.objects.filter(user=user)
+		self.limit = limit
+
+	@cached_property
+	def unread_count(self):
+		return self.queryset.filter(unread=True).count()
+
+	@cached_property
+	def count(self):
+		return self.queryset.count()
+
+	@cached_property
+	def items(self):
+		return list(self.queryset.order_by('-unread', '-time')[:self.limit])
+
+	def __iter__(self):
+		return iter(self.items)
+
+	def __len__(self):
+		return self.count
+
+	def __bool__(self):
+		return self.count > 0
+
 
 def school_setting_processor(request):
 	if request.META['SMS-CONTEXT-EXIST']:
-		# try getting the current session if exist, otherwise create the current Session
-		try:
-			current_session = Session.objects.get(current_session=True)
-		except Session.DoesNotExist:
-			current_session = Session.objects.create(name=session, current_session=True)
-			current_session.save()
+		# computed once per request, whatever the number of rendered templates
+		if hasattr(request, '_school_context'):
+			return request._school_context
+		current_session = get_current_session()
 
 		# detect the usertype from request
 		if request.user.is_anonymous:
@@ -37,33 +62,15 @@ def school_setting_processor(request):
 
 		notifications = {}
 		if not request.user.is_anonymous:
-			notifications = Notification.objects.filter(user=request.user)
-
-		all_sessions = Session.objects.all()
-		default_logo = 'logo.png'
-		default_name = "Bitpoint Academy"
-
-		try:
-		    school_setting = Setting.objects.first()
-		except Setting.DoesNotExist:
-			school_setting = Setting.objects.create(school_name=default_name,
-				school_logo=default_logo,
-				school_address="Yola, Nigeria",
-				school_slogan="Bringing the future closer the world !",
-				ft_begins=date.today(),
-				ft_ends=add_months(date.today(), 3),
-				st_begins=add_months(date.today(), 4),
-				st_ends=add_months(date.today(), 7),
-				tt_begins=add_months(date.today(), 8),
-				tt_ends=add_months(date.today(), 11)
-				)
-			school_setting.save()
-		return {
-			"school_setting": school_setting,
+			notifications = NotificationFeed(request.user)
+
+		request._school_context = {
+			"school_setting": get_school_setting(),
 			"current_session": current_session,
-			"all_sessions": all_sessions,
+			"all_sessions": get_all_sessions(),
 			"user_type": user_type,
 			"notifications": notifications,
 			}
+		return request._school_context
 	else:
-		return {}
\ No newline at end of file
+		return {}
@@ -0,0 +1,128 @@
+from django.conf import settings
+from django.db.models import Count, F, FloatField, Func, IntegerField, Max, Q, Subquery
+
+from authentication.models import User
+from .cache import tenant_cached
+from .models import Class, Parent, Student, Subject, SubjectAssign
+from .school import get_school_setting
+
+
+# dashboard figures are never invalidated, they are only recomputed
+# once they are DASHBOARD_CACHE_TIMEOUT old
+TIMEOUT = getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 60)
+
+
+def _scalar(queryset, function, field, output_field):
+	""" function(field) over the whole queryset, as a scalar subquery """
+	return Subquery(queryset.order_by().annotate(
+		value=Func(F(field), function=function, output_field=output_field)).values('value'),
+		output_field=output_field)
+
+
+def _school_counts():
+	# a single query, the class and subject figures are scalar subqueries,
+	# Max only lifts these constants into the aggregate
+	counts = User.objects.aggregate(
+		no_parents=Count('pk', filter=Q(is_parent=True)),
+		no_students=Count('pk', filter=Q(is_student=True)),
+		no_teachers=Count('pk', filter=Q(is_teacher=True)),
+		no_classes=Max(_scalar(Class.objects.all(), 'COUNT', 'pk', IntegerField())),
+		no_subjects=Max(_scalar(Subject.objects.all(), 'COUNT', 'pk', IntegerField())),
+		target_income=Max(_scalar(Class.objects.all(), 'SUM', 'amount_to_pay', FloatField())),
+	)
+	counts['target_income'] = int(counts['target_income'] or 0)
+	return counts
+
+
+def school_counts():
+	""" Users by role, classes, subjects and the target income of the school """
+	return tenant_cached('dashboard:school', _school_counts, TIMEOUT)
+
+
+def _class_counts(clss_id, session_id):
+	return Class.objects.filter(pk=clss_id).aggregate(
+		no_students=Count('student', filter=Q(student__session=session_id), distinct=True),
+		no_subjects=Count('subjects', distinct=True),
+	)
+
+
+def student_counts(student):
+	""" Students and subjects of the class of student """
+	return tenant_cached(
+		'dashboard:student:{}:{}'.format(student.in_class_id, student.session_id),
+		lambda: _class_counts(student.in_class_id, student.session_id),
+		TIMEOUT)
+
+
+def _teacher_counts(class_ids, session_id):
+	return Student.objects.filter(in_class__in=class_ids, session=session_id).aggregate(
+		no_students=Count('pk', distinct=True),
+		no_parents=Count('guardians', distinct=True),
+	)
+
+
+def teacher_counts(teacher, assignments, session, term):
+	""" Distinct students of the classes a teacher is assigned to in session
+		and term, and their parents.
+	"""
+	class_ids = sorted({assignment.clss_id for assignment in assignments})
+	return tenant_cached(
+		'dashboard:teacher:{}:{}:{}'.format(teacher.pk, session.pk, term),
+		lambda: _teacher_counts(class_ids, session.pk),
+		TIMEOUT)
+
+
+def admin_dashboard(user, session, term):
+	return dict(school_counts(), sms_unit=get_school_setting().sms_unit, colxl=2)
+
+
+def student_dashboard(user, session, term):
+	student = Student.objects.select_related('user', 'in_class').get(user=user, session=session)
+	context = dict(school_counts())
+	context.update(student_counts(student))
+	context.update({
+		'student': student,
+		'p': student.payment_set.filter(session=session),
+		'subjects': student.in_class.subjects.all(),
+		'colxl': 3,
+	})
+	return context
+
+
+def teacher_dashboard(user, session, term):
+	assignments = list(SubjectAssign.objects.filter(
+		teacher=user, session=session, term=term).select_related('clss').prefetch_related('subjects'))
+	context = {'no_teachers': school_counts()['no_teachers']}
+	context.update(teacher_counts(user, assignments, session, term))
+	context.update({
+		'no_subjects': len(assignments),
+		'allocated_subjects': assignments,
+		'colxl': 3,
+	})
+	return context
+
+
+def parent_dashboard(user, session, term):
+	parent = Parent.objects.get(parent=user)
+	students = list(parent.student.filter(session=session).select_related('user', 'in_class'))
+	context = dict(school_counts())
+	context.update({
+		'no_students': len(students),
+		'no_parents': 1,
+		'students': students,
+		'colxl': 3,
+	})
+	return context
+
+
+def dashboard(user, session, term):
+	""" Context of the home page for the role of user """
+	if user.is_superuser:
+		return admin_dashboard(user, session, term)
+	if user.is_student:
+		return student_dashboard(user, session, term)
+	if user.is_teacher:
+		return teacher_dashboard(user, session, term)
+	if user.is_parent:
+		return parent_dashboard(user, session, term)
+	return {}
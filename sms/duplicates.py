@@ -0,0 +1,98 @@
+""" Merging of the duplicate rows the academic tables could hold before
+	they had unique constraints.
+
+	The functions take the model classes as arguments so that the data
+	migration can run them on its historical models.
+"""
+from django.db.models import Count, Max
+
+from constants import NOT_PAID, PAID, PARTIALLY_PAID
+
+
+def _duplicate_groups(model, fields):
+	""" Values of fields shared by more than one row, with the ids of the rows """
+	groups = model.objects.values(*fields).annotate(count=Count('id')).filter(count__gt=1)
+	for group in groups:
+		del group['count']
+		yield group, list(model.objects.filter(**group).order_by('pk').values_list('pk', flat=True))
+
+
+def keep_latest(model, fields):
+	""" Delete all but the latest row of every group, returns the number of rows deleted """
+	deleted = 0
+	groups = model.objects.values(*fields).annotate(count=Count('id'), latest=Max('id')).filter(count__gt=1)
+	for group in groups:
+		latest = group.pop('latest')
+		del group['count']
+		deleted += model.objects.filter(**group).exclude(pk=latest).delete()[1].get(model._meta.label, 0)
+	return deleted
+
+
+def merge_grades(Grade):
+	""" The latest score sheet of a subject wins """
+	return keep_latest(Grade, ['session', 'term', 'student', 'subject'])
+
+
+def merge_payments(Payment):
+	""" Payments of a student for a term are added up into the latest one,
+		the amount to pay being the largest paid + due amount of the group.
+	"""
+	merged = 0
+	for group, ids in _duplicate_groups(Payment, ['student', 'session', 'term']):
+		payments = list(Payment.objects.filter(pk__in=ids).order_by('pk'))
+		fee = max(p.paid_amount + p.due_amount for p in payments)
+		payment = payments[-1]
+		payment.paid_amount = sum(p.paid_amount for p in payments)
+		payment.due_amount = max(fee - payment.paid_amount, 0)
+		if not payment.paid_amount:
+			payment.payment_status = NOT_PAID
+		elif payment.due_amount:
+			payment.payment_status = PARTIALLY_PAID
+		else:
+			payment.payment_status = PAID
+		payment.teller_number = payment.teller_number or next(
+			(p.teller_number for p in reversed(payments) if p.teller_number), None)
+		payment.save()
+		Payment.objects.filter(pk__in=ids[:-1]).delete()
+		merged += len(ids) - 1
+	return merged
+
+
+def merge_rankings(Ranking, SubjectRanking):
+	""" Rankings are recomputed from the grades, any copy can go """
+	return (keep_latest(Ranking, ['session', 'term', 'student'])
+		+ keep_latest(SubjectRanking, ['session', 'term', 'student', 'subject']))
+
+
+def merge_subject_assignments(SubjectAssign):
+	""" Assignments of a teacher to the same class and term are merged into
+		the first one, which gets the subjects of the others.
+	"""
+	merged = 0
+	for group, ids in _duplicate_groups(SubjectAssign, ['session', 'term', 'clss', 'teacher']):
+		first = SubjectAssign.objects.get(pk=ids[0])
+		subjects = SubjectAssign.subjects.through.objects.filter(
+			subjectassign_id__in=ids[1:]).values_list('subject_id', flat=True)
+		first.subjects.add(*set(subjects))
+		SubjectAssign.objects.filter(pk__in=ids[1:]).delete()
+		merged += len(ids) - 1
+	return merged
+
+
+def merge_attendance(Attendance):
+	""" The latest roll call of a day wins """
+	return keep_latest(Attendance, ['session', 'term', 'student', 'date'])
+
+
+def merge_all(apps):
+	""" {table: rows merged} for every academic table, apps being the app
+		registry (django.apps.apps or the one of a migration)
+	"""
+	model = lambda name: apps.get_model('sms', name)
+	return {
+		'grade': merge_grades(model('Grade')),
+		'attendance': merge_attendance(model('Attendance')),
+		'payment': merge_payments(model('Payment')),
+		'ranking': merge_rankings(model('Ranking'), model('SubjectRanking')),
+		'subject assignment': merge_subject_assignments(model('SubjectAssign')),
+	}
@@ -0,0 +1,205 @@
+""" Spreadsheet exports of grades, broadsheets, payments and attendance.
+
+	Every export is a generator of rows, the header first, reading the
+	database through a server-side cursor EXPORT_CHUNK_SIZE rows at a time,
+	so that the memory used does not grow with the size of the school. CSV
+	is streamed to the client as it is produced, XLSX (with openpyxl, an
+	optional dependency) is written in write-only mode to a temporary file
+	which is then streamed.
+"""
+import csv
+import io
+import tempfile
+import zipfile
+from itertools import groupby
+
+from django.apps import apps
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone as tz
+
+from .models import Attendance, Grade, Payment
+from .ranking import class_ranking
+
+try:
+	import openpyxl
+except ImportError:
+	openpyxl = None
+
+CSV = 'csv'
+XLSX = 'xlsx'
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+STUDENT_FIELDS = (
+	'student__roll_number',
+	'student__user__first_name',
+	'student__user__last_name',
+	'student__user__other_name',
+)
+
+
+def formats():
+	""" The export formats available on this installation """
+	return (CSV, XLSX) if openpyxl is not None else (CSV,)
+
+
+def _chunk_size():
+	return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def _name(first_name, last_name, other_name):
+	return ' '.join(name for name in (first_name, last_name, other_name) if name)
+
+
+def _score(value):
+	return '' if value is None else value
+
+
+def score_sheet_rows(clss, session, term, subject):
+	""" Scores of a subject for the students of a class """
+	yield ('Roll number', 'Name', 'CA 1', 'CA 2', 'Exam', 'Total', 'Grade', 'Remark')
+	grades = Grade.objects.filter(
+		session=session,
+		term=term,
+		subject=subject,
+		student__in_class=clss).order_by('student__roll_number', 'student').values_list(
+		*STUDENT_FIELDS + ('fca', 'sca', 'exam', 'total', 'grade', 'remark'))
+	for roll_number, first_name, last_name, other_name, fca, sca, exam, total, grade, remark in grades.iterator(
+			chunk_size=_chunk_size()):
+		yield (roll_number, _name(first_name, last_name, other_name), _score(fca), _score(sca),
+			_score(exam), _score(total), grade or '', remark or '')
+
+
+def broadsheet_rows(clss, session, term):
+	""" Totals of every subject of a class, one row per graded student with
+		the overall total, average and class position.
+
+		The subjects and positions are read when it is called, before the
+		rows are streamed: one small row per student ranked by the database,
+		the rankings tables are not written to.
+	"""
+	subjects = list(clss.subjects.order_by('pk'))
+	positions = {row['student']: row['position'] for row in class_ranking(clss, session, term)}
+	return _broadsheet_rows(clss, session, term, subjects, positions)
+
+
+def _broadsheet_rows(clss, session, term, subjects, positions):
+	yield ('Roll number', 'Name') + tuple(subject.name for subject in subjects) + (
+		'Total', 'Average', 'Subjects', 'Position')
+	grades = Grade.objects.filter(
+		session=session,
+		term=term,
+		student__in_class=clss).order_by('student__roll_number', 'student').values_list(
+		'student', *STUDENT_FIELDS + ('subject', 'total'))
+	rows = grades.iterator(chunk_size=_chunk_size())
+	for student_id, student_grades in groupby(rows, key=lambda row: row[0]):
+		student_grades = list(student_grades)
+		student_id, roll_number, first_name, last_name, other_name = student_grades[0][:5]
+		scores = {subject_id: total or 0 for subject_id, total in (row[5:] for row in student_grades)}
+		overall = sum(scores.values())
+		yield (roll_number, _name(first_name, last_name, other_name)) + tuple(
+			scores.get(subject.pk, '') for subject in subjects) + (
+			overall,
+			round(overall / float(len(subjects)), 2) if subjects else '',
+			len(scores),
+			positions.get(student_id, ''))
+
+
+def _local(value):
+	""" A datetime without time zone in local time, as spreadsheets expect """
+	if value is None:
+		return value
+	if tz.is_aware(value):
+		value = tz.make_naive(value)
+	return value.replace(microsecond=0)
+
+
+def payment_rows(session, term=None):
+	""" Payments of a session, or of one of its terms, in the order they were made """
+	yield ('Date', 'Roll number', 'Name', 'Class', 'Term', 'Paid', 'Due', 'Method', 'Status', 'Teller number')
+	payments = Payment.objects.filter(session=session)
+	if term:
+		payments = payments.filter(term=term)
+	payments = payments.order_by('date_paid', 'pk').values_list(
+		'date_paid', *STUDENT_FIELDS + ('student__in_class__name', 'term', 'paid_amount', 'due_amount',
+		'payment_method', 'payment_status', 'teller_number'))
+	for row in payments.iterator(chunk_size=_chunk_size()):
+		date_paid, roll_number, first_name, last_name, other_name = row[:5]
+		yield (_local(date_paid), roll_number, _name(first_name, last_name, other_name)) + tuple(
+			_score(value) for value in row[5:])
+
+
+def attendance_rows(clss, session, term):
+	""" Attendance register of a class over a term, one row per student and day """
+	yield ('Date', 'Roll number', 'Name', 'Status', 'Late', 'Late for')
+	marks = Attendance.objects.filter(
+		session=session,
+		term=term,
+		student__in_class=clss).order_by('date', 'student__roll_number', 'student').values_list(
+		'date', *STUDENT_FIELDS + ('is_present', 'is_late', 'is_late_for'))
+	for date, roll_number, first_name, last_name, other_name, is_present, is_late, is_late_for in marks.iterator(
+			chunk_size=_chunk_size()):
+		yield (date, roll_number, _name(first_name, last_name, other_name),
+			'Present' if is_present else 'Absent',
+			'Yes' if is_late else '',
+			is_late_for if is_late else '')
+
+
+class Echo(object):
+	""" Pseudo file of csv.writer, writerow returns the line instead of buffering it """
+
+	def write(self, value):
+		return value
+
+
+def csv_response(rows, filename):
+	writer = csv.writer(Echo())
+	response = StreamingHttpResponse(
+		(writer.writerow(row) for row in rows), content_type='text/csv; charset=utf-8')
+	response['Content-Disposition'] = 'attachment; filename="{}.csv"'.format(filename)
+	return response
+
+
+def xlsx_response(rows, filename):
+	""" The rows written in write-only mode to a temporary file, which the
+		response streams and closes
+	"""
+	workbook = openpyxl.Workbook(write_only=True)
+	sheet = workbook.create_sheet(title=filename[:31])
+	for row in rows:
+		sheet.append(row)
+	output = tempfile.TemporaryFile()
+	workbook.save(output)
+	output.seek(0)
+	return FileResponse(
+		output, as_attachment=True, filename='{}.xlsx'.format(filename), content_type=XLSX_CONTENT_TYPE)
+
+
+def export_response(rows, filename, output=CSV):
+	if output == XLSX:
+		return xlsx_response(rows, filename)
+	return csv_response(rows, filename)
+
+
+def table_rows(model):
+	""" Every row of a table, the column names first """
+	columns = [field.attname for field in model._meta.concrete_fields]
+	yield columns
+	for row in model._base_manager.order_by('pk').values_list(*columns).iterator(chunk_size=_chunk_size()):
+		yield row
+
+
+def write_backup(fileobj, app_label='sms'):
+	""" A zip archive of one CSV file per table of the app written to fileobj,
+		many-to-many tables included, to be run in the schema of the school
+	"""
+	with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
+		for model in apps.get_app_config(app_label).get_models(include_auto_created=True):
+			with archive.open('{}.csv'.format(model._meta.db_table), 'w') as member:
+				output = io.TextIOWrapper(member, encoding='utf-8', newline='')
+				writer = csv.writer(output)
+				for row in table_rows(model):
+					writer.writerow(row)
+				output.flush()
+				output.detach()
+	return fileobj
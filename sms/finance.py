@@ -0,0 +1,81 @@
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+from constants import TERM
+from .cache import tenant_cached, tenant_invalidate
+from .models import Expense, Payment
+
+FINANCE = 'finance'
+
+
+def _monthly_totals(queryset, date_field, amount_field):
+	""" {(session_id, term, year, month): total} computed by a single grouped query,
+		months are taken in the current time zone.
+	"""
+	rows = queryset.order_by().annotate(month=TruncMonth(date_field)).values(
+		'session', 'term', 'month').annotate(total=Sum(amount_field))
+	return {
+		(row['session'], row['term'], row['month'].year, row['month'].month): row['total'] or 0
+		for row in rows
+	}
+
+
+class Ledger(object):
+	""" Monthly income (payments) and expenditure (expenses) of the school,
+		for every session and term. Loaded with one query per model and
+		cached per tenant until a payment or an expense changes.
+	"""
+
+	def __init__(self, income, expenditure):
+		self.income = income
+		self.expenditure = expenditure
+
+	@classmethod
+	def load(cls):
+		return cls(
+			income=_monthly_totals(Payment.objects.all(), 'date_paid', 'paid_amount'),
+			expenditure=_monthly_totals(Expense.objects.all(), 'timestamp', 'amount'))
+
+	def _select(self, totals, session_id, term=None):
+		for (session, month_term, year, month), total in totals.items():
+			if session == session_id and (term is None or month_term == term):
+				yield month_term, year, month, total
+
+	def monthly(self, session_id, term=None):
+		""" Income and expenditure by calendar month (January first) of a
+			session, or of one of its terms.
+		"""
+		series = {'income': [0] * 12, 'expenditure': [0] * 12}
+		for name in series:
+			for month_term, year, month, total in self._select(getattr(self, name), session_id, term):
+				series[name][month - 1] += total
+		return series
+
+	def totals(self, session_id, term=None):
+		income = sum(row[-1] for row in self._select(self.income, session_id, term))
+		expenditure = sum(row[-1] for row in self._select(self.expenditure, session_id, term))
+		return {'income': income, 'expenditure': expenditure, 'balance': income - expenditure}
+
+	def by_term(self, session_id):
+		""" Totals of every term of a session """
+		return [dict(self.totals(session_id, term), term=term) for term, label in TERM]
+
+	def trend(self, sessions):
+		""" Totals, per term totals and monthly series of several sessions,
+			in the given order, to compare them.
+		"""
+		return [
+			dict(self.totals(session.pk),
+				session=session.name,
+				terms=self.by_term(session.pk),
+				monthly=self.monthly(session.pk))
+			for session in sessions
+		]
+
+
+def get_ledger():
+	return tenant_cached(FINANCE, Ledger.load)
+
+
+def invalidate_finance():
+	tenant_invalidate(FINANCE)
@@ -0,0 +1,140 @@
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from constants import MAX_CA_SCORE, MAX_EXAM_SCORE, TERM
+from .models import Grade, Student, Subject
+from .pdf import invalidate_report_version
+from .ranking import refresh_rankings
+from .remark import get_scale_table, lookup
+
+
+class ScoreSheet(object):
+	""" Scores of a subject for a whole class, as submitted from the score
+		entry table (one ca1/ca2/exam triple per student id).
+
+		The sheet is validated as a whole, then saved with a single bulk
+		upsert and the rankings of the affected class are refreshed once.
+	"""
+
+	def __init__(self, session, term, subject, student_ids, ca1, ca2, exam):
+		self.session = session
+		self.term = term
+		self.subject = subject
+		self.student_ids = list(student_ids)
+		self.ca1 = list(ca1)
+		self.ca2 = list(ca2)
+		self.exam = list(exam)
+		self.rows = []
+
+	@classmethod
+	def from_post(cls, session, subject, data):
+		return cls(
+			session=session,
+			term=data.get('term'),
+			subject=subject,
+			student_ids=data.getlist('student_id'),
+			ca1=data.getlist('ca1'),
+			ca2=data.getlist('ca2'),
+			exam=data.getlist('exam'))
+
+	def _score(self, value, maximum, label, student, errors):
+		""" (stored score, score counted in the total), a blank score is stored as NULL """
+		value = (value or '').strip()
+		if not value:
+			return None, 0
+		try:
+			score = int(value)
+		except ValueError:
+			errors.append('{}: {} must be a whole number'.format(student.roll_number, label))
+			return None, 0
+		if score < 0 or score > maximum:
+			errors.append('{}: {} must be between 0 and {}'.format(student.roll_number, label, maximum))
+		return score, score
+
+	def clean(self):
+		if self.term not in dict(TERM):
+			raise ValidationError('Please select a valid term')
+		count = len(self.student_ids)
+		if not count:
+			raise ValidationError('There is no score to record')
+		if not (count == len(self.ca1) == len(self.ca2) == len(self.exam)):
+			raise ValidationError('The score sheet is incomplete, please reload it and try again')
+		try:
+			ids = [int(i) for i in self.student_ids]
+		except ValueError:
+			raise ValidationError('The score sheet contains an invalid student')
+		if len(set(ids)) != count:
+			raise ValidationError('A student appears more than once on the score sheet')
+
+		students = Student.objects.filter(session=self.session).in_bulk(ids)
+		if len(students) != count:
+			raise ValidationError('The score sheet contains an invalid student')
+		class_ids = {student.in_class_id for student in students.values()}
+		if len(class_ids) != 1:
+			raise ValidationError('The score sheet contains students of different classes')
+		clss_id = class_ids.pop()
+		# a subject of the class, or one assigned to a teacher of the class this session
+		offered = Subject.objects.filter(
+			Q(**{'class': clss_id}) | Q(subjectassign__clss=clss_id, subjectassign__session=self.session),
+			pk=self.subject.pk).exists()
+		if not offered:
+			raise ValidationError('{} is not a subject of this class'.format(self.subject))
+
+		errors = []
+		self.rows = []
+		for i, student_id in enumerate(ids):
+			student = students[student_id]
+			fca, fca_score = self._score(self.ca1[i], MAX_CA_SCORE, 'CA 1', student, errors)
+			sca, sca_score = self._score(self.ca2[i], MAX_CA_SCORE, 'CA 2', student, errors)
+			exam, exam_score = self._score(self.exam[i], MAX_EXAM_SCORE, 'Exam', student, errors)
+			self.rows.append((student, fca, sca, exam, fca_score + sca_score + exam_score))
+		if errors:
+			raise ValidationError(errors)
+		return self.rows
+
+	@transaction.atomic
+	def save(self):
+		if not self.rows:
+			self.clean()
+		existing = {
+			grade.student_id: grade for grade in Grade.objects.filter(
+				session=self.session,
+				term=self.term,
+				subject=self.subject,
+				student__in=[row[0] for row in self.rows])
+		}
+		created, updated = [], []
+		table = get_scale_table()
+		for student, fca, sca, exam, total in self.rows:
+			grade, remark = lookup(total, table)
+			obj = existing.get(student.pk)
+			if obj is None:
+				obj = Grade(
+					session=self.session,
+					term=self.term,
+					subject=self.subject,
+					student=student)
+				created.append(obj)
+			else:
+				updated.append(obj)
+			obj.fca = fca
+			obj.sca = sca
+			obj.exam = exam
+			# the database trigger computes the same total, it is set here for
+			# the grade lookup and the rankings refreshed below
+			obj.total = total
+			obj.grade = grade
+			obj.remark = remark
+		try:
+			Grade.objects.bulk_create(created)
+		except IntegrityError:
+			raise ValidationError('These scores were saved by someone else meanwhile, please submit them again')
+		Grade.objects.bulk_update(updated, ['fca', 'sca', 'exam', 'total', 'grade', 'remark'])
+
+		# bulk operations do not send signals, rank the affected classes
+		# and expire the cached reports here
+		for clss_id in {row[0].in_class_id for row in self.rows}:
+			refresh_rankings(clss_id, self.session, self.term)
+		transaction.on_commit(invalidate_report_version)
+		return len(self.rows)
@@ -0,0 +1,144 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage as EMessage, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone as tz
+
+from constants import DELIVERED, FAILED, PENDING, SENDING
+from .background import in_tenant
+from .mailmerge import MailMerge, MergeTemplate
+from .models import EmailMessage
+from .school import get_academic_context, get_school_setting
+
+
+LOGGER = logging.getLogger(__name__)
+
+# a single worker per process, the rate limit applies to it
+_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def mail_content(mail, setting):
+	return render_to_string('email_template.html', {'setting': setting, 'mail': mail})
+
+
+def _send_message(connection, message):
+	""" Send one message over the open connection, reconnecting between attempts.
+		Returns None once it is sent, the last error otherwise.
+
+		Messages are retried one by one, so that a failure in the middle of
+		a batch never sends the messages before it twice.
+	"""
+	error = None
+	for attempt in range(settings.MAIL_MAX_ATTEMPTS):
+		if attempt:
+			time.sleep(settings.MAIL_RETRY_BACKOFF * 2 ** (attempt - 1))
+		try:
+			connection.open()
+			if connection.send_messages([message]):
+				return None
+			# refused without an error (e.g. no valid recipient), retrying will not help
+			return ValueError('The message to {} was not sent'.format(', '.join(message.to)))
+		except Exception as e:
+			LOGGER.warning('Sending a mail message failed (attempt %s): %s', attempt + 1, e)
+			error = e
+			connection.close()
+	return error
+
+
+def send_mail(mail):
+	""" Send the personalized messages of a mail that was claimed for sending.
+
+		Messages go in batches of MAIL_BATCH_SIZE over one backend connection,
+		at most MAIL_RATE_LIMIT messages per second. The counters are saved
+		after every message so that an interrupted mail resumes where it
+		stopped, see resume_stalled.
+	"""
+	current_session, term = get_academic_context()
+	setting = get_school_setting()
+	audience = [user for user in mail.recipients.order_by('pk') if user.email]
+	audience = audience[mail.sent + mail.failed:]
+	merge = MailMerge(audience, current_session, term, setting)
+	template = MergeTemplate(mail_content(mail, setting))
+
+	connection = get_connection()
+	error = None
+	size = settings.MAIL_BATCH_SIZE
+	try:
+		for i in range(0, len(audience), size):
+			started = time.monotonic()
+			batch = audience[i:i + size]
+			for user in batch:
+				msg = EMessage(mail.title, merge.render(template, user), settings.DEFAULT_FROM_EMAIL, [user.email])
+				msg.content_subtype = 'html'
+				message_error = _send_message(connection, msg)
+				if message_error is None:
+					mail.sent += 1
+				else:
+					mail.failed += 1
+					error = message_error
+				EmailMessage.objects.filter(pk=mail.pk).update(
+					sent=mail.sent, failed=mail.failed, progress_on=tz.now())
+
+			wait = len(batch) / float(settings.MAIL_RATE_LIMIT) - (time.monotonic() - started)
+			if wait > 0 and i + size < len(audience):
+				time.sleep(wait)
+	finally:
+		connection.close()
+
+	mail.status = FAILED if mail.failed else DELIVERED
+	mail.error = str(error) if mail.failed and error else None
+	EmailMessage.objects.filter(pk=mail.pk).update(status=mail.status, error=mail.error)
+	return mail.sent
+
+
+def claim(mail, status=PENDING, stalled_before=None):
+	""" Mark a mail as being sent, False when another worker already did.
+
+		A mail already sending is only claimed when its worker made no
+		progress since stalled_before, i.e. it was interrupted.
+	"""
+	mails = EmailMessage.objects.filter(pk=mail.pk, status=status)
+	if status == SENDING:
+		mails = mails.filter(Q(progress_on__lt=stalled_before) | Q(progress_on=None))
+	return mails.update(status=SENDING, progress_on=tz.now()) == 1
+
+
+def resume_stalled(minutes=10):
+	""" Send the rest of the mails whose worker stopped (e.g. the process was
+		restarted) without progress for minutes, returns the messages sent
+	"""
+	stalled_before = tz.now() - timedelta(minutes=minutes)
+	count = 0
+	for mail in EmailMessage.objects.filter(status=SENDING).order_by('pk'):
+		if claim(mail, SENDING, stalled_before):
+			mail.refresh_from_db()
+			already_sent = mail.sent
+			count += send_mail(mail) - already_sent
+	return count
+
+
+def _worker(mail_id):
+	mail = EmailMessage.objects.get(pk=mail_id)
+	try:
+		send_mail(mail)
+	except Exception as e:
+		LOGGER.exception('Sending mail %s failed', mail_id)
+		EmailMessage.objects.filter(pk=mail_id).update(status=FAILED, error=str(e))
+
+
+def queue_mail(mail):
+	""" Send a mail in the background once the transaction commits,
+		with MAIL_BACKGROUND = False it is sent right away in the request.
+	"""
+	if not claim(mail):
+		return
+	if not settings.MAIL_BACKGROUND:
+		_worker(mail.pk)
+		return
+	transaction.on_commit(lambda: _executor.submit(in_tenant(_worker), mail.pk))
@@ -0,0 +1,187 @@
+import re
+from datetime import date
+
+from django.db.models import Prefetch, Sum
+from django.utils.html import escape
+
+from .models import (Attendance, Expense, Grade, Parent, Payment, Student,
+	SubjectAssign)
+
+
+FIELD_RE = re.compile(r'==(\w+)==')
+
+
+class MergeTemplate(object):
+	""" Mail content with ``==field==`` placeholders, parsed once and rendered
+		for every recipient. Unknown or missing fields render empty.
+	"""
+
+	def __init__(self, content):
+		# literal, field, literal, field, ..., literal
+		self.parts = FIELD_RE.split(content)
+
+	@property
+	def fields(self):
+		return set(self.parts[1::2])
+
+	def render(self, values):
+		output = []
+		for i, part in enumerate(self.parts):
+			output.append(values.get(part, '') if i % 2 else part)
+		return ''.join(output)
+
+
+def _subjects_html(subjects, header='<p>Subject(s)</p>', color='green'):
+	items = ''.join(
+		'<li style="color: {}">{}</li>'.format(color, escape(subject)) for subject in subjects)
+	return '{}<ol>{}</ol>'.format(header, items)
+
+
+def _grades_html(grades, header):
+	items = ''.join(
+		'<li style="color: green"><span>{}</span> '
+		'<span id="grade" style="margin-left: 35vw;">{}</span></li>'.format(
+			escape(grade.subject), escape(grade.grade) if grade.grade else '<small><i>Nill</i></small>')
+		for grade in grades)
+	return '{}<ol>{}</ol>'.format(header, items)
+
+
+class MailMerge(object):
+	""" Merge field values of a whole audience for a session and term.
+
+		Students (with their class, section and subjects), parents' children,
+		payments, grades, today's attendance and subject allocations are
+		fetched once for every recipient, in a fixed number of queries.
+	"""
+
+	def __init__(self, audience, session, term, setting, today=None):
+		self.audience = list(audience)
+		self.session = session
+		self.term = term
+		self.setting = setting
+		self.today = today or date.today()
+		self.total_expenditure = Expense.objects.aggregate(Sum('amount'))['amount__sum']
+
+		students = Student.objects.filter(session=session).select_related(
+			'user', 'in_class', 'in_class__section').prefetch_related('in_class__subjects')
+
+		self.students = {
+			student.user_id: student for student in students.filter(
+				user__in=[user.pk for user in self.audience if user.is_student])
+		}
+		self.children = {}
+		parents = Parent.objects.filter(
+			parent__in=[user.pk for user in self.audience if user.is_parent]).prefetch_related(
+			Prefetch('student', queryset=students))
+		for parent in parents:
+			self.children.setdefault(parent.parent_id, []).extend(parent.student.all())
+
+		student_ids = [student.pk for student in self.students.values()]
+		student_ids += [child.pk for children in self.children.values() for child in children]
+
+		self.payments = {}
+		for payment in Payment.objects.filter(
+				student__in=student_ids, session=session, term=term).order_by('-pk'):
+			# the first payment of a student, as Payment.objects.filter(...).first() did
+			self.payments[payment.student_id] = payment
+
+		self.grades = {}
+		for grade in Grade.objects.filter(
+				student__in=student_ids, session=session, term=term).select_related('subject'):
+			self.grades.setdefault(grade.student_id, []).append(grade)
+
+		self.present = dict(Attendance.objects.filter(
+			student__in=student_ids, session=session, term=term,
+			date=self.today).values_list('student_id', 'is_present'))
+
+		self.allocations = {}
+		assignments = SubjectAssign.objects.filter(
+			session=session,
+			term=term,
+			teacher__in=[user.pk for user in self.audience if user.is_teacher]).select_related(
+			'clss').prefetch_related('subjects')
+		for assignment in assignments:
+			self.allocations.setdefault(assignment.teacher_id, []).append(assignment)
+
+	def user_values(self, user):
+		values = {
+			'fullname': user.get_full_name(),
+			'fname': user.first_name,
+			'sname': user.last_name,
+			'oname': user.other_name,
+			'gender': user.gender,
+			'lga': user.lga,
+			'session': self.session,
+			'state': user.state,
+			'address': user.address,
+			'expnse': self.total_expenditure,
+			'scname': self.setting.school_name,
+		}
+		return {field: escape('' if value is None else value) for field, value in values.items()}
+
+	def student_values(self, student):
+		payment = self.payments.get(student.pk)
+		return {
+			'clss': escape(student.in_class.name),
+			'section': escape(student.in_class.section.name),
+			'clssub': _subjects_html(student.in_class.subjects.all()),
+			'grades': _grades_html(
+				self.grades.get(student.pk, ()),
+				'<p><span>Subject</span> <span id="grade" style="margin-left: 35vw;">Grade</span></p>'),
+			'amount': str(payment.paid_amount) if payment else '<i>Not paid</i>',
+			'damnt': str(payment.due_amount) if payment else '<i>No outstanding fee</i>',
+			'tno': (payment.teller_number or '') if payment else '',
+			'attnd': 'Present' if self.present.get(student.pk) else 'Absent',
+		}
+
+	def child_values(self, child):
+		name = escape(child.user.first_name)
+		payment = self.payments.get(child.pk)
+		if payment:
+			paid = '{} has paid {} Naira'.format(name, payment.paid_amount)
+			due = '{}\'s due amount is {} Naira'.format(name, payment.due_amount)
+		else:
+			paid = due = '{} <i>Not paid</i>'.format(name)
+		if self.present.get(child.pk):
+			attendance = '{} is <b>Present</b> today <small>({})</small>'.format(name, self.today)
+		else:
+			attendance = '{} is Absent today <small>({})</small>'.format(name, self.today)
+		return {
+			'clssub': _subjects_html(
+				child.in_class.subjects.all(), '{}\'s <p>Subjects</p>'.format(name)),
+			'grades': _grades_html(
+				self.grades.get(child.pk, ()),
+				'<p>{}\'s results</p><span>Subject</span> '
+				'<span id="grade" style="margin-left: 35vw;">Grade</span></p>'.format(name)),
+			'amount': paid,
+			'attnd': attendance,
+			'damnt': due,
+			'tno': (payment.teller_number or '') if payment else '',
+		}
+
+	def values(self, user):
+		""" Merge field values of a recipient """
+		values = self.user_values(user)
+		if user.is_student and user.pk in self.students:
+			values.update(self.student_values(self.students[user.pk]))
+		if user.is_teacher:
+			subjects = [
+				'{} ({})'.format(subject, assignment.clss)
+				for assignment in self.allocations.get(user.pk, ())
+				for subject in assignment.subjects.all()
+			]
+			values['allsub'] = _subjects_html(subjects, color='#85144b')
+		if user.is_parent:
+			# one block per child, joined together
+			merged = {}
+			for child in self.children.get(user.pk, ()):
+				for field, value in self.child_values(child).items():
+					merged.setdefault(field, []).append(value)
+			values.update({
+				field: '<br>'.join(value for value in items if value)
+				for field, items in merged.items()
+			})
+		return values
+
+	def render(self, template, user):
+		return template.render(self.values(user))
@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from sms.benchmark import ENDPOINTS, compare, run
+
+
+class Command(BaseCommand):
+	help = ('Time the busiest views on a school created by create_benchmark_school, '
+		'run it with: manage.py tenant_command benchmark --schema=<schema>')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--repeat', type=int, default=5, help='Timed requests per endpoint')
+		parser.add_argument('--endpoint', action='append', choices=ENDPOINTS,
+			help='Endpoint to time, all of them by default')
+		parser.add_argument('--sync-pdf', action='store_true',
+			help='Render the PDF reports inside the request (PDF_WORKERS = 0)')
+		parser.add_argument('--output', help='Save the results to this JSON file')
+		parser.add_argument('--compare', help='JSON file of a previous run to compare with')
+
+	def handle(self, *args, **options):
+		domain = connection.tenant.domains.order_by('-is_primary').first()
+		if domain is None:
+			raise CommandError('The school has no domain')
+		results = run(
+			domain.domain.split(':')[0],
+			repeat=options['repeat'],
+			endpoints=options['endpoint'] or ENDPOINTS,
+			sync_pdf=options['sync_pdf'])
+
+		for name, result in results['endpoints'].items():
+			self.stdout.write('{:<20} {:>4} median {:8.4f}s  p90 {:8.4f}s  cold {:8.4f}s  {:>5} queries'.format(
+				name, result['status'], result['time']['median'], result['time']['p90'],
+				result['cold']['time'], result['queries']['median']))
+
+		if options['compare']:
+			with open(options['compare']) as f:
+				previous = json.load(f)
+			self.stdout.write('\nchange of the median time (queries) since {}'.format(previous.get('date')))
+			for name, old, new, change, old_queries, new_queries in compare(results, previous):
+				self.stdout.write('{:<20} {:8.4f}s -> {:8.4f}s {:+7.1f}%  ({} -> {})'.format(
+					name, old, new, change, old_queries, new_queries))
+
+		if options['output']:
+			with open(options['output'], 'w') as f:
+				json.dump(results, f, indent=2, sort_keys=True)
+			self.stdout.write(self.style.SUCCESS('Results saved to {}'.format(options['output'])))
@@ -0,0 +1,17 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from sms.duplicates import merge_all
+
+
+class Command(BaseCommand):
+	help = ('Merge the duplicate grades, attendance, payments, rankings and subject '
+		'assignments, run it per school with tenant_command or all_tenants_command')
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			merged = merge_all(apps)
+		for table, count in merged.items():
+			self.stdout.write('{}: {} duplicate rows merged'.format(table, count))
+		self.stdout.write(self.style.SUCCESS('{} rows merged'.format(sum(merged.values()))))
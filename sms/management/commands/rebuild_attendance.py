@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from sms.attendance import rebuild_all_term_attendance
+
+
+class Command(BaseCommand):
+	help = ('Rebuild the term attendance bitmaps from the attendance records, '
+		'run it per school with tenant_command or all_tenants_command')
+
+	def handle(self, *args, **options):
+		count = rebuild_all_term_attendance()
+		self.stdout.write(self.style.SUCCESS('{} attendance records processed'.format(count)))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from constants import PENDING
+from sms.mailer import claim, resume_stalled, send_mail
+from sms.models import EmailMessage
+
+
+class Command(BaseCommand):
+	help = ('Send the pending mails, run it per school with tenant_command '
+		'or all_tenants_command')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--resume', action='store_true',
+			help='Also resume the mails left sending by a worker that stopped')
+		parser.add_argument('--stalled-after', type=int, default=10,
+			help='Minutes without progress after which a mail being sent is resumed')
+
+	def handle(self, *args, **options):
+		count = 0
+		if options['resume']:
+			count += resume_stalled(options['stalled_after'])
+		for mail in EmailMessage.objects.filter(status=PENDING).order_by('pk'):
+			if claim(mail):
+				count += send_mail(mail)
+		self.stdout.write(self.style.SUCCESS('{} messages sent'.format(count)))
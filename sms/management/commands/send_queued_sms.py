@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from sms.sms_sender import process_queue, reset_stalled
+
+
+class Command(BaseCommand):
+	help = ('Send the queued text messages that are due, including retries, '
+		'run it per school with tenant_command or all_tenants_command')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--limit', type=int, default=None,
+			help='Maximum number of messages to send')
+		parser.add_argument('--stalled-after', type=int, default=10,
+			help='Minutes after which a message still being sent is queued again')
+
+	def handle(self, *args, **options):
+		stalled = reset_stalled(options['stalled_after'])
+		count = process_queue(options['limit'])
+		self.stdout.write(self.style.SUCCESS(
+			'{} messages processed, {} stalled messages queued again'.format(count, stalled)))
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.21 on 2026-10-18 11:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sms', '0003_auto_20190826_1735'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ranking',
+            name='clss',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='sms.Class'),
+        ),
+        migrations.CreateModel(
+            name='SubjectRanking',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(choices=[('First', 'First'), ('Second', 'Second'), ('Third', 'Third')], max_length=12)),
+                ('total', models.FloatField()),
+                ('rank', models.CharField(blank=True, max_length=5, null=True)),
+                ('clss', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sms.Class')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sms.Session')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sms.Student')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sms.Subject')),
+            ],
+        ),
+    ]
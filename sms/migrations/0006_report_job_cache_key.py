@@ -0,0 +1,18 @@
+# Generated by Django 2.2.21 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sms', '0005_report_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='cache_key',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.21 on 2026-10-18 11:54
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_attendance(apps, schema_editor):
+    """ Keep the latest record of a student for a day before adding the constraint """
+    Attendance = apps.get_model('sms', 'Attendance')
+    duplicates = Attendance.objects.values(
+        'student', 'session', 'term', 'date').annotate(
+        count=Count('id'), latest=Max('id')).filter(count__gt=1)
+    for row in duplicates:
+        Attendance.objects.filter(
+            student=row['student'],
+            session=row['session'],
+            term=row['term'],
+            date=row['date']).exclude(pk=row['latest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sms', '0006_report_job_cache_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_attendance, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attendance',
+            constraint=models.UniqueConstraint(fields=('student', 'session', 'term', 'date'), name='unique_attendance_per_day'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.2.21 on 2026-10-18 11:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sms', '0007_unique_attendance_per_day'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TermAttendance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(choices=[('First', 'First'), ('Second', 'Second'), ('Third', 'Third')], max_length=7)),
+                ('start', models.DateField(blank=True, null=True)),
+                ('recorded', models.BinaryField(default=b'')),
+                ('present', models.BinaryField(default=b'')),
+                ('late', models.BinaryField(default=b'')),
+                ('recorded_days', models.PositiveIntegerField(default=0)),
+                ('present_days', models.PositiveIntegerField(default=0)),
+                ('late_days', models.PositiveIntegerField(default=0)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sms.Session')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sms.Student')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='termattendance',
+            constraint=models.UniqueConstraint(fields=('student', 'session', 'term'), name='unique_term_attendance'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.21 on 2026-10-18 11:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sms', '0008_term_attendance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmsDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone', models.CharField(max_length=60)),
+                ('body', models.TextField()),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('O', 'Sending'), ('S', 'Delivered'), ('F', 'Failed')], default='P', max_length=1)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('message_id', models.CharField(blank=True, max_length=64, null=True)),
+                ('error', models.CharField(blank=True, max_length=300, null=True)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('sent_on', models.DateTimeField(blank=True, null=True)),
+                ('sms', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='sms.Sms')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='smsdelivery',
+            index=models.Index(fields=['status', 'next_attempt'], name='sms_delivery_due_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.21 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sms', '0009_sms_delivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='emailmessage',
+            name='failed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='emailmessage',
+            name='sent',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='emailmessage',
+            name='status',
+            field=models.CharField(choices=[('D', 'Draft'), ('S', 'Delivered'), ('P', 'Pending'), ('O', 'Sending'), ('F', 'Failed')], default='P', max_length=1),
+        ),
+        migrations.AlterField(
+            model_name='sms',
+            name='status',
+            field=models.CharField(choices=[('D', 'Draft'), ('S', 'Delivered'), ('P', 'Pending'), ('O', 'Sending'), ('F', 'Failed')], default='P', max_length=1),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.21 on 2026-10-18 12:40
+
+from django.db import migrations
+
+from sms.duplicates import merge_all
+
+
+def merge_duplicates(apps, schema_editor):
+    """ Merge the duplicate rows before 0012 adds the unique constraints """
+    merge_all(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sms', '0010_mail_delivery_progress'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.21 on 2026-10-18 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sms', '0011_merge_duplicates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['session', 'term', 'date'], name='attendance_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grade',
+            index=models.Index(fields=['session', 'term', 'subject'], name='grade_subject_sheet_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ranking',
+            index=models.Index(fields=['clss', 'session', 'term'], name='ranking_class_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subjectassign',
+            index=models.Index(fields=['session', 'term', 'teacher'], name='subjectassign_teacher_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subjectranking',
+            index=models.Index(fields=['clss', 'session', 'term'], name='subjectranking_class_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='grade',
+            constraint=models.UniqueConstraint(fields=('session', 'term', 'student', 'subject'), name='unique_grade_per_subject'),
+        ),
+        migrations.AddConstraint(
+            model_name='payment',
+            constraint=models.UniqueConstraint(fields=('student', 'session', 'term'), name='unique_payment_per_term'),
+        ),
+        migrations.AddConstraint(
+            model_name='ranking',
+            constraint=models.UniqueConstraint(fields=('session', 'term', 'student'), name='unique_ranking'),
+        ),
+        migrations.AddConstraint(
+            model_name='subjectassign',
+            constraint=models.UniqueConstraint(fields=('session', 'term', 'clss', 'teacher'), name='unique_subject_assignment'),
+        ),
+        migrations.AddConstraint(
+            model_name='subjectranking',
+            constraint=models.UniqueConstraint(fields=('session', 'term', 'student', 'subject'), name='unique_subject_ranking'),
+        ),
+    ]
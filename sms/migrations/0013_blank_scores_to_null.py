@@ -0,0 +1,57 @@
+# Generated by Django 2.2.21 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+def parse_score(value):
+    """ The whole number of a stored score, None when it is blank or not a score """
+    try:
+        score = int(round(float(value.strip())))
+    except (AttributeError, ValueError):
+        return None
+    return score if score >= 0 else None
+
+
+def scores_to_numbers(apps, schema_editor):
+    """ Normalize the score columns so that they can be cast to integers """
+    Grade = apps.get_model('sms', 'Grade')
+    changed = []
+    for grade in Grade.objects.only('fca', 'sca', 'exam').iterator():
+        values = [parse_score(getattr(grade, field)) for field in ('fca', 'sca', 'exam')]
+        values = [None if value is None else str(value) for value in values]
+        if values != [grade.fca, grade.sca, grade.exam]:
+            grade.fca, grade.sca, grade.exam = values
+            changed.append(grade)
+    Grade.objects.bulk_update(changed, ['fca', 'sca', 'exam'], batch_size=1000)
+
+
+def null_scores_to_blank(apps, schema_editor):
+    Grade = apps.get_model('sms', 'Grade')
+    for field in ('fca', 'sca', 'exam'):
+        Grade.objects.filter(**{field: None}).update(**{field: ''})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sms', '0012_academic_constraints'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='grade',
+            name='exam',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='grade',
+            name='fca',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='grade',
+            name='sca',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+        migrations.RunPython(scores_to_numbers, null_scores_to_blank),
+    ]
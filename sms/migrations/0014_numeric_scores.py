@@ -0,0 +1,51 @@
+# Generated by Django 2.2.21 on 2026-10-18 12:12
+
+from django.db import migrations, models
+
+# total is computed by the database on every insert and update of a grade,
+# Django 2.2 has no generated columns
+GRADE_TOTAL_TRIGGER = """
+CREATE OR REPLACE FUNCTION sms_grade_total() RETURNS trigger AS $$
+BEGIN
+    NEW.total := COALESCE(NEW.fca, 0) + COALESCE(NEW.sca, 0) + COALESCE(NEW.exam, 0);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER sms_grade_total BEFORE INSERT OR UPDATE ON sms_grade
+    FOR EACH ROW EXECUTE PROCEDURE sms_grade_total();
+
+UPDATE sms_grade SET total = COALESCE(fca, 0) + COALESCE(sca, 0) + COALESCE(exam, 0)
+    WHERE total IS DISTINCT FROM COALESCE(fca, 0) + COALESCE(sca, 0) + COALESCE(exam, 0);
+"""
+
+DROP_GRADE_TOTAL_TRIGGER = """
+DROP TRIGGER IF EXISTS sms_grade_total ON sms_grade;
+DROP FUNCTION IF EXISTS sms_grade_total();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sms', '0013_blank_scores_to_null'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='grade',
+            name='exam',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='grade',
+            name='fca',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='grade',
+            name='sca',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.RunSQL(GRADE_TOTAL_TRIGGER, DROP_GRADE_TOTAL_TRIGGER),
+    ]
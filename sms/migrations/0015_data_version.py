@@ -0,0 +1,22 @@
+# Generated by Django 2.2.21 on 2026-10-18 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sms', '0014_numeric_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('stamp', models.CharField(max_length=32)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
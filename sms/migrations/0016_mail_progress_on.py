@@ -0,0 +1,18 @@
+# Generated by Django 2.2.21 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sms', '0015_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='progress_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
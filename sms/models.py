@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from authentication.models import User
 from constants import *
@@ -7,32 +8,12 @@ from markdownx.utils import markdownify
 from django.utils.translation import ugettext_lazy as _
 
 from django.template.defaultfilters import slugify
-from django.core.mail import EmailMessage as EMessage
-
-from datetime import date
-
-import asyncio
-
-import re
 
 from django.utils import timezone as tz
 
-from django.db.models import Sum
-
 def get_terms():
-	term = 'First'
-	now = tz.now()
-	date = tz.localtime(now).date()
-	setting = Setting.objects.first()
-
-	if setting:
-		st_begins, st_ends = setting.st_begins, setting.st_ends
-		tt_begins, tt_ends = setting.tt_begins, setting.tt_ends
-		if (st_begins and st_begins) and (date >= st_begins) and (date <=st_ends):
-			term = 'Second'
-		if (tt_begins and tt_ends) and (date >= tt_begins) and (date <=tt_ends):
-			term = 'Third'
-	return term
+	from .school import get_current_term
+	return get_current_term()
 
 class Session(models.Model):
 	name = models.CharField(max_length=100)
@@ -41,7 +22,8 @@ class Session(models.Model):
 	created_on = models.DateTimeField(auto_now_add=True)
 
 	def get_current_session():
-		return Session.objects.get(current_session=True).name
+		from .school import get_current_session
+		return get_current_session().name
 
 	def __str__(self):
 		return self.name
@@ -78,7 +60,8 @@ class Class(models.Model):
 		verbose_name_plural = 'classes'
 
 def get_current_session():
-    return Session.objects.get(current_session=True).id
+    from .school import get_current_session
+    return get_current_session().id
 
 class Student(models.Model):
 	user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -105,6 +88,14 @@ class SubjectAssign(models.Model):
 	teacher = models.ForeignKey(User, on_delete=models.CASCADE)
 	subjects = models.ManyToManyField(Subject, blank=True)
 
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(
+				fields=['session', 'term', 'clss', 'teacher'], name='unique_subject_assignment'),
+		]
+		indexes = [
+			models.Index(fields=['session', 'term', 'teacher'], name='subjectassign_teacher_idx'),
+		]
 
 
 class SectionAssign(models.Model):
@@ -113,38 +104,51 @@ class SectionAssign(models.Model):
 	placeholder = models.CharField(max_length=100)
 	signature = models.ImageField(upload_to="school_signature/", blank=True, null=True)
 
+class GradeQuerySet(models.query.QuerySet):
+	""" Statistics computed by the database from the numeric score columns """
+
+	def component_statistics(self):
+		""" Average, highest and lowest of every score component, per subject,
+			a missing score counting as 0 like in the total
+		"""
+		fields = {}
+		for name in ('fca', 'sca', 'exam', 'total'):
+			score = Coalesce(name, 0)
+			fields[name + '_avg'] = models.Avg(score)
+			fields[name + '_max'] = models.Max(score)
+			fields[name + '_min'] = models.Min(score)
+		return self.values('subject').annotate(students=models.Count('student'), **fields).order_by('subject')
+
+
 class Grade(models.Model):
 	session = models.ForeignKey(Session, on_delete=models.CASCADE)
 	term = models.CharField(choices=TERM, max_length=7)
 	student = models.ForeignKey(Student, on_delete=models.CASCADE)
 	subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
-	fca = models.CharField(max_length=10)
-	sca = models.CharField(max_length=10)
-	exam = models.CharField(max_length=10)
+	# a missing score is NULL, shown as absent
+	fca = models.PositiveSmallIntegerField(blank=True, null=True)
+	sca = models.PositiveSmallIntegerField(blank=True, null=True)
+	exam = models.PositiveSmallIntegerField(blank=True, null=True)
+	# fca + sca + exam, kept up to date by the sms_grade_total trigger (migration 0014)
 	total = models.FloatField(blank=True, null=True)
 	grade = models.CharField(choices=GRADE, max_length=1, blank=True, null=True)
 	remark = models.CharField(max_length=50, blank=True, null=True)
+	objects = GradeQuerySet.as_manager()
 
 	def compute_position(self, term):
-		cs = Session.objects.get(current_session=True)
-		total = 0
-		all_score = Grade.objects.filter(student__id=self.student.id)
-		for i in all_score:
-			if i.total == None:
-				total += 0
-			else:
-				total += float(i.total)
-		try:
-			r = Ranking.objects.get(session=cs, term=term, student=self.student)
-			r.cumulative=total
-			r.save()
-		except Ranking.DoesNotExist:
-			a = Ranking.objects.create(
-				session=cs,
-				term=term,
-				student=self.student,
-				cumulative=total,
-				)
+		from .ranking import schedule_refresh
+		schedule_refresh(self.student.in_class_id, self.session_id, term)
+
+	class Meta:
+		# (session, term) and (session, term, student) prefixes serve the class
+		# grade matrix and the report cards, the index the score entry sheets
+		constraints = [
+			models.UniqueConstraint(
+				fields=['session', 'term', 'student', 'subject'], name='unique_grade_per_subject'),
+		]
+		indexes = [
+			models.Index(fields=['session', 'term', 'subject'], name='grade_subject_sheet_idx'),
+		]
 
 
 class Attendance(models.Model):
@@ -164,6 +168,110 @@ class Attendance(models.Model):
 	def __str__(self):
 		return self.student.user.get_full_name()
 
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(
+				fields=['student', 'session', 'term', 'date'], name='unique_attendance_per_day'),
+		]
+		indexes = [
+			# roll call of a class for a day
+			models.Index(fields=['session', 'term', 'date'], name='attendance_day_idx'),
+		]
+
+class TermAttendance(models.Model):
+	""" Attendance of a student over a term kept as bitmaps, bit n standing
+		for the nth day after ``start``: days with a roll call, days present
+		and days late. Maintained from the Attendance rows.
+	"""
+	student = models.ForeignKey(Student, on_delete=models.CASCADE)
+	session = models.ForeignKey(Session, on_delete=models.CASCADE)
+	term = models.CharField(choices=TERM, max_length=7)
+	start = models.DateField(blank=True, null=True)
+	recorded = models.BinaryField(default=b'')
+	present = models.BinaryField(default=b'')
+	late = models.BinaryField(default=b'')
+	recorded_days = models.PositiveIntegerField(default=0)
+	present_days = models.PositiveIntegerField(default=0)
+	late_days = models.PositiveIntegerField(default=0)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(
+				fields=['student', 'session', 'term'], name='unique_term_attendance'),
+		]
+
+	def __str__(self):
+		return '{} ({} term)'.format(self.student, self.term)
+
+	@staticmethod
+	def _bits(value):
+		return int.from_bytes(bytes(value or b''), 'little')
+
+	@staticmethod
+	def _bytes(bits):
+		return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+	def get_bitmaps(self):
+		""" (recorded, present, late) bitmaps as integers """
+		return self._bits(self.recorded), self._bits(self.present), self._bits(self.late)
+
+	def set_bitmaps(self, recorded, present, late):
+		self.recorded = self._bytes(recorded)
+		self.present = self._bytes(present)
+		self.late = self._bytes(late)
+		self.recorded_days = bin(recorded).count('1')
+		self.present_days = bin(present).count('1')
+		self.late_days = bin(late).count('1')
+
+	def mark(self, day, is_present, is_late):
+		recorded, present, late = self.get_bitmaps()
+		if self.start is None:
+			self.start = day
+		elif day < self.start:
+			shift = (self.start - day).days
+			recorded, present, late = recorded << shift, present << shift, late << shift
+			self.start = day
+		bit = 1 << (day - self.start).days
+		recorded |= bit
+		present = present | bit if is_present else present & ~bit
+		late = late | bit if is_late else late & ~bit
+		self.set_bitmaps(recorded, present, late)
+
+	def status(self, day):
+		""" (is_present, is_late) on a day, None when there was no roll call """
+		if self.start is None or day < self.start:
+			return None
+		bit = 1 << (day - self.start).days
+		recorded, present, late = self.get_bitmaps()
+		if not recorded & bit:
+			return None
+		return bool(present & bit), bool(late & bit)
+
+	@property
+	def absent_days(self):
+		return self.recorded_days - self.present_days
+
+	@property
+	def present_rate(self):
+		""" Percentage of the roll calls the student was present at """
+		if not self.recorded_days:
+			return None
+		return round(self.present_days * 100.0 / self.recorded_days, 2)
+
+	def streaks(self):
+		""" (current, longest) runs of consecutive roll calls attended,
+			days without a roll call (weekends, holidays) do not break a run
+		"""
+		recorded, present, late = self.get_bitmaps()
+		current = longest = 0
+		day = 0
+		while recorded >> day:
+			if recorded >> day & 1:
+				current = current + 1 if present >> day & 1 else 0
+				longest = max(longest, current)
+			day += 1
+		return current, longest
+
 class FeeType(models.Model):
 	name = models.CharField(max_length=100)
 	for_class = models.ManyToManyField(Class)
@@ -188,6 +296,12 @@ class Payment(models.Model):
 	def __str__(self):
 		return self.student.roll_number
 
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(
+				fields=['student', 'session', 'term'], name='unique_payment_per_term'),
+		]
+
 class Expense(models.Model):
 	item = models.CharField(max_length=100)
 	description = models.CharField(max_length=500, blank=True, null=True)
@@ -249,13 +363,94 @@ class Sms(models.Model):
 	body = models.CharField(max_length=250)
 	status = models.CharField(max_length=1, choices=STATUS, default=PENDING)
 
+class SmsDelivery(models.Model):
+	""" One outbound text message to one phone number, queued until a
+		worker sends it through the SMS gateway.
+	"""
+	sms = models.ForeignKey(Sms, on_delete=models.CASCADE, blank=True, null=True, related_name='deliveries')
+	phone = models.CharField(max_length=60)
+	body = models.TextField()
+	status = models.CharField(max_length=1, choices=DELIVERY_STATUS, default=PENDING)
+	attempts = models.PositiveSmallIntegerField(default=0)
+	next_attempt = models.DateTimeField(default=tz.now)
+	message_id = models.CharField(max_length=64, blank=True, null=True)
+	error = models.CharField(max_length=300, blank=True, null=True)
+	created_on = models.DateTimeField(auto_now_add=True)
+	sent_on = models.DateTimeField(blank=True, null=True)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['status', 'next_attempt'], name='sms_delivery_due_idx'),
+		]
+
+	def __str__(self):
+		return '{} ({})'.format(self.phone, self.get_status_display())
+
 class Ranking(models.Model):
 	student = models.ForeignKey(Student, on_delete=models.CASCADE)
+	clss = models.ForeignKey(Class, on_delete=models.CASCADE, blank=True, null=True)
 	term = models.CharField(max_length=12, choices=TERM)
 	session = models.ForeignKey(Session, on_delete=models.CASCADE)
 	cumulative = models.FloatField()
 	rank = models.CharField(max_length=5, blank=True, null=True)
 
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(
+				fields=['session', 'term', 'student'], name='unique_ranking'),
+		]
+		indexes = [
+			models.Index(fields=['clss', 'session', 'term'], name='ranking_class_idx'),
+		]
+
+class SubjectRanking(models.Model):
+	student = models.ForeignKey(Student, on_delete=models.CASCADE)
+	subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+	clss = models.ForeignKey(Class, on_delete=models.CASCADE)
+	term = models.CharField(max_length=12, choices=TERM)
+	session = models.ForeignKey(Session, on_delete=models.CASCADE)
+	total = models.FloatField()
+	rank = models.CharField(max_length=5, blank=True, null=True)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(
+				fields=['session', 'term', 'student', 'subject'], name='unique_subject_ranking'),
+		]
+		indexes = [
+			models.Index(fields=['clss', 'session', 'term'], name='subjectranking_class_idx'),
+		]
+
+class ReportJob(models.Model):
+	user = models.ForeignKey(User, on_delete=models.CASCADE)
+	name = models.CharField(max_length=100)
+	filename = models.CharField(max_length=100)
+	status = models.CharField(max_length=10, choices=JOB_STATUS, default=JOB_QUEUED)
+	file = models.FileField(upload_to="reports/", blank=True, null=True)
+	cache_key = models.CharField(max_length=64, blank=True)
+	error = models.TextField(blank=True, null=True)
+	created_on = models.DateTimeField(auto_now_add=True)
+	finished_on = models.DateTimeField(blank=True, null=True)
+
+	def __str__(self):
+		return self.name
+
+	@property
+	def is_finished(self):
+		return self.status in (JOB_DONE, JOB_FAILED)
+
+class DataVersion(models.Model):
+	""" Stamp of a set of data, replaced on every change of it, e.g. what the
+		PDF reports are built from. It lives in the database so that every
+		worker process sees the same one.
+	"""
+	name = models.CharField(max_length=50, unique=True)
+	stamp = models.CharField(max_length=32)
+	updated_on = models.DateTimeField(auto_now=True)
+
+	def __str__(self):
+		return self.name
+
 class NoticeBoard(models.Model):
     post_title = models.CharField(max_length=100, blank=True, null=True)
     post_body = models.TextField(blank=True, null=True)
@@ -292,6 +487,12 @@ class EmailMessage(models.Model):
     status = models.CharField(max_length=1, choices=STATUS, default=PENDING)
     content = MarkdownxField()
     recipients = models.ManyToManyField(User)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    # last time the worker sending the mail reported progress, a mail left
+    # sending without progress for a while was interrupted and can be resumed
+    progress_on = models.DateTimeField(blank=True, null=True)
     objects = EmailQuerySet.as_manager()
 
     class Meta:
@@ -312,210 +513,7 @@ class EmailMessage(models.Model):
         return markdownify(self.content)
 
 
-    async def deliver_mail(self, content):
-    	audience = self.recipients.all()
-    	setting = Setting.objects.first()
-    	current_session = Session.objects.get(
-    		current_session=True)
-    	recipients = ()
-
-    	for i in audience:
-    		recipients += (i.email,)
-    		total_expenditure = Expense.objects.aggregate(
-    			Sum('amount'))['amount__sum']
-
-    		default_user_replacements = [
-    			('==fullname==', i.get_full_name()),
-    			('==fname==', i.first_name),
-    			('==sname==', i.last_name),
-    			('==gender==', i.gender or ''),
-    			('==session==', str(current_session)),
-    			('==state==', i.state or ''),
-    			('==address==', i.address or ''),
-    			('==expnse==', str(total_expenditure)),
-    			('==scname==', str(setting.school_name)),
-    		]
-    		for old, new in default_user_replacements:
-    			content = re.sub(old, new, content)
-
-    		if i.is_student:
-    			student = Student.objects.get(
-    				user__id=i.id,
-    				session=current_session)
-    			
-    			subject_q = student.in_class.subjects.all()
-
-    			subjects_html_with_header = '<p>Subject(s)</p><ol>'
-
-    			for subject_obj in subject_q:
-    				subjects_html_with_header += f'<li style="color: green">\
-    					{subject_obj.name}\
-    					</li>'
-
-    			subjects_html_with_header += '</ol>'
-    			grades_q = Grade.objects.filter(
-    				student=student,
-    				session=current_session,
-    				term=get_terms())
-    			grades_html_with_header = '<p><span>Subject</span> \
-    				<span id="grade" style="margin-left: 35vw;">Grade</span>\
-    				</p><ol>'
-
-    			for grade_obj in grades_q:
-    				grades_html_with_header += f'<li style="color: green"><span>{grade_obj.subject}</span>\
-    					<span id="grade" style="margin-left: 35vw;">\
-    						{grade_obj.grade}\
-    						</span></li>'
-
-
-    			grades_html_with_header += '</ol>'
-
-    			payment_q = Payment.objects.filter(
-    				student=student,
-    				session=current_session,
-    				term=get_terms()).first().paid_amount
-
-    			paid_amount = str(payment_q)
-
-    			due_amount_q = Payment.objects.filter(
-    				student=student,
-    				session=current_session,
-    				term=get_terms()).first() or '<i>No outstanding fee</i>'
-
-    			due_amount = str(due_amount_q)
-
-    			payment_t_number_q = Payment.objects.filter(
-    				student=student,
-    				session=current_session,
-    				term=get_terms()).first()
-
-    			payment_teller_number = payment_t_number_q.teller_number or ''
-
-    			attendance_status = Attendance.objects.filter(
-    				student=student,
-    				session=current_session,
-    				term=get_terms(),
-    				date=date.today()) or 'Absent'
-    			
-    			if attendance_status is not 'Absent':
-    				attendance_status = 'Present'
-
-    			student_replacements = [
-    				('==clss==', student.in_class.name),
-    				('==section==', student.in_class.section.name),
-    				('==clssub==', subjects_html_with_header),
-    				('==grades==', grades_html_with_header),
-    				('==amount==', paid_amount),
-    				('==attnd==', attendance_status),
-    				('==damnt==', due_amount),
-    				('==tno==', payment_teller_number),]
-
-    			for old, new in student_replacements:
-    				content = re.sub(old, new, content)
-    		
-    		if i.is_teacher:
-    			allocated_subjects_q = SubjectAssign.objects.get(
-    				session=current_session,
-    				term=get_terms(),
-    				teacher=i)
-
-    			subjects_html_with_header = '<p>Subject(s)</p><ol>'
-
-    			for subject in allocated_subjects_q.subjects.all():
-    				subjects_html_with_header += f'<li style="color: #85144b">\
-    					{subject} ({allocated_subjects_q.clss})\
-    					</li>'
-
-    			subjects_html_with_header += '</ol>'
-    			teacher_replacements = [
-    				('==allsub==', subjects_html_with_header),
-    				]
-
-    			for old, new in teacher_replacements:
-    				content = re.sub(old, new, content)
-
-    		if i.is_parent:
-    			"""Get all his childrens
-    				Get the pattern and replace with their actual:
-	    				subjects for the current class
-	    				School Fee Paid Amount for the current term and session
-	    				School Fee Due Amount for the current term and session
-	    				Today's Attendance and
-	    				Grades for the current term and session
-	    		"""
-
-	    		childrens_q = Parent.objects.get(parent__pk=i.id)
-
-	    		for child in childrens_q.student.all():
-	    			subjects_in_class = child.in_class.subjects.all()
-
-	    			subjects_html_with_header = f'{child.user.first_name}\'s <p>Subjects</p><ol>'
-
-	    			for subject in subjects_in_class:
-	    				subjects_html_with_header += f'<li style="color: green">\
-	    				{subject.name}</li>'
-
-	    			subjects_html_with_header += '</ol>'
-
-	    			# paid amount and due amount
-
-	    			paid_amount = f'{child.user.first_name} <i>Not paid</i>'
-	    			due_amount = f'{child.user.first_name} <i>Not Paid</i>'
-	    			teller_number = ''
-
-	    			payment_q = Payment.objects.filter(
-	    				student=child, 
-	    				session=current_session,
-	    				term=get_terms()).first()
-
-	    			if payment_q:
-	    				paid_amount = f'{child.user.first_name} has paid {payment_q.paid_amount} Naira'
-	    				due_amount = f'{child.user.first_name}\'s due amount is {payment_q.due_amount} Naira'
-	    				teller_number = payment_q.teller_number
-
-	    			# Student attendance
-	    			attendance_q = Attendance.objects.filter(
-	    				student=child,
-	    				session=current_session,
-	    				term=get_terms(),
-	    				date=date.today()).first()
-
-	    			attendance_status = f'{child.user.first_name} is Absent today <small>({date.today()})</small>'
-
-	    			if attendance_q:
-	    				attendance_status = f'{child.user.first_name} is <b>Present</b> today <small>({date.today()})</small>'
-
-	    			# Get and replace grades
-	    			grades_q = Grade.objects.filter(
-	    				student=child,
-	    				session=current_session,
-	    				term=get_terms()) or ''
-
-	    			grades_html_with_header = f'<p>{child.user.first_name}\'s results</p><span>Subject</span> \
-	    				<span id="grade" style="margin-left: 35vw;">\
-	    				Grade</span></p><ol>'
-
-	    			for grade in grades_q:
-	    				grades_html_with_header += f'<li style="color: green">\
-	    				<span>{grade.subject}</span> \
-	    				<span id="grade" style="margin-left: 35vw;">\
-	    				{grade.grade or "<small><i>Nill</i></small>"}</span></li>'
-
-	    			grades_html_with_header += '</ol>'
-
-	    			parent_replacements = [
-	    				('==clssub==', subjects_html_with_header),
-	    				('==grades==', grades_html_with_header),
-	    				('==amount==', paid_amount),
-	    				('==attnd==', attendance_status),
-	    				('==damnt==', due_amount),
-	    				('==tno==', teller_number),
-	    				]
-	    			for old, new in parent_replacements:
-	    				content = re.sub(old, new, content)
-
-    	content = re.sub('^==.*==$', ' ', content)
-    	msg = EMessage(self.title, content, "noreply@bitpoint.com", recipients)
-    	msg.content_subtype = 'html'
-    	msg.send()
-    	self.status = DELIVERED
\ No newline at end of file
+    def deliver_mail(self):
+        """Queue the mail, a worker sends one personalized message per recipient"""
+        from .mailer import queue_mail
+        queue_mail(self)
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import logging
+import mimetypes
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from functools import partial
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.http import FileResponse
+from django.utils import timezone as tz
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from bitpoint.instrumentation import observe, timer
+from constants import JOB_DONE, JOB_FAILED
+from .background import in_tenant
+from .models import DataVersion, ReportJob
+from .pdf_render import PAGE_LANDSCAPE, PAGE_PORTRAIT, render_pdf
+
+
+LOGGER = logging.getLogger(__name__)
+
+REPORT_CACHE_DIR = 'report_cache'
+# DataVersion of the data the reports are built from
+REPORT_DATA = 'report'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(reset=False):
+	""" Process pool shared by every tenant served by this process """
+	global _executor
+	with _executor_lock:
+		if reset and _executor is not None:
+			_executor.shutdown(wait=False)
+			_executor = None
+		if _executor is None:
+			_executor = ProcessPoolExecutor(
+				max_workers=settings.PDF_WORKERS,
+				mp_context=multiprocessing.get_context('spawn'))
+		return _executor
+
+
+def report_version():
+	""" Random stamp of the data the reports are built from, replaced on every change """
+	return DataVersion.objects.get_or_create(
+		name=REPORT_DATA, defaults={'stamp': uuid.uuid4().hex})[0].stamp
+
+
+def invalidate_report_version():
+	DataVersion.objects.update_or_create(name=REPORT_DATA, defaults={'stamp': uuid.uuid4().hex})
+
+
+def report_key(report, *params):
+	""" Content address of a report: its school, its type, its parameters and the data version """
+	data = json.dumps([connection.schema_name, report, [str(p) for p in params], report_version()])
+	return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def cache_path(key, filename):
+	return '{}/{}{}'.format(REPORT_CACHE_DIR, key, os.path.splitext(filename)[1])
+
+
+def cached_report(key, filename):
+	""" Storage path of the report cached under key, None when there is none """
+	path = cache_path(key, filename)
+	return path if default_storage.exists(path) else None
+
+
+def serve_report(request, path, filename, etag=None):
+	""" Serve a stored report, answering conditional requests with a 304 """
+	last_modified = int(default_storage.get_modified_time(path).timestamp())
+	etag = quote_etag(etag) if etag else None
+	response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+	if response is None:
+		content_type = mimetypes.guess_type(filename)[0] or 'application/pdf'
+		response = FileResponse(default_storage.open(path, 'rb'), content_type=content_type)
+		response['Content-Disposition'] = 'filename="{}"'.format(filename)
+	if etag:
+		response['ETag'] = etag
+	response['Last-Modified'] = http_date(last_modified)
+	# the same url serves a new file once the data changed, always revalidate
+	patch_cache_control(response, private=True, no_cache=True)
+	return response
+
+
+def merge_pdfs(pdfs):
+	from PyPDF2 import PdfFileMerger
+	merger = PdfFileMerger()
+	for pdf in pdfs:
+		merger.append(BytesIO(pdf))
+	output = BytesIO()
+	merger.write(output)
+	return output.getvalue()
+
+
+def zip_pdfs(names, pdfs):
+	output = BytesIO()
+	with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+		for name, pdf in zip(names, pdfs):
+			archive.writestr(name, pdf)
+	return output.getvalue()
+
+
+def _combine(filename, names, pdfs):
+	""" The parts of a report, zipped for a .zip filename and merged otherwise """
+	if filename.endswith('.zip'):
+		return zip_pdfs(names, pdfs)
+	if len(pdfs) == 1:
+		return pdfs[0]
+	return merge_pdfs(pdfs)
+
+
+def _store(job_id, build):
+	job = ReportJob.objects.get(pk=job_id)
+	try:
+		data = build()
+	except Exception as e:
+		LOGGER.exception('Rendering report job %s failed', job_id)
+		job.status = JOB_FAILED
+		job.error = str(e) or e.__class__.__name__
+	else:
+		if job.cache_key:
+			path = cache_path(job.cache_key, job.filename)
+			if not default_storage.exists(path):
+				path = default_storage.save(path, ContentFile(data))
+			job.file.name = path
+		else:
+			job.file.save('{}{}'.format(job.pk, os.path.splitext(job.filename)[1]), ContentFile(data), save=False)
+		job.status = JOB_DONE
+	job.finished_on = tz.now()
+	job.save()
+
+
+def _render_async(html, base_url, css_string):
+	try:
+		return get_executor().submit(render_pdf, html, base_url, css_string)
+	except BrokenProcessPool:
+		# a worker died (e.g. killed for using too much memory), start a new pool
+		return get_executor(reset=True).submit(render_pdf, html, base_url, css_string)
+
+
+def _submit(job_id, filename, parts, base_url, css_string):
+	store = in_tenant(_store)
+	schema_name = connection.schema_name
+	start = time.perf_counter()
+	names = [name for name, html in parts]
+	futures = [_render_async(html, base_url, css_string) for name, html in parts]
+	remaining = [len(futures)]
+	lock = threading.Lock()
+
+	def done(future):
+		with lock:
+			remaining[0] -= 1
+			if remaining[0]:
+				return
+		store(job_id, lambda: _combine(filename, names, [f.result() for f in futures]))
+		observe(schema_name, 'report_job', pdf=time.perf_counter() - start)
+
+	for future in futures:
+		future.add_done_callback(done)
+
+
+def purge_jobs():
+	""" Delete the jobs, and their files, older than REPORT_JOB_MAX_AGE.
+
+		This also bounds the lifetime of the cached reports, which are the
+		files of the jobs that produced them. Jobs with the same cache key
+		share one file, it is only deleted with the last job using it.
+	"""
+	expired = ReportJob.objects.filter(
+		created_on__lt=tz.now() - timedelta(seconds=settings.REPORT_JOB_MAX_AGE))
+	for job in expired:
+		name = job.file.name if job.file else None
+		job.delete()
+		if name and not ReportJob.objects.filter(file=name).exists() and default_storage.exists(name):
+			default_storage.delete(name)
+
+
+def queue_report(request, name, filename, html, css_string=PAGE_PORTRAIT, cache_key=''):
+	""" Queue an already rendered report template for PDF conversion.
+
+		html is either one document or a list of (name, html) parts which
+		are rendered in parallel by the process pool, then merged in order
+		into a single PDF, or bundled as is when filename is a .zip.
+
+		The result is saved to the tenant storage (under cache_key when
+		given) and the returned job is polled until it is finished. With
+		PDF_WORKERS = 0 everything is rendered right away in the request.
+	"""
+	purge_jobs()
+	job = ReportJob.objects.create(
+		user=request.user, name=name, filename=filename, cache_key=cache_key)
+	base_url = request.build_absolute_uri()
+	parts = [(filename, html)] if isinstance(html, str) else list(html)
+	if not settings.PDF_WORKERS:
+		with timer('pdf'):
+			_store(job.pk, lambda: _combine(filename, [n for n, h in parts], [
+				render_pdf(h, base_url, css_string) for n, h in parts]))
+		job.refresh_from_db()
+		return job
+	transaction.on_commit(partial(_submit, job.pk, filename, parts, base_url, css_string))
+	return job
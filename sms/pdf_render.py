@@ -0,0 +1,23 @@
+""" Code executed by the PDF worker processes.
+
+This module must not import Django: workers are spawned fresh and only need
+WeasyPrint to turn an already rendered template into a PDF.
+"""
+
+PAGE_PORTRAIT = """@page {
+	size: a4 portrait;
+	margin: 1mm;
+	counter-increment: page;
+}"""
+
+PAGE_LANDSCAPE = """@page {
+	size: a4 landscape;
+	margin: 1mm;
+	counter-increment: page;
+}"""
+
+
+def render_pdf(html, base_url, css_string=PAGE_PORTRAIT):
+	from weasyprint import HTML, CSS
+	return HTML(string=html, base_url=base_url).write_pdf(
+		stylesheets=[CSS(string=css_string)], presentational_hints=True)
@@ -0,0 +1,228 @@
+import threading
+
+from django.db import transaction
+from django.db.models import F, Sum, Window
+from django.db.models.functions import Coalesce, DenseRank, Rank
+
+from .models import Grade, Ranking, SubjectRanking
+
+
+GRADE_FIELDS = (
+	'id',
+	'session_id',
+	'term',
+	'student_id',
+	'subject_id',
+	'fca',
+	'sca',
+	'exam',
+	'total',
+	'grade',
+	'remark',
+)
+
+
+def load_grade_matrix(clss, session, term):
+	""" matrix[student_id][subject_id] = grade row, for a class in a session and term """
+	grades = Grade.objects.filter(
+		term=term,
+		session=session,
+		student__in_class=clss).values(*GRADE_FIELDS)
+	matrix = {}
+	for row in grades:
+		matrix.setdefault(row['student_id'], {})[row['subject_id']] = row
+	return matrix
+
+
+def _rank(dense):
+	return DenseRank() if dense else Rank()
+
+
+def class_ranking(clss, session, term, dense=False):
+	""" Grade totals of the students of a class, one row per graded student
+		with its ``cumulative`` total and its class ``position``.
+
+		The positions are computed by the database with RANK() OVER the
+		class ordered by total, equal totals share a position and the next
+		one is skipped (1, 2, 2, 4), or is not with dense (1, 2, 2, 3).
+	"""
+	cumulative = Sum(Coalesce('total', 0))
+	return Grade.objects.filter(
+		term=term,
+		session=session,
+		student__in_class=clss).values('student').annotate(
+		cumulative=cumulative,
+		position=Window(_rank(dense), order_by=cumulative.desc())).order_by('position', 'student')
+
+
+def subject_ranking(clss, session, term, dense=False):
+	""" Grades of a class annotated with their ``score`` (total, 0 when
+		missing) and their ``position`` in the subject, computed with
+		RANK() OVER (PARTITION BY subject ORDER BY total DESC).
+	"""
+	return Grade.objects.filter(
+		term=term,
+		session=session,
+		student__in_class=clss).annotate(
+		score=Coalesce('total', 0),
+		position=Window(
+			_rank(dense),
+			partition_by=[F('subject')],
+			order_by=Coalesce('total', 0).desc())).order_by('subject', 'position', 'student')
+
+
+def compute_positions(clss, session, term):
+	""" Totals, class positions and subject positions of a class, two queries.
+
+		Returns (totals, positions, subject_positions, subject_totals) where
+		positions maps a student id to its class position and
+		subject_positions and subject_totals map a (student id, subject id)
+		pair to the position and the total in that subject.
+	"""
+	totals, positions = {}, {}
+	for row in class_ranking(clss, session, term):
+		totals[row['student']] = row['cumulative']
+		positions[row['student']] = row['position']
+	subject_positions, subject_totals = {}, {}
+	for student_id, subject_id, score, position in subject_ranking(clss, session, term).values_list(
+			'student_id', 'subject_id', 'score', 'position'):
+		subject_positions[(student_id, subject_id)] = position
+		subject_totals[(student_id, subject_id)] = score
+	return totals, positions, subject_positions, subject_totals
+
+
+def refresh_rankings(clss, session, term):
+	""" Recompute the materialized Ranking and SubjectRanking rows of a class.
+
+		Only rows whose cumulative, total or position changed are written.
+	"""
+	clss_id = getattr(clss, 'pk', clss)
+	session_id = getattr(session, 'pk', session)
+	totals, positions, subject_positions, subject_totals = compute_positions(clss_id, session_id, term)
+
+	with transaction.atomic():
+		existing = {
+			r.student_id: r for r in Ranking.objects.filter(
+				clss=clss_id, session=session_id, term=term)
+		}
+		created, updated = [], []
+		for student_id, total in totals.items():
+			rank = str(positions[student_id])
+			ranking = existing.pop(student_id, None)
+			if ranking is None:
+				created.append(Ranking(
+					student_id=student_id,
+					clss_id=clss_id,
+					session_id=session_id,
+					term=term,
+					cumulative=total,
+					rank=rank))
+			elif ranking.cumulative != total or ranking.rank != rank:
+				ranking.cumulative = total
+				ranking.rank = rank
+				updated.append(ranking)
+		# rows of these students in another class (they changed class) or in
+		# none (saved before rankings were kept per class), a student has one
+		# ranking per term
+		Ranking.objects.filter(
+			session=session_id,
+			term=term,
+			student__in=list(totals)).exclude(clss=clss_id).delete()
+		if existing:
+			Ranking.objects.filter(pk__in=[r.pk for r in existing.values()]).delete()
+		Ranking.objects.bulk_create(created)
+		Ranking.objects.bulk_update(updated, ['cumulative', 'rank'])
+
+		existing = {
+			(r.student_id, r.subject_id): r for r in SubjectRanking.objects.filter(
+				clss=clss_id, session=session_id, term=term)
+		}
+		created, updated = [], []
+		for (student_id, subject_id), position in subject_positions.items():
+			total = subject_totals[(student_id, subject_id)]
+			rank = str(position)
+			ranking = existing.pop((student_id, subject_id), None)
+			if ranking is None:
+				created.append(SubjectRanking(
+					student_id=student_id,
+					subject_id=subject_id,
+					clss_id=clss_id,
+					session_id=session_id,
+					term=term,
+					total=total,
+					rank=rank))
+			elif ranking.total != total or ranking.rank != rank:
+				ranking.total = total
+				ranking.rank = rank
+				updated.append(ranking)
+		if existing:
+			SubjectRanking.objects.filter(pk__in=[r.pk for r in existing.values()]).delete()
+		SubjectRanking.objects.filter(
+			session=session_id,
+			term=term,
+			student__in=list(totals)).exclude(clss=clss_id).delete()
+		SubjectRanking.objects.bulk_create(created)
+		SubjectRanking.objects.bulk_update(updated, ['total', 'rank'])
+
+	return totals, positions, subject_positions
+
+
+_scheduled = threading.local()
+
+
+def _pending_refreshes():
+	""" Rankings waiting for a commit, per thread like database connections """
+	if not hasattr(_scheduled, 'keys'):
+		_scheduled.keys = set()
+	return _scheduled.keys
+
+
+def schedule_refresh(clss_id, session_id, term):
+	""" Refresh the rankings of a class once the current transaction commits.
+
+		Several grade changes of the same class inside one transaction only
+		trigger one refresh, outside of a transaction it runs immediately.
+	"""
+	key = (clss_id, session_id, term)
+	_pending_refreshes().add(key)
+
+	def refresh():
+		# the first callback of the class does the refresh, the others find
+		# the key gone; keys left by a rolled back transaction are harmless
+		pending = _pending_refreshes()
+		if key in pending:
+			pending.discard(key)
+			refresh_rankings(*key)
+	transaction.on_commit(refresh)
+
+
+def get_positions(clss, session, term, matrix=None):
+	""" Class and subject positions of a class read from the materialized rows.
+
+		The rows are (re)built on the fly when they are missing or do not
+		cover every graded student, e.g. for grades recorded before rankings
+		were materialized.
+	"""
+	positions = {
+		student_id: int(rank) for student_id, rank in Ranking.objects.filter(
+			clss=clss, session=session, term=term).values_list('student_id', 'rank')
+	}
+	if matrix is not None and set(positions) != set(matrix):
+		totals, positions, subject_positions = refresh_rankings(clss, session, term)
+		return positions, subject_positions
+
+	subject_positions = {
+		(student_id, subject_id): int(rank)
+		for student_id, subject_id, rank in SubjectRanking.objects.filter(
+			clss=clss, session=session, term=term).values_list('student_id', 'subject_id', 'rank')
+	}
+	return positions, subject_positions
+
+
+def get_student_position(clss, session, term, student):
+	ranking = Ranking.objects.filter(
+		clss=clss, session=session, term=term, student=student).values_list('rank', flat=True).first()
+	if ranking is None:
+		totals, positions, subject_positions = refresh_rankings(clss, session, term)
+		return positions.get(getattr(student, 'pk', student))
+	return int(ranking)
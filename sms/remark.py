@@ -1,21 +1,56 @@
+from bisect import bisect_right
+
 from constants import *
+from .cache import tenant_cached, tenant_invalidate
 from .models import GradeScale
 
+SCALE_TABLE = 'grade-scale'
+
+
+def compile_scale():
+	""" Sorted interval table of the grade scale.
+
+		Returns (starts, bands) where bands[i] = (mark_from, mark_upto, grade, remark)
+		and starts[i] = bands[i][0], ready for a bisect lookup.
+	"""
+	bands = [
+		(scale.mark_from, scale.mark_upto, scale.grade, scale.remark)
+		for scale in GradeScale.objects.order_by('mark_from')
+	]
+	return [band[0] for band in bands], bands
+
+
+def get_scale_table():
+	return tenant_cached(SCALE_TABLE, compile_scale)
+
+
+def invalidate_scale_table():
+	tenant_invalidate(SCALE_TABLE)
+
+
+def lookup(total, table=None):
+	""" (grade, remark) of a total, (None, None) when it is not covered.
+
+		A band covers [mark_from, mark_upto + 1) so fractional totals such as
+		49.5 fall in the 40 - 49 band rather than in no band at all. Loops
+		pass the table of get_scale_table() to read it only once.
+	"""
+	if total is None:
+		return None, None
+	starts, bands = table or get_scale_table()
+	i = bisect_right(starts, total) - 1
+	if i >= 0:
+		mark_from, mark_upto, grade, remark = bands[i]
+		if total < mark_upto + 1:
+			return grade, remark
+	return None, None
+
 def getRemark(total):
-	gradeScale = GradeScale.objects.all()
-	for i in gradeScale:
-		if total in range(i.mark_from, i.mark_upto+1):
-			return i.remark
+	return lookup(total)[1]
 
 def getGrade(total):
-	gradeScale = GradeScale.objects.all()
-	for i in gradeScale:
-		if total in range(i.mark_from, i.mark_upto+1):
-			return i.grade
+	return lookup(total)[0]
 
 def getGradeWithTotalApproximate(total):
 	total = round(total, 0)
-	gradeScale = GradeScale.objects.all()
-	for i in gradeScale:
-		if total in range(i.mark_from, i.mark_upto+1):
-			return i.grade
\ No newline at end of file
+	return lookup(total)[0]
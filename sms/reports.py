@@ -0,0 +1,147 @@
+from collections import OrderedDict
+
+from .models import Student
+from .ranking import get_positions, load_grade_matrix
+
+
+class ClassReport(object):
+	""" Report data for a class in a given session and term.
+
+		The whole grade matrix of the class is fetched with a single query,
+		class and subject positions are read from the materialized rankings
+		and totals, highest/lowest scores and averages are computed in memory.
+	"""
+
+	def __init__(self, clss, session, term, subjects=None):
+		self.clss = clss
+		self.session = session
+		self.term = term
+		if subjects is None:
+			subjects = clss.subjects.all()
+		self.subjects = list(subjects)
+
+		# matrix[student_id][subject_id] = grade row
+		self.matrix = load_grade_matrix(clss, session, term)
+		self.totals = {
+			student_id: sum(row['total'] or 0 for row in rows.values())
+			for student_id, rows in self.matrix.items()
+		}
+		self.positions, self.subject_positions = get_positions(
+			clss, session, term, self.matrix)
+
+		self.subject_totals = {}
+		for subject in self.subjects:
+			self.subject_totals[subject.pk] = [
+				rows[subject.pk]['total'] or 0
+				for rows in self.matrix.values() if subject.pk in rows
+			]
+
+		self._students = None
+		self._student_map = None
+		self._subject_map = {subject.pk: subject for subject in self.subjects}
+
+	def exists(self):
+		return bool(self.matrix)
+
+	@property
+	def students(self):
+		""" Students of the class having at least one grade, annotated with
+			``total_mark`` and ``student_rank`` as the report templates expect.
+		"""
+		if self._students is None:
+			students = Student.objects.filter(
+				in_class=self.clss,
+				session=self.session).select_related('user', 'in_class', 'in_class__section')
+			self._students = []
+			for student in students:
+				if student.pk not in self.matrix:
+					continue
+				student.total_mark = self.totals[student.pk]
+				student.student_rank = self.positions[student.pk]
+				self._students.append(student)
+		return self._students
+
+	def covers(self, clss=None, session=None, term=None):
+		""" Whether the report is the one of this class, session and term,
+			the values given as instances or primary keys, None matching any
+		"""
+		for value, own in ((clss, self.clss), (session, self.session)):
+			if value is not None and str(getattr(value, 'pk', value)) != str(getattr(own, 'pk', own)):
+				return False
+		return term is None or term == self.term
+
+	def student(self, student_id):
+		""" A graded student of the class with its user, None for another one """
+		if self._student_map is None:
+			self._student_map = {student.pk: student for student in self.students}
+		return self._student_map.get(int(getattr(student_id, 'pk', student_id)))
+
+	def subject(self, subject_id):
+		return self._subject_map.get(int(getattr(subject_id, 'pk', subject_id)))
+
+	def score(self, subject_id, student_id):
+		""" Total of a student in a subject, None when it was not graded """
+		row = self.matrix.get(int(getattr(student_id, 'pk', student_id)), {}).get(
+			int(getattr(subject_id, 'pk', subject_id)))
+		return None if row is None else row['total']
+
+	@property
+	def number_of_students(self):
+		return len(self.matrix)
+
+	@property
+	def highest(self):
+		return max(self.totals.values()) if self.totals else None
+
+	@property
+	def lowest(self):
+		return min(self.totals.values()) if self.totals else None
+
+	@property
+	def class_average(self):
+		if not self.totals:
+			return 0
+		return round(sum(self.totals.values()) / float(len(self.totals)), 2)
+
+	def total(self, student_id):
+		return self.totals.get(student_id)
+
+	def position(self, student_id):
+		return self.positions.get(student_id)
+
+	def student_average(self, student_id):
+		total = self.totals.get(student_id)
+		if total is None or not self.subjects:
+			return None
+		return total / float(len(self.subjects))
+
+	def subject_position(self, student_id, subject_id):
+		return self.subject_positions.get((student_id, subject_id), 0)
+
+	def subject_average(self, subject_id):
+		""" Average score of a subject over the students graded in the class """
+		scores = self.subject_totals.get(subject_id)
+		if not scores:
+			return 0
+		return sum(scores) / float(len(scores))
+
+	def subject_rows(self, student_id, subjects=None):
+		""" Grade rows of a student, one per graded subject in subject order,
+			each with the subject position under ``rank``.
+		"""
+		rows = self.matrix.get(student_id, {})
+		result = []
+		for subject in (self.subjects if subjects is None else subjects):
+			row = rows.get(subject.pk)
+			if row is None:
+				continue
+			row = dict(row)
+			row['rank'] = str(self.subject_position(student_id, subject.pk))
+			result.append(row)
+		return result
+
+	def records(self):
+		""" (student, subject rows) for every graded student of the class """
+		return OrderedDict(
+			(student.pk, (student, self.subject_rows(student.pk)))
+			for student in self.students)
@@ -0,0 +1,105 @@
+import datetime
+from collections import namedtuple
+
+from django.utils import timezone as tz
+
+from .cache import tenant_cached, tenant_invalidate
+from .models import Session, Setting
+
+CURRENT_SESSION = 'current-session'
+SCHOOL_SETTING = 'school-setting'
+ALL_SESSIONS = 'all-sessions'
+
+DEFAULT_SCHOOL_NAME = "Bitpoint Academy"
+
+
+def add_months(sourcedate, months):
+	import calendar
+	month = sourcedate.month - 1 + months
+	year = sourcedate.year + month // 12
+	month = month % 12 + 1
+	day = min(sourcedate.day, calendar.monthrange(year,month)[1])
+	return datetime.date(year, month, day)
+
+
+def _load_current_session():
+	# get the current session if it exists, otherwise create it
+	try:
+		return Session.objects.get(current_session=True)
+	except Session.DoesNotExist:
+		today = datetime.date.today()
+		name = "{} / {}".format(today.year, today.year + 1)
+		return Session.objects.create(name=name, current_session=True)
+
+
+def _load_school_setting():
+	school_setting = Setting.objects.first()
+	if school_setting is None:
+		today = datetime.date.today()
+		school_setting = Setting.objects.create(school_name=DEFAULT_SCHOOL_NAME,
+			school_logo='logo.png',
+			school_address="Yola, Nigeria",
+			school_slogan="Bringing the future closer the world !",
+			ft_begins=today,
+			ft_ends=add_months(today, 3),
+			st_begins=add_months(today, 4),
+			st_ends=add_months(today, 7),
+			tt_begins=add_months(today, 8),
+			tt_ends=add_months(today, 11)
+			)
+	return school_setting
+
+
+def get_current_session():
+	""" The current Session of the tenant, cached until sessions change """
+	return tenant_cached(CURRENT_SESSION, _load_current_session)
+
+
+def get_school_setting():
+	""" The Setting of the tenant, cached until it changes """
+	return tenant_cached(SCHOOL_SETTING, _load_school_setting)
+
+
+def get_all_sessions():
+	return tenant_cached(ALL_SESSIONS, lambda: list(Session.objects.all()))
+
+
+def invalidate_sessions():
+	tenant_invalidate(CURRENT_SESSION, ALL_SESSIONS)
+
+
+def invalidate_school_setting():
+	tenant_invalidate(SCHOOL_SETTING)
+
+
+def get_current_term(today=None):
+	""" Term of the current date according to the term dates of the school setting """
+	term = 'First'
+	if today is None:
+		today = tz.localtime(tz.now()).date()
+	setting = get_school_setting()
+
+	st_begins, st_ends = setting.st_begins, setting.st_ends
+	tt_begins, tt_ends = setting.tt_begins, setting.tt_ends
+	if (st_begins and st_ends) and (today >= st_begins) and (today <=st_ends):
+		term = 'Second'
+	if (tt_begins and tt_ends) and (today >= tt_begins) and (today <=tt_ends):
+		term = 'Third'
+	return term
+
+
+AcademicContext = namedtuple('AcademicContext', ['session', 'term'])
+
+
+def get_academic_context(request=None):
+	""" The current session and term.
+
+		Both are read from the tenant cache (invalidated when sessions or the
+		term dates change) and memoized on the request when one is given.
+	"""
+	if request is not None and hasattr(request, '_academic_context'):
+		return request._academic_context
+	context = AcademicContext(get_current_session(), get_current_term())
+	if request is not None:
+		request._academic_context = context
+	return context
@@ -0,0 +1,83 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from authentication.models import User
+from .attendance import rebuild_term_attendance
+from .finance import invalidate_finance
+from .models import (Attendance, Class, Expense, Grade, GradeScale, Payment, Section, Session,
+	Setting, Student, Subject, SubjectAssign)
+from .pdf import invalidate_report_version
+from .ranking import schedule_refresh
+from .remark import invalidate_scale_table
+from .school import invalidate_sessions, invalidate_school_setting
+
+
+@receiver([post_save, post_delete], sender=Grade)
+def grade_changed(sender, instance, **kwargs):
+	try:
+		clss_id = instance.student.in_class_id
+	except Student.DoesNotExist:
+		return
+	schedule_refresh(clss_id, instance.session_id, instance.term)
+
+
+@receiver([post_save, post_delete], sender=Attendance)
+def attendance_changed(sender, instance, **kwargs):
+	# after the commit, the student may be being deleted along with its attendance
+	transaction.on_commit(partial(
+		rebuild_term_attendance, instance.student_id, instance.session_id, instance.term))
+
+
+@receiver([post_save, post_delete], sender=Payment)
+@receiver([post_save, post_delete], sender=Expense)
+def finance_changed(sender, **kwargs):
+	transaction.on_commit(invalidate_finance)
+
+
+# after the commit, another process could otherwise cache the old values again
+# between the invalidation and the commit
+
+@receiver([post_save, post_delete], sender=GradeScale)
+def grade_scale_changed(sender, **kwargs):
+	transaction.on_commit(invalidate_scale_table)
+
+
+@receiver([post_save, post_delete], sender=Session)
+def session_changed(sender, **kwargs):
+	transaction.on_commit(invalidate_sessions)
+
+
+@receiver([post_save, post_delete], sender=Setting)
+def setting_changed(sender, **kwargs):
+	transaction.on_commit(invalidate_school_setting)
+
+
+# data the cached PDF reports are built from
+REPORT_MODELS = (Class, Grade, GradeScale, Section, Session, Setting, Student, Subject, SubjectAssign)
+
+
+def report_data_changed(sender, **kwargs):
+	# after the commit, so that no report is cached from the old data under the new version
+	transaction.on_commit(invalidate_report_version)
+
+
+for model in REPORT_MODELS:
+	post_save.connect(report_data_changed, sender=model)
+	post_delete.connect(report_data_changed, sender=model)
+
+
+def is_login(update_fields):
+	""" Whether a save of a User only records a login (update_last_login) """
+	return update_fields is not None and set(update_fields) == {'last_login'}
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, update_fields=None, **kwargs):
+	# the report cards show the names of the students and teachers
+	if not is_login(update_fields):
+		report_data_changed(sender)
+m2m_changed.connect(report_data_changed, sender=Class.subjects.through)
+m2m_changed.connect(report_data_changed, sender=SubjectAssign.subjects.through)
@@ -1,38 +1,229 @@
-import asyncio
-from .models import Setting
-from twilio.rest import Client
-from .twilio_token import ACCOUNT_SID, AUTH_TOKEN
-from .models import Sms
-from constants import DELIVERED
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone as tz
+from django.utils.module_loading import import_string
 
+from constants import DELIVERED, FAILED, PENDING, SENDING
+from .background import in_tenant
+from .models import Setting, Sms, SmsDelivery
+from .school import get_school_setting, invalidate_school_setting
 
-client = Client(ACCOUNT_SID, AUTH_TOKEN)
 
+LOGGER = logging.getLogger(__name__)
 
-async def send_sms(phone, msg):
-	if phone:
-		if len(str(phone)) == 0:
-			pass
+
+class GatewayError(Exception):
+	""" Raised by a gateway when a message could not be sent,
+		``retry`` tells whether sending it again may succeed.
+	"""
+	def __init__(self, message, retry=True):
+		super().__init__(message)
+		self.retry = retry
+
+
+class TwilioGateway(object):
+	def __init__(self):
+		from twilio.rest import Client
+		from .twilio_token import ACCOUNT_SID, AUTH_TOKEN
+		self.client = Client(ACCOUNT_SID, AUTH_TOKEN)
+
+	def send(self, phone, body):
+		from twilio.base.exceptions import TwilioRestException
+		try:
+			message = self.client.messages.create(
+				to=phone,
+				from_=settings.SMS_SENDER_ID,
+				body=body)
+		except TwilioRestException as e:
+			# 4xx are rejected messages (invalid number, ...), anything else may pass later
+			raise GatewayError(e.msg, retry=not 400 <= e.status < 500)
+		except IOError as e:
+			raise GatewayError(str(e))
+		return message.sid
+
+
+class FakeGateway(object):
+	""" Gateway keeping the messages in memory, for development and tests.
+		Numbers listed in ``failing`` are rejected.
+	"""
+	outbox = []
+	failing = set()
+
+	def send(self, phone, body):
+		if phone in self.failing:
+			raise GatewayError('{} is not reachable'.format(phone))
+		self.outbox.append((phone, body))
+		return 'fake-{}'.format(len(self.outbox))
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+	global _gateway
+	with _gateway_lock:
+		if _gateway is None:
+			_gateway = import_string(settings.SMS_GATEWAY)()
+		return _gateway
+
+
+def normalize_phone(phone):
+	""" International form of a phone number, None when it is not valid """
+	phone = ''.join(str(phone or '').split())
+	if phone.startswith('+') and phone[1:].isdigit():
+		return phone
+	if phone.startswith('0') and len(phone) == 11 and phone.isdigit():
+		return '+234{}'.format(phone[1:])
+	return None
+
+
+def _claim():
+	""" Mark the next due message as being sent, None when there is none """
+	with transaction.atomic():
+		delivery = SmsDelivery.objects.select_for_update(skip_locked=True).filter(
+			status=PENDING, next_attempt__lte=tz.now()).order_by('next_attempt', 'pk').first()
+		if delivery is not None:
+			delivery.status = SENDING
+			delivery.attempts += 1
+			delivery.next_attempt = tz.now()
+			delivery.save(update_fields=['status', 'attempts', 'next_attempt'])
+	return delivery
+
+
+def _take_unit():
+	""" Use one of the school sms units, False when they are exhausted """
+	return Setting.objects.filter(
+		pk=get_school_setting().pk, sms_unit__gt=0).update(sms_unit=F('sms_unit') - 1) > 0
+
+
+def _give_back_unit():
+	Setting.objects.filter(pk=get_school_setting().pk).update(sms_unit=F('sms_unit') + 1)
+
+
+def finalize_sms(sms_id):
+	""" Set the status of a Sms once none of its messages is left to send:
+		delivered when they all were, failed when any failed or there was none
+	"""
+	statuses = set(SmsDelivery.objects.filter(sms=sms_id).order_by().values_list(
+		'status', flat=True).distinct())
+	if statuses & {PENDING, SENDING}:
+		return
+	Sms.objects.filter(pk=sms_id).update(status=DELIVERED if statuses == {DELIVERED} else FAILED)
+
+
+def _deliver(delivery, gateway):
+	phone = normalize_phone(delivery.phone)
+	if phone is None:
+		error = GatewayError('Invalid phone number', retry=False)
+	elif not _take_unit():
+		error = GatewayError('No sms unit left', retry=False)
+	else:
+		try:
+			delivery.message_id = gateway.send(phone, delivery.body)
+		except Exception as e:
+			_give_back_unit()
+			error = e if isinstance(e, GatewayError) else GatewayError(str(e))
+			LOGGER.warning('Sending sms %s failed: %s', delivery.pk, e)
 		else:
-			if str(phone)[0] == '0':
-				if len(phone) != 10:
-					phone = str(phone)[1:]
-					phone = '+234{}'.format(phone)
-					try:
-						message = client.messages.create(
-							to=phone,
-							from_='Bitpoint inc.',
-							body=msg,
-							status_callback='https://postb.in/1566539964442-7949227630160',
-						)
-						print("message send with an ID of {}".format(message.sid))
-						Sms.objects.get(body=msg)
-						if message.status_callback == 'sent':
-							sms_unit = Setting.objects.first()
-							sms_unit.sms_unit -= 1
-							sms_unit.save()
-							message.status = DELIVERED
-							message.save()
-					except:
-						print("there is an error while sending an sms")
\ No newline at end of file
+			error = None
+
+	if error is None:
+		delivery.status = DELIVERED
+		delivery.sent_on = tz.now()
+		delivery.error = None
+	elif error.retry and delivery.attempts < settings.SMS_MAX_ATTEMPTS:
+		delivery.status = PENDING
+		delivery.next_attempt = tz.now() + timedelta(
+			seconds=settings.SMS_RETRY_BACKOFF * 2 ** (delivery.attempts - 1))
+		delivery.error = str(error)[:300]
+	else:
+		delivery.status = FAILED
+		delivery.error = str(error)[:300]
+	delivery.save(update_fields=['status', 'next_attempt', 'message_id', 'error', 'sent_on'])
+
+	if delivery.sms_id and delivery.status in (DELIVERED, FAILED):
+		finalize_sms(delivery.sms_id)
+
+
+def process_queue(limit=None):
+	""" Send the due messages of the current tenant, returns how many were processed """
+	gateway = get_gateway()
+	count = 0
+	while limit is None or count < limit:
+		delivery = _claim()
+		if delivery is None:
+			break
+		_deliver(delivery, gateway)
+		count += 1
+	if count:
+		invalidate_school_setting()
+	return count
+
+
+def reset_stalled(minutes=10):
+	""" Put back in the queue messages left sending by a worker that died,
+		such a message may be sent twice if the gateway had accepted it.
+	"""
+	return SmsDelivery.objects.filter(
+		status=SENDING,
+		next_attempt__lt=tz.now() - timedelta(minutes=minutes)).update(status=PENDING)
+
+
+_executor = ThreadPoolExecutor(max_workers=settings.SMS_WORKERS)
+_running = {}
+_running_lock = threading.Lock()
+
+
+def _worker(schema_name):
+	retry = None
+	try:
+		process_queue()
+		retry = SmsDelivery.objects.filter(status=PENDING).order_by(
+			'next_attempt').values_list('next_attempt', flat=True).first()
+	finally:
+		with _running_lock:
+			_running[schema_name] -= 1
+			last = not _running[schema_name]
+	# the last worker to stop wakes the queue up for the next retry
+	if last and retry is not None:
+		delay = max((retry - tz.now()).total_seconds(), 0)
+		timer = threading.Timer(delay, in_tenant(dispatch))
+		timer.daemon = True
+		timer.start()
+
+
+def dispatch():
+	""" Start workers for the queue of the current tenant, at most SMS_WORKERS
+		of them send messages at the same time.
+	"""
+	schema_name = connection.schema_name
+	with _running_lock:
+		workers = settings.SMS_WORKERS - _running.get(schema_name, 0)
+		_running[schema_name] = settings.SMS_WORKERS
+	for i in range(workers):
+		_executor.submit(in_tenant(_worker), schema_name)
+
+
+def queue_sms(phones, body, sms=None):
+	""" Queue body for every phone number, sent once the transaction commits """
+	deliveries = SmsDelivery.objects.bulk_create([
+		SmsDelivery(sms=sms, phone=str(phone), body=body) for phone in phones if phone
+	])
+	if deliveries:
+		transaction.on_commit(dispatch)
+	elif sms is not None:
+		# no recipient with a phone number, nothing will ever finalize it
+		finalize_sms(sms.pk)
+	return deliveries
+
+
+def send_sms(phone, msg):
+	""" Queue a single text message """
+	return queue_sms([phone], msg)
@@ -0,0 +1,199 @@
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from authentication.models import User
+from constants import *
+from .attendance import rebuild_all_term_attendance
+from .finance import invalidate_finance
+from .models import (Attendance, Class, Expense, Grade, GradeScale, Parent, Payment, Section,
+	Session, Setting, Student, Subject, SubjectAssign)
+from .pdf import invalidate_report_version
+from .ranking import refresh_rankings
+from .remark import invalidate_scale_table, lookup
+from .school import invalidate_school_setting, invalidate_sessions
+
+PASSWORD = 'benchmark'
+ADMIN_USERNAME = 'bench-admin'
+
+GRADE_SCALE = (
+	(A, 70, 100, 'Excellent'),
+	(B, 60, 69, 'Very good'),
+	(C, 50, 59, 'Good'),
+	(D, 45, 49, 'Fair'),
+	(E, 40, 44, 'Poor'),
+	(F, 0, 39, 'Fail'),
+)
+
+# fixed dates so that two schools generated with the same volume are identical
+FIRST_DAY = date(2020, 9, 7)
+TERM_WEEKS = 14
+
+
+def school_days(term_index, days):
+	""" The first days weekdays of a term """
+	day = FIRST_DAY + timedelta(weeks=TERM_WEEKS * term_index)
+	result = []
+	while len(result) < days:
+		if day.weekday() < 5:
+			result.append(day)
+		day += timedelta(days=1)
+	return result
+
+
+def _users(prefix, count, password, **flags):
+	User.objects.bulk_create([
+		User(
+			username='{}-{}'.format(prefix, i),
+			first_name=prefix.capitalize(),
+			last_name=str(i),
+			email='{}-{}@example.com'.format(prefix, i),
+			phone='080{:08d}'.format(i),
+			gender=MALE if i % 2 else FMALE,
+			password=password,
+			**flags)
+		for i in range(count)
+	], batch_size=1000)
+	return list(User.objects.filter(username__startswith='{}-'.format(prefix)).order_by('pk'))
+
+
+@transaction.atomic
+def generate_school(classes=12, subjects=10, students=600, terms=3, days=60, payments=True,
+		seed=1, stdout=None):
+	""" Fill the current (empty) tenant with a school of the given volume.
+
+		Every class takes every subject, every student is graded in every
+		subject of the first terms terms, has days attendance marks per term
+		and, with payments, one payment per term. Two parents out of three
+		have two children. The data only depends on the arguments, the seed
+		included, so that benchmark runs on two schools can be compared.
+	"""
+	def log(message):
+		if stdout is not None:
+			stdout.write(message)
+
+	rng = random.Random(seed)
+	password = make_password(PASSWORD)
+	term_names = [term for term, label in TERM][:terms]
+
+	Setting.objects.all().delete()
+	Setting.objects.create(school_name='Benchmark Academy', sms_unit=100000)
+	Session.objects.update(current_session=False)
+	session = Session.objects.create(name='2020 / 2021', current_session=True)
+	if not GradeScale.objects.exists():
+		GradeScale.objects.bulk_create([
+			GradeScale(grade=grade, mark_from=mark_from, mark_upto=mark_upto, remark=remark)
+			for grade, mark_from, mark_upto, remark in GRADE_SCALE
+		])
+	invalidate_school_setting()
+	invalidate_sessions()
+	invalidate_scale_table()
+
+	User.objects.create_superuser(ADMIN_USERNAME, 'admin@example.com', PASSWORD)
+	section = Section.objects.create(name='Benchmark')
+	Subject.objects.bulk_create([Subject(name='Subject {}'.format(i)) for i in range(subjects)])
+	all_subjects = list(Subject.objects.filter(name__startswith='Subject ').order_by('pk'))
+	Class.objects.bulk_create([
+		Class(name='Class {}'.format(i), section=section, amount_to_pay=50000)
+		for i in range(classes)
+	])
+	all_classes = list(Class.objects.filter(section=section).order_by('pk'))
+	Class.subjects.through.objects.bulk_create([
+		Class.subjects.through(class_id=clss.pk, subject_id=subject.pk)
+		for clss in all_classes for subject in all_subjects
+	])
+	log('{} classes, {} subjects'.format(len(all_classes), len(all_subjects)))
+
+	teachers = _users('teacher', classes, password, is_teacher=True)
+	for term in term_names:
+		SubjectAssign.objects.bulk_create([
+			SubjectAssign(session=session, term=term, clss=clss, teacher=teacher)
+			for clss, teacher in zip(all_classes, teachers)
+		])
+		SubjectAssign.subjects.through.objects.bulk_create([
+			SubjectAssign.subjects.through(subjectassign_id=assignment.pk, subject_id=subject.pk)
+			for assignment in SubjectAssign.objects.filter(session=session, term=term)
+			for subject in all_subjects
+		])
+
+	student_users = _users('student', students, password, is_student=True)
+	Student.objects.bulk_create([
+		Student(
+			user=user,
+			in_class=all_classes[i % classes],
+			session=session,
+			year_of_admission='2020',
+			roll_number='BA/{:05d}'.format(i))
+		for i, user in enumerate(student_users)
+	], batch_size=1000)
+	all_students = list(Student.objects.filter(session=session).order_by('pk'))
+	log('{} students, {} teachers'.format(len(all_students), len(teachers)))
+
+	# children 2k and 2k + 1 share a parent for two parents out of three
+	groups = []
+	i = 0
+	while i < len(all_students):
+		size = 1 if len(groups) % 3 == 2 else 2
+		groups.append(all_students[i:i + size])
+		i += size
+	parent_users = _users('parent', len(groups), password, is_parent=True)
+	Parent.objects.bulk_create([Parent(parent=user) for user in parent_users], batch_size=1000)
+	parents = list(Parent.objects.filter(parent__in=parent_users).order_by('pk'))
+	Parent.student.through.objects.bulk_create([
+		Parent.student.through(parent_id=parent.pk, student_id=student.pk)
+		for parent, children in zip(parents, groups) for student in children
+	], batch_size=1000)
+	log('{} parents'.format(len(parents)))
+
+	for index, term in enumerate(term_names):
+		grades = []
+		for student in all_students:
+			for subject in all_subjects:
+				fca, sca, exam = rng.randint(5, 20), rng.randint(5, 20), rng.randint(20, 60)
+				total = fca + sca + exam
+				grade, remark = lookup(total)
+				grades.append(Grade(
+					session=session, term=term, student=student, subject=subject,
+					fca=fca, sca=sca, exam=exam,
+					total=total, grade=grade, remark=remark))
+		Grade.objects.bulk_create(grades, batch_size=2000)
+		for clss in all_classes:
+			refresh_rankings(clss.pk, session.pk, term)
+
+		marks = 0
+		for day in school_days(index, days):
+			attendance = []
+			for student in all_students:
+				is_present = rng.random() < 0.92
+				is_late = is_present and rng.random() < 0.05
+				attendance.append(Attendance(
+					student=student, session=session, term=term, date=day,
+					is_present=is_present, is_late=is_late,
+					is_late_for=str(rng.randint(5, 30)) if is_late else '0'))
+			Attendance.objects.bulk_create(attendance, batch_size=5000)
+			marks += len(attendance)
+
+		if payments:
+			paid = []
+			for student in all_students:
+				amount = rng.choice((50000, 50000, 25000, 0))
+				paid.append(Payment(
+					student=student, session=session, term=term,
+					paid_amount=amount, due_amount=50000 - amount,
+					payment_method=CASH,
+					payment_status=PAID if amount == 50000 else PARTIALLY_PAID if amount else NOT_PAID))
+			Payment.objects.bulk_create(paid, batch_size=2000)
+			Expense.objects.bulk_create([
+				Expense(item='Expense {}'.format(i), session=session, term=term,
+					amount=rng.randint(1000, 100000))
+				for i in range(20)
+			])
+		log('{} term: {} grades, {} attendance marks'.format(term, len(grades), marks))
+
+	rebuild_all_term_attendance()
+	# bulk inserts do not send signals
+	transaction.on_commit(invalidate_report_version)
+	transaction.on_commit(invalidate_finance)
+	return session
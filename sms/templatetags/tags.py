@@ -1,13 +1,13 @@
 import math
 from django import template
-from schools.models import Client, Domain
-from sms.models import Setting
-from authentication.models import User
-from django_tenants.utils import schema_context
+from schools.models import Domain
+from main_site.models import TenantStatistics
 
 register = template.Library()
-from sms.models import Subject, Student, Grade, Class, Session
+from sms.models import Subject, Student, Grade
 from django.db.models import Sum
+from sms.ranking import get_student_position
+from sms.reports import ClassReport
 
 ordinal = lambda n: "%d%s" % (n,"tsnrhtdd"[(math.floor(n/10)%10!=1)*(n%10<4)*n%10::4])
 
@@ -15,76 +15,101 @@ ordinal = lambda n: "%d%s" % (n,"tsnrhtdd"[(math.floor(n/10)%10!=1)*(n%10<4)*n%1
 def get_rank(rank):
 	return ordinal(int(rank))
 
-@register.simple_tag
-def get_subject(pk):
-	return Subject.objects.get(pk=int(pk))
-
-@register.simple_tag
-def get_student_roll_no(pk):
-	return Student.objects.get(pk=int(pk)).roll_number
-
-@register.simple_tag
-def get_student_fname(pk):
-	return Student.objects.get(pk=int(pk)).user.first_name
-
-@register.simple_tag
-def get_student_lname(pk):
-	return Student.objects.get(pk=int(pk)).user.last_name
-
-@register.simple_tag
-def get_student_oname(pk):
-	return Student.objects.get(pk=int(pk)).user.other_name or "--"
-
-@register.simple_tag
-def get_student_full_name(pk):
-	return Student.objects.get(pk=pk).user.get_full_name()
-
-@register.simple_tag
-def get_subject_total_score(subject, student):
-	return Grade.objects.get(subject=subject, student=student).total
-
-@register.simple_tag
-def get_overall_total(student, term, session):
-	return Grade.objects.filter(student=student, term=term, session=session).aggregate(overall=Sum('total')).get('overall')
-
-@register.simple_tag
-def calculate_avg(student, term, session, num_subjects):
-	overall = get_overall_total(student, term, session)
+def _report(context, clss=None, session=None, term=None):
+	""" The ClassReport a view put in the context as ``report`` when it covers
+		the values asked for, None for the templates rendered without one
+	"""
+	report = context.get('report')
+	if isinstance(report, ClassReport) and report.covers(clss, session, term):
+		return report
+	return None
+
+def _student(context, pk):
+	report = _report(context)
+	student = report.student(pk) if report is not None else None
+	if student is None:
+		student = Student.objects.select_related('user').get(pk=int(pk))
+	return student
+
+@register.simple_tag(takes_context=True)
+def get_subject(context, pk):
+	report = _report(context)
+	subject = report.subject(pk) if report is not None else None
+	return subject or Subject.objects.get(pk=int(pk))
+
+@register.simple_tag(takes_context=True)
+def get_student_roll_no(context, pk):
+	return _student(context, pk).roll_number
+
+@register.simple_tag(takes_context=True)
+def get_student_fname(context, pk):
+	return _student(context, pk).user.first_name
+
+@register.simple_tag(takes_context=True)
+def get_student_lname(context, pk):
+	return _student(context, pk).user.last_name
+
+@register.simple_tag(takes_context=True)
+def get_student_oname(context, pk):
+	return _student(context, pk).user.other_name or "--"
+
+@register.simple_tag(takes_context=True)
+def get_student_full_name(context, pk):
+	return _student(context, pk).user.get_full_name()
+
+@register.simple_tag(takes_context=True)
+def get_subject_total_score(context, subject, student):
+	report = _report(context)
+	score = report.score(subject, student) if report is not None else None
+	if score is None:
+		score = Grade.objects.get(subject=subject, student=student).total
+	return score
+
+@register.simple_tag(takes_context=True)
+def get_overall_total(context, student, term, session):
+	report = _report(context, session=session, term=term)
+	overall = report.total(int(getattr(student, 'pk', student))) if report is not None else None
+	if overall is None:
+		overall = Grade.objects.filter(student=student, term=term, session=session).aggregate(overall=Sum('total')).get('overall')
+	return overall
+
+@register.simple_tag(takes_context=True)
+def calculate_avg(context, student, term, session, num_subjects):
+	overall = get_overall_total(context, student, term, session)
 	return (float(overall) / float(num_subjects))
 
-@register.simple_tag
-def get_student_rank(clss, session, term, student):
-	student =  Student.objects.get(pk=student)
-	grades = Grade.objects.filter(term=term, student__in_class=clss,session=session).order_by('-total')
-	grades_ordered= grades\
-	.values('student')\
-	.annotate(total_mark=Sum('total'))\
-	.order_by('-total_mark')
-	total_marks = [i.get('total_mark') for i in grades_ordered]
-	records = {}
-	highest = grades_ordered.first()['total_mark']
-	lowest = grades_ordered.last()['total_mark']
-	try:
-		total_mark = (grades_ordered.get(student=student.pk)['total_mark'])
-		setattr(student, 'total_mark', total_mark)
-		student_rank = total_marks.index(total_mark)+1
-		return student_rank
-	except Exception as e:
-		DB_LOGGER.error('{}'.format(e))
-		return None
-
-@register.simple_tag
-def get_class_avg(clss, session, term, no_of_students):
-	clss = Class.objects.get(pk=clss)
-	session = Session.objects.get(pk=session)
-	grades = Grade.objects.filter(student__in_class=clss, session=session, term=term)
-	print(grades.count())
-	avg = grades.aggregate(overall=Sum('total')).get('overall') / float(no_of_students)
-	return round(avg, 2)
+@register.simple_tag(takes_context=True)
+def get_student_rank(context, clss, session, term, student):
+	report = _report(context, clss, session, term)
+	position = report.position(int(getattr(student, 'pk', student))) if report is not None else None
+	if position is None:
+		position = get_student_position(clss, session, term, student)
+	return position
+
+@register.simple_tag(takes_context=True)
+def get_class_avg(context, clss, session, term, no_of_students):
+	report = _report(context, clss, session, term)
+	if report is not None:
+		overall = sum(report.totals.values())
+	else:
+		grades = Grade.objects.filter(student__in_class=clss, session=session, term=term)
+		overall = grades.aggregate(overall=Sum('total')).get('overall')
+	if overall is None:
+		return 0
+	return round(overall / float(no_of_students), 2)
 
-@register.simple_tag
-def get_subject_avg(subject_id, session, clss, no_of_students, term):
-	return round(Grade.objects.filter(subject=subject_id, session=session.pk, term=term).aggregate(subject_avg=Sum('total')).get('subject_avg') / no_of_students, 2)
+@register.simple_tag(takes_context=True)
+def get_subject_avg(context, subject_id, session, clss, no_of_students, term):
+	report = _report(context, clss, session, term)
+	if report is not None and int(subject_id) in report.subject_totals:
+		overall = sum(report.subject_totals[int(subject_id)])
+	else:
+		overall = Grade.objects.filter(
+			subject=subject_id, session=session.pk, term=term, student__in_class=clss).aggregate(subject_avg=Sum('total')).get('subject_avg')
+	if overall is None:
+		# no grade of the subject in the class
+		return 0
+	return round(overall / no_of_students, 2)
 
 
 @register.simple_tag
@@ -108,11 +133,11 @@ def get_tenant_domain(tenant_id):
 
 @register.simple_tag
 def get_tenant_data(data, tenant_id):
-	tenant = Client.objects.get(id=tenant_id)
-	with schema_context(tenant.schema_name):
-		if data == 'sms_unit':
-			unit = Setting.objects.first().sms_unit
-			return unit
-		if data == 'no_studs':
-			students = User.objects.filter(is_student=True).count()
-			return students
+	# read from the public rollup, not from the schema of the tenant
+	statistics = TenantStatistics.objects.filter(tenant_id=tenant_id).first()
+	if statistics is None:
+		return 0
+	if data == 'sms_unit':
+		return statistics.sms_unit
+	if data == 'no_studs':
+		return statistics.students
@@ -1,3 +1,1099 @@
-from django.test import TestCase
+import datetime
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.mail.backends import locmem
+from django.db import connection
+from django.template import Context
+from django.test import RequestFactory, SimpleTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone as tz
+from django_tenants.test.cases import TenantTestCase
+from django_tenants.utils import get_public_schema_name, schema_context
+
+from authentication.models import User
+from bitpoint.middleware import TenantCache, invalidate_tenant_cache
+from constants import (CASH, DELIVERED, FAILED, JOB_DONE, JOB_FAILED, NOT_PAID, PAID, PARTIALLY_PAID,
+	PENDING, SENDING)
+from main_site import statistics
+from main_site.models import TenantStatistics
+from . import cache as sms_cache, sms_sender
+from .attendance import AttendanceSheet, get_term_attendance, rebuild_term_attendance
+from .cache import clear_process_cache
+from .context_processors import NotificationFeed
+from .dashboard import dashboard, school_counts
+from .duplicates import merge_all
+from .exports import (XLSX, attendance_rows, broadsheet_rows, export_response, openpyxl,
+	score_sheet_rows)
+from .finance import Ledger, get_ledger, invalidate_finance
+from .grading import ScoreSheet
+from .mailer import queue_mail, resume_stalled
+from .mailmerge import MailMerge, MergeTemplate
+from .models import (Attendance, Class, EmailMessage, Expense, Grade, GradeScale, Notification, Parent,
+	Payment, Ranking, ReportJob, Section, Session, Setting, Sms, SmsDelivery, Student, Subject,
+	SubjectAssign, TermAttendance)
+from .pdf import (cache_path, cached_report, invalidate_report_version, purge_jobs, queue_report,
+	report_key, report_version, serve_report)
+from .ranking import class_ranking, subject_ranking
+from .remark import getGradeWithTotalApproximate, lookup
+from .reports import ClassReport
+from .school import (get_academic_context, get_current_session, get_current_term, get_school_setting,
+	invalidate_school_setting, invalidate_sessions)
+from .synthetic import generate_school, school_days
+from .templatetags import tags
+
+
+class SchoolTestCase(TenantTestCase):
+	""" Tests run in the schema of a test school, as the academic tables are tenant tables """
+
+	@classmethod
+	def setup_tenant(cls, tenant):
+		tenant.name = 'Test school'
+		tenant.active_until = datetime.date.today() + timedelta(days=365)
+
+	def setUp(self):
+		# the cached settings and grade scale of a test must not leak into the next one
+		cache.clear()
+		clear_process_cache()
+		self.session = Session.objects.create(name='2026 / 2027', current_session=True)
+		self.section = Section.objects.create(name='Junior')
+		self.clss = Class.objects.create(name='JSS 1', section=self.section)
+		self.maths = Subject.objects.create(name='Mathematics')
+		self.english = Subject.objects.create(name='English')
+		self.clss.subjects.add(self.maths, self.english)
+
+	def add_student(self, roll_number, clss=None):
+		user = User.objects.create(username='student{}'.format(roll_number), is_student=True)
+		return Student.objects.create(
+			user=user, in_class=clss or self.clss, session=self.session, roll_number=roll_number)
+
+	def add_grade(self, student, subject, total, term='First'):
+		return Grade.objects.create(
+			student=student, subject=subject, session=self.session, term=term, exam=total, total=total)
+
+
+class RankingTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		self.students = [self.add_student(str(i)) for i in range(1, 5)]
+		# totals 150, 120, 120, 90: a tie for the second place
+		for student, (maths, english) in zip(self.students, ((80, 70), (60, 60), (50, 70), (45, 45))):
+			self.add_grade(student, self.maths, maths)
+			self.add_grade(student, self.english, english)
+
+	def positions(self, dense):
+		return [(row['student'], row['cumulative'], row['position'])
+			for row in class_ranking(self.clss, self.session, 'First', dense=dense)]
+
+	def test_rank_skips_the_place_after_a_tie(self):
+		first, second, third, fourth = [student.pk for student in self.students]
+		self.assertEqual(self.positions(dense=False), [
+			(first, 150, 1), (second, 120, 2), (third, 120, 2), (fourth, 90, 4)])
+
+	def test_dense_rank_does_not_skip_the_place_after_a_tie(self):
+		self.assertEqual([position for student, total, position in self.positions(dense=True)], [1, 2, 2, 3])
+
+	def test_subject_positions(self):
+		english = {
+			grade.student_id: grade.position for grade in subject_ranking(
+				self.clss, self.session, 'First').filter(subject=self.english)
+		}
+		first, second, third, fourth = [student.pk for student in self.students]
+		self.assertEqual(english, {first: 1, third: 1, second: 3, fourth: 4})
+
+	def test_other_classes_and_terms_are_not_ranked(self):
+		other = Class.objects.create(name='JSS 2', section=self.section)
+		self.add_grade(self.add_student('9', clss=other), self.maths, 100)
+		self.add_grade(self.students[3], self.maths, 100, term='Second')
+		self.assertEqual(len(self.positions(dense=False)), 4)
+
+
+class RemarkTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		for grade, mark_from, mark_upto, remark in (
+				('A', 70, 100, 'Excellent'),
+				('C', 50, 59, 'Credit'),
+				('B', 60, 69, 'Very good'),
+				('F', 0, 39, 'Fail')):
+			GradeScale.objects.create(grade=grade, mark_from=mark_from, mark_upto=mark_upto, remark=remark)
+
+	def test_bounds_of_a_band_are_inclusive(self):
+		self.assertEqual(lookup(50), ('C', 'Credit'))
+		self.assertEqual(lookup(59), ('C', 'Credit'))
+		self.assertEqual(lookup(60), ('B', 'Very good'))
+		self.assertEqual(lookup(100), ('A', 'Excellent'))
+
+	def test_fractional_total_falls_in_the_band_below(self):
+		self.assertEqual(lookup(59.5), ('C', 'Credit'))
+		self.assertEqual(lookup(39.9), ('F', 'Fail'))
+
+	def test_total_outside_the_scale(self):
+		self.assertEqual(lookup(None), (None, None))
+		self.assertEqual(lookup(-1), (None, None))
+		self.assertEqual(lookup(101), (None, None))
+		# 40 - 49 is a gap of this scale
+		self.assertEqual(lookup(45), (None, None))
+
+	def test_approximate_grade_rounds_the_total(self):
+		self.assertEqual(getGradeWithTotalApproximate(69.6), 'A')
+		self.assertEqual(getGradeWithTotalApproximate(69.4), 'B')
+
+
+class ScoreSheetTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		self.first = self.add_student('1')
+		self.second = self.add_student('2')
+
+	def sheet(self, ca1, ca2, exam):
+		return ScoreSheet(
+			self.session, 'First', self.maths, [self.first.pk, self.second.pk], ca1, ca2, exam)
+
+	def test_totals_count_blank_scores_as_zero(self):
+		self.sheet(['10', ''], ['20', '5'], ['50', '']).save()
+		grades = {grade.student_id: grade for grade in Grade.objects.filter(subject=self.maths)}
+		self.assertEqual(grades[self.first.pk].total, 80)
+		self.assertEqual(grades[self.second.pk].total, 5)
+		self.assertIsNone(grades[self.second.pk].fca)
+		self.assertIsNone(grades[self.second.pk].exam)
+
+	def test_saving_again_updates_the_grades(self):
+		self.sheet(['10', '10'], ['10', '10'], ['10', '10']).save()
+		self.sheet(['20', '10'], ['10', '10'], ['10', '10']).save()
+		self.assertEqual(Grade.objects.filter(subject=self.maths).count(), 2)
+		self.assertEqual(Grade.objects.get(student=self.first, subject=self.maths).total, 40)
+
+	def test_scores_above_the_maximum_are_rejected(self):
+		with self.assertRaises(ValidationError):
+			self.sheet(['31', '0'], ['0', '0'], ['0', '0']).save()
+		self.assertFalse(Grade.objects.exists())
+
+	def test_students_of_another_session_are_rejected(self):
+		other_session = Session.objects.create(name='2025 / 2026', current_session=False)
+		old = Student.objects.create(
+			user=self.first.user, in_class=self.clss, session=other_session, roll_number='1')
+		sheet = ScoreSheet(
+			self.session, 'First', self.maths, [self.first.pk, old.pk], ['1', '1'], ['1', '1'], ['1', '1'])
+		with self.assertRaises(ValidationError):
+			sheet.save()
+		self.assertFalse(Grade.objects.exists())
+
+	def test_subject_must_be_offered_to_the_class(self):
+		biology = Subject.objects.create(name='Biology')
+		sheet = ScoreSheet(self.session, 'First', biology, [self.first.pk], ['1'], ['1'], ['1'])
+		with self.assertRaises(ValidationError):
+			sheet.save()
+		teacher = User.objects.create(username='teacher', is_teacher=True)
+		SubjectAssign.objects.create(
+			session=self.session, term='First', clss=self.clss, teacher=teacher).subjects.add(biology)
+		self.assertEqual(ScoreSheet(self.session, 'First', biology, [self.first.pk], ['1'], ['1'], ['1']).save(), 1)
+
+	def test_students_of_different_classes_are_rejected(self):
+		other = Class.objects.create(name='JSS 2', section=self.section)
+		other.subjects.add(self.maths)
+		sheet = ScoreSheet(
+			self.session, 'First', self.maths, [self.first.pk, self.add_student('3', clss=other).pk],
+			['1', '1'], ['1', '1'], ['1', '1'])
+		with self.assertRaises(ValidationError):
+			sheet.save()
+
+	@skipUnless(connection.vendor == 'postgresql', 'the grade total trigger is PostgreSQL only')
+	def test_database_computes_the_total(self):
+		grade = Grade.objects.create(
+			student=self.first, subject=self.maths, session=self.session, term='First', fca=10, exam=40)
+		grade.refresh_from_db()
+		self.assertEqual(grade.total, 50)
+		Grade.objects.filter(pk=grade.pk).update(sca=5, total=0)
+		grade.refresh_from_db()
+		self.assertEqual(grade.total, 55)
+
+
+class MergeDuplicatesTest(SchoolTestCase):
+	""" The rows are duplicated with the unique constraints dropped, as they
+		were before 0012, the test transaction brings the constraints back
+	"""
+
+	def setUp(self):
+		super().setUp()
+		with connection.schema_editor() as editor:
+			for model in (Grade, Payment, SubjectAssign):
+				for constraint in model._meta.constraints:
+					editor.remove_constraint(model, constraint)
+		self.student = self.add_student('1')
+
+	def payment(self, paid, due, teller_number=None):
+		return Payment.objects.create(
+			student=self.student, session=self.session, term='First', paid_amount=paid, due_amount=due,
+			payment_method=CASH, payment_status=NOT_PAID, teller_number=teller_number)
+
+	def test_latest_grade_wins(self):
+		self.add_grade(self.student, self.maths, 40)
+		latest = self.add_grade(self.student, self.maths, 60)
+		self.add_grade(self.student, self.maths, 50, term='Second')
+		self.assertEqual(merge_all(apps)['grade'], 1)
+		self.assertEqual(list(Grade.objects.filter(term='First').values_list('pk', flat=True)), [latest.pk])
+		self.assertEqual(Grade.objects.count(), 2)
+
+	def test_payments_are_added_up(self):
+		self.payment(3000, 7000, teller_number='T1')
+		self.payment(2000, 5000)
+		self.assertEqual(merge_all(apps)['payment'], 1)
+		payment = Payment.objects.get()
+		self.assertEqual((payment.paid_amount, payment.due_amount), (5000, 5000))
+		self.assertEqual(payment.payment_status, PARTIALLY_PAID)
+		self.assertEqual(payment.teller_number, 'T1')
+
+	def test_payments_covering_the_fee_are_paid(self):
+		self.payment(6000, 4000)
+		self.payment(4000, 0)
+		merge_all(apps)
+		payment = Payment.objects.get()
+		self.assertEqual((payment.paid_amount, payment.due_amount, payment.payment_status), (10000, 0, PAID))
+
+	def test_subject_assignments_are_merged_into_the_first(self):
+		teacher = User.objects.create(username='teacher', is_teacher=True)
+		first = SubjectAssign.objects.create(session=self.session, term='First', clss=self.clss, teacher=teacher)
+		first.subjects.add(self.maths)
+		second = SubjectAssign.objects.create(session=self.session, term='First', clss=self.clss, teacher=teacher)
+		second.subjects.add(self.maths, self.english)
+		self.assertEqual(merge_all(apps)['subject assignment'], 1)
+		self.assertEqual(list(SubjectAssign.objects.values_list('pk', flat=True)), [first.pk])
+		self.assertEqual(set(first.subjects.all()), {self.maths, self.english})
+
+	def test_nothing_to_merge(self):
+		self.add_grade(self.student, self.maths, 40)
+		self.payment(1000, 0)
+		self.assertEqual(set(merge_all(apps).values()), {0})
+
+
+@override_settings(SMS_MAX_ATTEMPTS=2, SMS_RETRY_BACKOFF=60)
+class SmsDeliveryTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		self.gateway = sms_sender.FakeGateway()
+		self.gateway.outbox = []
+		self.gateway.failing = {'+2348000000002'}
+		patcher = mock.patch.object(sms_sender, 'get_gateway', return_value=self.gateway)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.set_units(10)
+
+	def set_units(self, units):
+		Setting.objects.filter(pk=get_school_setting().pk).update(sms_unit=units)
+
+	def units(self):
+		return Setting.objects.get(pk=get_school_setting().pk).sms_unit
+
+	def send(self, *phones):
+		sms = Sms.objects.create(title='Notice', body='School resumes on Monday', to_user='Parent')
+		sms_sender.queue_sms(phones, 'Notice, School resumes on Monday', sms=sms)
+		sms_sender.process_queue()
+		return sms
+
+	def retry_now(self):
+		SmsDelivery.objects.filter(status=PENDING).update(next_attempt=tz.now())
+		sms_sender.process_queue()
+
+	def test_delivered(self):
+		sms = self.send('08000000001')
+		delivery = SmsDelivery.objects.get()
+		self.assertEqual(delivery.status, DELIVERED)
+		self.assertEqual(delivery.phone, '08000000001')
+		self.assertEqual(self.gateway.outbox, [('+2348000000001', delivery.body)])
+		self.assertIsNotNone(delivery.message_id)
+		self.assertEqual(Sms.objects.get(pk=sms.pk).status, DELIVERED)
+		self.assertEqual(self.units(), 9)
+
+	def test_failure_is_retried_then_failed(self):
+		sms = self.send('+2348000000002')
+		delivery = SmsDelivery.objects.get()
+		self.assertEqual((delivery.status, delivery.attempts), (PENDING, 1))
+		self.assertGreater(delivery.next_attempt, tz.now())
+		self.assertEqual(Sms.objects.get(pk=sms.pk).status, PENDING)
+
+		self.retry_now()
+		delivery.refresh_from_db()
+		self.assertEqual((delivery.status, delivery.attempts), (FAILED, 2))
+		self.assertIn('not reachable', delivery.error)
+		self.assertEqual(Sms.objects.get(pk=sms.pk).status, FAILED)
+		# the unit of a message that was not sent is given back
+		self.assertEqual(self.units(), 10)
+
+	def test_any_failed_message_fails_the_sms(self):
+		sms = self.send('+2348000000001', '+2348000000002')
+		self.retry_now()
+		self.assertEqual(Sms.objects.get(pk=sms.pk).status, FAILED)
+		self.assertEqual(len(self.gateway.outbox), 1)
+
+	def test_invalid_number_is_not_retried(self):
+		self.send('12345')
+		delivery = SmsDelivery.objects.get()
+		self.assertEqual((delivery.status, delivery.attempts), (FAILED, 1))
+		self.assertEqual(self.gateway.outbox, [])
+
+	def test_no_unit_left(self):
+		self.set_units(0)
+		sms = self.send('+2348000000001')
+		self.assertEqual(SmsDelivery.objects.get().status, FAILED)
+		self.assertEqual(Sms.objects.get(pk=sms.pk).status, FAILED)
+		self.assertEqual(self.gateway.outbox, [])
+
+	def test_sms_without_recipient_is_failed(self):
+		sms = self.send()
+		self.assertFalse(SmsDelivery.objects.exists())
+		self.assertEqual(Sms.objects.get(pk=sms.pk).status, FAILED)
+
+
+class TenantCacheTest(SimpleTestCase):
+	""" The hostname cache of the tenant middleware, its stamp stands for the other processes """
+
+	def setUp(self):
+		cache.clear()
+		self.tenants = TenantCache(maxsize=2, ttl=60, check_interval=0)
+
+	def test_cached_hostname(self):
+		self.assertEqual(self.tenants.get('school.example.com'), (False, None))
+		self.tenants.set('school.example.com', 'school')
+		self.tenants.set('unknown.example.com', None)
+		self.assertEqual(self.tenants.get('school.example.com'), (True, 'school'))
+		# unknown hostnames are cached too
+		self.assertEqual(self.tenants.get('unknown.example.com'), (True, None))
+
+	def test_least_recently_used_hostname_is_evicted(self):
+		self.tenants.set('a.example.com', 'a')
+		self.tenants.set('b.example.com', 'b')
+		self.tenants.get('a.example.com')
+		self.tenants.set('c.example.com', 'c')
+		self.assertEqual(self.tenants.get('b.example.com'), (False, None))
+		self.assertEqual(self.tenants.get('a.example.com'), (True, 'a'))
+
+	def test_expired_hostname(self):
+		with mock.patch('bitpoint.middleware.time.monotonic', return_value=1000):
+			self.tenants.set('school.example.com', 'school')
+		with mock.patch('bitpoint.middleware.time.monotonic', return_value=1061):
+			self.assertEqual(self.tenants.get('school.example.com'), (False, None))
+
+	def test_invalidation_reaches_the_other_processes(self):
+		other = TenantCache(maxsize=2, ttl=60, check_interval=0)
+		other.set('school.example.com', 'school')
+		invalidate_tenant_cache()
+		self.assertEqual(other.get('school.example.com'), (False, None))
+
+	def test_stamp_is_only_read_every_check_interval(self):
+		other = TenantCache(maxsize=2, ttl=60, check_interval=60)
+		other.set('school.example.com', 'school')
+		invalidate_tenant_cache()
+		self.assertEqual(other.get('school.example.com'), (True, 'school'))
+		with mock.patch('bitpoint.middleware.time.monotonic', return_value=time.monotonic() + 61):
+			self.assertEqual(other.get('school.example.com'), (False, None))
+
+
+class TenantCachedTest(SchoolTestCase):
+	""" Per-tenant values kept in the memory of the process """
+
+	def setUp(self):
+		super().setUp()
+		self.computed = 0
+
+	def compute(self):
+		self.computed += 1
+		return self.computed
+
+	def invalidate_elsewhere(self, key):
+		# another process invalidates key, this one still holds the value
+		held = dict(sms_cache._entries)
+		sms_cache.tenant_invalidate(key)
+		sms_cache._entries.update(held)
+
+	def test_value_is_computed_once(self):
+		self.assertEqual(sms_cache.tenant_cached('value', self.compute), 1)
+		self.assertEqual(sms_cache.tenant_cached('value', self.compute), 1)
+		sms_cache.tenant_invalidate('value')
+		self.assertEqual(sms_cache.tenant_cached('value', self.compute), 2)
+
+	def test_values_are_scoped_to_the_tenant(self):
+		sms_cache.tenant_cached('value', self.compute)
+		with mock.patch.object(connection, 'schema_name', 'other_school'):
+			self.assertEqual(sms_cache.tenant_cached('value', self.compute), 2)
+		self.assertEqual(sms_cache.tenant_cached('value', self.compute), 1)
+
+	@override_settings(SMS_CACHE_CHECK_INTERVAL=60)
+	def test_invalidation_in_another_process(self):
+		sms_cache.tenant_cached('value', self.compute)
+		self.invalidate_elsewhere('value')
+		# the stamp is only read again after the check interval
+		self.assertEqual(sms_cache.tenant_cached('value', self.compute), 1)
+		with mock.patch('sms.cache.time.monotonic', return_value=time.monotonic() + 61):
+			self.assertEqual(sms_cache.tenant_cached('value', self.compute), 2)
+
+	def test_school_setting_is_read_from_memory(self):
+		setting = get_school_setting()
+		with self.assertNumQueries(0):
+			self.assertEqual(get_school_setting(), setting)
+		Setting.objects.filter(pk=setting.pk).update(school_name='New name')
+		invalidate_school_setting()
+		self.assertEqual(get_school_setting().school_name, 'New name')
+
+
+class NotificationFeedTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create(username='teacher', is_teacher=True)
+		for number in range(3):
+			notification = Notification.objects.create(
+				user=self.user, title='Read {}'.format(number), body='', message_type='info')
+			Notification.objects.filter(pk=notification.pk).update(
+				time=tz.now() - timedelta(days=3 - number))
+		Notification.objects.create(
+			user=self.user, title='Unread', body='', unread=True, message_type='info')
+
+	def test_nothing_is_read_until_used(self):
+		with self.assertNumQueries(0):
+			NotificationFeed(self.user)
+
+	def test_counts_cover_every_notification(self):
+		feed = NotificationFeed(self.user, limit=2)
+		self.assertEqual((feed.unread_count, len(feed)), (1, 4))
+		self.assertTrue(feed)
+		self.assertFalse(NotificationFeed(User.objects.create(username='parent')))
+
+	def test_latest_notifications_are_listed_unread_first(self):
+		titles = [notification.title for notification in NotificationFeed(self.user, limit=2)]
+		self.assertEqual(titles, ['Unread', 'Read 2'])
+
+
+@override_settings(
+	MEDIA_ROOT=tempfile.mkdtemp(), DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+class ReportCacheTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		self.key = report_key('broadsheet', self.clss.pk, self.session.pk, 'First')
+		self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT, True)
+
+	def store(self, key):
+		return default_storage.save(cache_path(key, 'broadsheet.pdf'), ContentFile(b'%PDF-1.4'))
+
+	def get(self, key, **headers):
+		path = cached_report(key, 'broadsheet.pdf')
+		return serve_report(RequestFactory().get('/', **headers), path, 'broadsheet.pdf', etag=key)
+
+	def test_key_addresses_the_report_and_its_parameters(self):
+		self.assertEqual(self.key, report_key('broadsheet', self.clss.pk, self.session.pk, 'First'))
+		self.assertNotEqual(self.key, report_key('broadsheet', self.clss.pk, self.session.pk, 'Second'))
+		self.assertNotEqual(self.key, report_key('class_members', self.clss.pk, self.session.pk, 'First'))
+		with mock.patch.object(connection, 'schema_name', 'other_school'):
+			self.assertNotEqual(self.key, report_key('broadsheet', self.clss.pk, self.session.pk, 'First'))
+
+	def test_key_changes_with_the_data(self):
+		version = report_version()
+		self.assertEqual(report_version(), version)
+		invalidate_report_version()
+		self.assertNotEqual(report_version(), version)
+		self.assertNotEqual(self.key, report_key('broadsheet', self.clss.pk, self.session.pk, 'First'))
+
+	def test_cached_report(self):
+		self.assertIsNone(cached_report(self.key, 'broadsheet.pdf'))
+		path = self.store(self.key)
+		self.assertEqual(cached_report(self.key, 'broadsheet.pdf'), path)
+
+	def test_report_is_served_with_its_etag(self):
+		self.store(self.key)
+		response = self.get(self.key)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response['ETag'], '"{}"'.format(self.key))
+		self.assertEqual(response['Content-Type'], 'application/pdf')
+		self.assertIn('no-cache', response['Cache-Control'])
+		self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4')
+
+	def test_unchanged_report_is_not_sent_again(self):
+		self.store(self.key)
+		response = self.get(self.key, HTTP_IF_NONE_MATCH='"{}"'.format(self.key))
+		self.assertEqual(response.status_code, 304)
+		self.assertEqual(response['ETag'], '"{}"'.format(self.key))
+
+		# once the data changed, the report is built again under another key
+		invalidate_report_version()
+		key = report_key('broadsheet', self.clss.pk, self.session.pk, 'First')
+		self.store(key)
+		response = self.get(key, HTTP_IF_NONE_MATCH='"{}"'.format(self.key))
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response['ETag'], '"{}"'.format(key))
+
+
+class MailMergeTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		self.student = self.add_student('JSS1/001')
+		self.student.user.first_name = '<b>Ada</b>'
+		self.student.user.last_name = 'Lovelace & Co'
+		self.student.user.save()
+		self.parent = User.objects.create(username='parent', first_name='Mary', is_parent=True)
+		Parent.objects.create(parent=self.parent).student.add(self.student)
+		self.add_grade(self.student, self.maths, 75)
+		self.setting = get_school_setting()
+
+	def merge(self, *users):
+		return MailMerge(users, self.session, 'First', self.setting, today=datetime.date(2026, 10, 5))
+
+	def queries(self, users):
+		with CaptureQueriesContext(connection) as queries:
+			merge = self.merge(*users)
+			for user in users:
+				merge.values(user)
+		return len(queries)
+
+	def test_fields_of_the_template(self):
+		template = MergeTemplate('Dear ==fname==, ==clss== ==fname==')
+		self.assertEqual(template.fields, {'fname', 'clss'})
+
+	def test_unknown_and_missing_fields_render_empty(self):
+		template = MergeTemplate('Dear ==fname====unknown==, ==clss==. = =fname=')
+		self.assertEqual(template.render({'fname': 'Ada'}), 'Dear Ada, . = =fname=')
+
+	def test_values_are_escaped(self):
+		template = MergeTemplate('==fullname== of ==clss==')
+		self.assertEqual(
+			self.merge(self.student.user).render(template, self.student.user),
+			'&lt;b&gt;Ada&lt;/b&gt; Lovelace &amp; Co of JSS 1')
+
+	def test_student_values(self):
+		values = self.merge(self.student.user).values(self.student.user)
+		self.assertEqual(values['amount'], '<i>Not paid</i>')
+		self.assertEqual(values['attnd'], 'Absent')
+		self.assertIn('<li style="color: green">Mathematics</li>', values['clssub'])
+		self.assertIn('<span>Mathematics</span>', values['grades'])
+
+	def test_parent_values_cover_the_children(self):
+		Payment.objects.create(
+			student=self.student, paid_amount=5000, due_amount=0, session=self.session, term='First',
+			payment_method=CASH, payment_status=PAID)
+		values = self.merge(self.parent).values(self.parent)
+		self.assertEqual(values['amount'], '&lt;b&gt;Ada&lt;/b&gt; has paid 5000.0 Naira')
+		self.assertEqual(values['attnd'], '&lt;b&gt;Ada&lt;/b&gt; is Absent today <small>(2026-10-05)</small>')
+
+	def test_audience_is_merged_in_a_fixed_number_of_queries(self):
+		queries = self.queries([self.student.user, self.parent])
+		users = [self.add_student('JSS1/{:03}'.format(n)).user for n in range(2, 6)]
+		self.assertEqual(self.queries(users + [self.student.user, self.parent]), queries)
+
+
+class TermAttendanceTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		self.student = self.add_student('JSS1/001')
+		self.monday = datetime.date(2026, 10, 5)
+
+	def day(self, number):
+		return self.monday + timedelta(days=number)
+
+	def summary(self, marks):
+		summary = TermAttendance(student=self.student, session=self.session, term='First')
+		for day, is_present, is_late in marks:
+			summary.mark(self.day(day), is_present, is_late)
+		return summary
+
+	def record(self, day, is_present, is_late=False):
+		Attendance.objects.create(
+			student=self.student, session=self.session, term='First', date=self.day(day),
+			is_present=is_present, is_late=is_late, is_late_for='5' if is_late else '0')
+
+	def test_status_of_a_day(self):
+		summary = self.summary([(0, True, False), (1, True, True), (2, False, False)])
+		self.assertEqual(summary.status(self.day(0)), (True, False))
+		self.assertEqual(summary.status(self.day(1)), (True, True))
+		self.assertEqual(summary.status(self.day(2)), (False, False))
+		# no roll call on those days
+		self.assertIsNone(summary.status(self.day(-1)))
+		self.assertIsNone(summary.status(self.day(5)))
+		self.assertEqual((summary.recorded_days, summary.present_days, summary.late_days), (3, 2, 1))
+		self.assertEqual(summary.absent_days, 1)
+		self.assertEqual(summary.present_rate, 66.67)
+
+	def test_marking_a_day_again_replaces_it(self):
+		summary = self.summary([(0, True, True), (0, False, False)])
+		self.assertEqual(summary.status(self.day(0)), (False, False))
+		self.assertEqual((summary.recorded_days, summary.present_days, summary.late_days), (1, 0, 0))
+
+	def test_day_before_the_start_shifts_the_bitmaps(self):
+		summary = self.summary([(3, True, False), (0, False, False)])
+		self.assertEqual(summary.start, self.day(0))
+		self.assertEqual(summary.status(self.day(3)), (True, False))
+		self.assertEqual(summary.status(self.day(0)), (False, False))
+		self.assertIsNone(summary.status(self.day(1)))
+
+	def test_days_without_roll_call_do_not_break_a_streak(self):
+		# the weekend of days 5 and 6 has no roll call
+		summary = self.summary([
+			(0, True, False), (1, False, False), (2, True, False), (3, True, True),
+			(4, True, False), (7, True, False), (8, False, False), (9, True, False)])
+		self.assertEqual(summary.streaks(), (1, 4))
+		self.assertEqual(TermAttendance().streaks(), (0, 0))
+
+	def test_rebuild_from_the_attendance_rows(self):
+		self.record(0, True)
+		self.record(1, True, is_late=True)
+		self.record(2, False)
+		summary = rebuild_term_attendance(self.student, self.session, 'First')
+		self.assertEqual(get_term_attendance(self.student, self.session, 'First').pk, summary.pk)
+		self.assertEqual((summary.recorded_days, summary.present_days, summary.late_days), (3, 2, 1))
+
+		Attendance.objects.filter(date=self.day(2)).update(is_present=True)
+		summary = rebuild_term_attendance(self.student, self.session, 'First')
+		self.assertEqual(summary.status(self.day(2)), (True, False))
+		self.assertEqual(TermAttendance.objects.count(), 1)
+
+		Attendance.objects.all().delete()
+		self.assertIsNone(rebuild_term_attendance(self.student, self.session, 'First'))
+		self.assertFalse(TermAttendance.objects.exists())
+
+	def test_sheet_updates_the_bitmaps(self):
+		other = self.add_student('JSS1/002')
+		ids = [str(self.student.pk), str(other.pk)]
+		for day, present in ((self.day(0), ids), (self.day(1), ids[:1])):
+			AttendanceSheet(
+				self.session, 'First', day.isoformat(), ids, present, [], ['', '']).save()
+		summary = get_term_attendance(other, self.session, 'First')
+		self.assertEqual(summary.status(self.day(1)), (False, False))
+		self.assertEqual((summary.recorded_days, summary.present_days), (2, 1))
+		self.assertEqual(get_term_attendance(self.student, self.session, 'First').present_days, 2)
+
+
+class LedgerTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		self.students = 0
+		self.last_session = Session.objects.create(name='2025 / 2026', current_session=False)
+
+	def on(self, obj, month, year=2026):
+		day = tz.make_aware(datetime.datetime(year, month, 15, 12))
+		field = 'date_paid' if isinstance(obj, Payment) else 'timestamp'
+		type(obj).objects.filter(pk=obj.pk).update(**{field: day})
+
+	def pay(self, amount, month, term='First', session=None):
+		# a student pays once per term
+		self.students += 1
+		self.on(Payment.objects.create(
+			student=self.add_student('JSS1/{:03}'.format(self.students)), paid_amount=amount, due_amount=0,
+			session=session or self.session,
+			term=term, payment_method=CASH, payment_status=PAID), month)
+
+	def spend(self, amount, month, term='First', session=None):
+		self.on(Expense.objects.create(
+			item='Chalk', amount=amount, session=session or self.session, term=term), month)
+
+	def test_monthly_income_and_expenditure(self):
+		self.pay(1000, 9)
+		self.pay(500, 9, term='Second')
+		self.pay(2000, 10)
+		self.spend(300, 10)
+		self.spend(50, 1, term='Second')
+		self.pay(9999, 9, session=self.last_session)
+		ledger = Ledger.load()
+
+		monthly = ledger.monthly(self.session.pk)
+		self.assertEqual(monthly['income'][8:10], [1500, 2000])
+		self.assertEqual(monthly['expenditure'][0], 50)
+		self.assertEqual(monthly['expenditure'][9], 300)
+		self.assertEqual(sum(monthly['income']), 3500)
+		self.assertEqual(ledger.monthly(self.session.pk, 'First')['income'][8], 1000)
+
+		self.assertEqual(
+			ledger.totals(self.session.pk), {'income': 3500, 'expenditure': 350, 'balance': 3150})
+		self.assertEqual(
+			[(row['term'], row['balance']) for row in ledger.by_term(self.session.pk)],
+			[('First', 2700), ('Second', 450), ('Third', 0)])
+
+	def test_trend_of_the_sessions(self):
+		self.pay(1000, 9)
+		self.pay(9999, 9, session=self.last_session)
+		trend = Ledger.load().trend([self.last_session, self.session])
+		self.assertEqual([row['session'] for row in trend], ['2025 / 2026', '2026 / 2027'])
+		self.assertEqual([row['income'] for row in trend], [9999, 1000])
+
+	def test_ledger_is_loaded_with_one_query_per_model(self):
+		self.pay(1000, 9)
+		self.spend(300, 10)
+		with self.assertNumQueries(2):
+			ledger = get_ledger()
+		with self.assertNumQueries(0):
+			self.assertIs(get_ledger(), ledger)
+		invalidate_finance()
+		self.assertEqual(get_ledger().totals(self.session.pk)['balance'], 700)
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2)
+class ExportTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		self.students = []
+		scores = (('JSS1/001', 'Ada', 80, 70), ('JSS1/002', 'Bola', 60, None), ('JSS1/003', 'Chidi', 90, 75))
+		for roll_number, first_name, maths, english in scores:
+			student = self.add_student(roll_number)
+			User.objects.filter(pk=student.user_id).update(first_name=first_name, last_name='Okafor')
+			self.add_grade(student, self.maths, maths)
+			if english is not None:
+				self.add_grade(student, self.english, english)
+			self.students.append(student)
+		# not graded
+		self.add_student('JSS1/004')
+
+	def test_score_sheet_rows(self):
+		Grade.objects.filter(student=self.students[0], subject=self.maths).update(fca=10, sca=None)
+		rows = list(score_sheet_rows(self.clss, self.session, 'First', self.maths))
+		self.assertEqual(rows[0], ('Roll number', 'Name', 'CA 1', 'CA 2', 'Exam', 'Total', 'Grade', 'Remark'))
+		self.assertEqual(rows[1], ('JSS1/001', 'Ada Okafor', 10, '', 80, 80, '', ''))
+		self.assertEqual([row[0] for row in rows[1:]], ['JSS1/001', 'JSS1/002', 'JSS1/003'])
+
+	def test_broadsheet_rows(self):
+		rows = list(broadsheet_rows(self.clss, self.session, 'First'))
+		self.assertEqual(rows, [
+			('Roll number', 'Name', 'Mathematics', 'English', 'Total', 'Average', 'Subjects', 'Position'),
+			('JSS1/001', 'Ada Okafor', 80, 70, 150, 75.0, 2, 2),
+			('JSS1/002', 'Bola Okafor', 60, '', 60, 30.0, 1, 3),
+			('JSS1/003', 'Chidi Okafor', 90, 75, 165, 82.5, 2, 1),
+		])
+
+	def test_broadsheet_is_ranked_before_streaming_without_writing_rankings(self):
+		rows = broadsheet_rows(self.clss, self.session, 'First')
+		# a grade saved while the rows are streamed does not change the positions
+		Grade.objects.filter(student=self.students[1], subject=self.maths).update(total=100)
+		self.assertEqual([row[-1] for row in list(rows)[1:]], [2, 3, 1])
+		self.assertFalse(Ranking.objects.exists())
+
+	def test_attendance_rows(self):
+		monday = datetime.date(2026, 10, 5)
+		for student, is_present, is_late in zip(self.students, (True, True, False), (False, True, False)):
+			Attendance.objects.create(
+				student=student, session=self.session, term='First', date=monday,
+				is_present=is_present, is_late=is_late, is_late_for='12' if is_late else '0')
+		self.assertEqual(list(attendance_rows(self.clss, self.session, 'First')), [
+			('Date', 'Roll number', 'Name', 'Status', 'Late', 'Late for'),
+			(monday, 'JSS1/001', 'Ada Okafor', 'Present', '', ''),
+			(monday, 'JSS1/002', 'Bola Okafor', 'Present', 'Yes', '12'),
+			(monday, 'JSS1/003', 'Chidi Okafor', 'Absent', '', ''),
+		])
+
+	def test_csv_is_streamed_row_by_row(self):
+		rows = broadsheet_rows(self.clss, self.session, 'First')
+		response = export_response(rows, 'broadsheet')
+		self.assertTrue(response.streaming)
+		self.assertEqual(response['Content-Disposition'], 'attachment; filename="broadsheet.csv"')
+		lines = [line.decode('utf-8') for line in response.streaming_content]
+		self.assertEqual(len(lines), 4)
+		self.assertEqual(lines[1], 'JSS1/001,Ada Okafor,80.0,70.0,150.0,75.0,2,2\r\n')
+
+	@skipUnless(openpyxl, 'openpyxl is not installed')
+	def test_xlsx(self):
+		rows = score_sheet_rows(self.clss, self.session, 'First', self.maths)
+		response = export_response(rows, 'maths', XLSX)
+		workbook = openpyxl.load_workbook(BytesIO(b''.join(response.streaming_content)))
+		rows = list(workbook['maths'].values)
+		self.assertEqual(rows[0][:2], ('Roll number', 'Name'))
+		self.assertEqual(rows[3][:2], ('JSS1/003', 'Chidi Okafor'))
+
+
+class ReportTagsTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		self.students = [self.add_student(str(i)) for i in range(1, 4)]
+		for student, (maths, english) in zip(self.students, ((80, 70), (60, 50), (90, 40))):
+			self.add_grade(student, self.maths, maths)
+			self.add_grade(student, self.english, english)
+		# totals 150, 110 and 130, another class takes mathematics too
+		other = Class.objects.create(name='JSS 2', section=self.section)
+		self.add_grade(self.add_student('9', clss=other), self.maths, 100)
+		self.report = ClassReport(self.clss, self.session, 'First')
+		self.report.students
+
+	def values(self, context):
+		first = self.students[0]
+		return [
+			tags.get_subject(context, self.maths.pk),
+			tags.get_student_full_name(context, first.pk),
+			tags.get_subject_total_score(context, self.english.pk, first.pk),
+			tags.get_overall_total(context, first.pk, 'First', self.session.pk),
+			[tags.get_student_rank(context, self.clss.pk, self.session.pk, 'First', student.pk)
+				for student in self.students],
+			tags.get_class_avg(context, self.clss, self.session, 'First', 3),
+			tags.get_subject_avg(context, self.maths.pk, self.session, self.clss, 3, 'First'),
+		]
+
+	def test_tags_are_answered_from_the_report(self):
+		context = Context({'report': self.report})
+		with self.assertNumQueries(0):
+			values = self.values(context)
+		self.assertEqual(values, [self.maths, 'student1', 70, 150, [1, 3, 2], 130.0, 76.67])
+
+	def test_tags_query_the_database_without_a_report(self):
+		self.assertEqual(
+			self.values(Context()), [self.maths, 'student1', 70, 150, [1, 3, 2], 130.0, 76.67])
+
+	def test_report_of_another_term_is_not_used(self):
+		self.add_grade(self.students[0], self.maths, 10, term='Second')
+		context = Context({'report': self.report})
+		self.assertEqual(tags.get_overall_total(context, self.students[0].pk, 'Second', self.session.pk), 10)
+		self.assertEqual(tags.get_class_avg(context, self.clss, self.session, 'Second', 1), 10)
+
+	def test_averages_without_grades(self):
+		context = Context()
+		self.assertEqual(tags.get_class_avg(context, self.clss, self.session, 'Third', 3), 0)
+		self.assertEqual(tags.get_subject_avg(context, self.maths.pk, self.session, self.clss, 3, 'Third'), 0)
+
+
+class DashboardTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		self.clss.amount_to_pay = 25000
+		self.clss.save()
+		Class.objects.create(name='JSS 2', section=self.section, amount_to_pay=30000)
+		self.students = [self.add_student(str(i)) for i in range(1, 4)]
+		self.teacher = User.objects.create(username='teacher', is_teacher=True)
+		self.parent = User.objects.create(username='parent', is_parent=True)
+		Parent.objects.create(parent=self.parent).student.add(*self.students[:2])
+		assignment = SubjectAssign.objects.create(
+			teacher=self.teacher, clss=self.clss, session=self.session, term='First')
+		assignment.subjects.add(self.maths)
+
+	def test_school_counts_are_read_with_one_query(self):
+		with self.assertNumQueries(1):
+			counts = school_counts()
+		self.assertEqual(counts, {
+			'no_parents': 1, 'no_students': 3, 'no_teachers': 1, 'no_classes': 2, 'no_subjects': 2,
+			'target_income': 55000})
+		with self.assertNumQueries(0):
+			school_counts()
+
+	def test_student_dashboard(self):
+		context = dashboard(self.students[0].user, self.session, 'First')
+		self.assertEqual((context['no_students'], context['no_subjects']), (3, 2))
+		self.assertEqual(context['student'], self.students[0])
+
+	def test_teacher_dashboard(self):
+		context = dashboard(self.teacher, self.session, 'First')
+		self.assertEqual(
+			(context['no_teachers'], context['no_students'], context['no_parents'], context['no_subjects']),
+			(1, 3, 1, 1))
+		self.assertEqual(dashboard(self.teacher, self.session, 'Second')['no_students'], 0)
+
+	def test_parent_dashboard(self):
+		context = dashboard(self.parent, self.session, 'First')
+		self.assertEqual(context['students'], self.students[:2])
+		self.assertEqual((context['no_students'], context['no_classes']), (2, 2))
+
+
+@override_settings(
+	MAIL_BACKGROUND=False, MAIL_BATCH_SIZE=2, MAIL_RATE_LIMIT=1000, MAIL_MAX_ATTEMPTS=2,
+	MAIL_RETRY_BACKOFF=0)
+class MailerTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		self.users = []
+		for number in range(1, 4):
+			self.users.append(User.objects.create(
+				username='teacher{}'.format(number), first_name='Teacher {}'.format(number),
+				email='teacher{}@example.com'.format(number), is_teacher=True))
+		self.mail = EmailMessage.objects.create(
+			admin=User.objects.create(username='admin', is_superuser=True), title='Notice',
+			content='Dear ==fname==, school resumes')
+		# a recipient without an address is left out
+		self.mail.recipients.add(*self.users, User.objects.create(username='no_email'))
+
+	def test_every_recipient_gets_a_personalized_message(self):
+		queue_mail(self.mail)
+		self.mail.refresh_from_db()
+		self.assertEqual((self.mail.status, self.mail.sent, self.mail.failed), (DELIVERED, 3, 0))
+		self.assertEqual([message.to for message in mail.outbox], [[user.email] for user in self.users])
+		self.assertIn('Dear Teacher 2, school resumes', mail.outbox[1].body)
+
+	def test_mail_is_only_sent_once(self):
+		queue_mail(self.mail)
+		queue_mail(self.mail)
+		self.assertEqual(len(mail.outbox), 3)
+
+	def test_failed_message_is_retried_alone(self):
+		send_messages = locmem.EmailBackend.send_messages
+		attempts = []
+
+		def failing(backend, messages):
+			attempts.append(messages[0].to)
+			if messages[0].to == [self.users[1].email] and attempts.count(messages[0].to) < 3:
+				raise ConnectionError('connection reset')
+			return send_messages(backend, messages)
+
+		with mock.patch.object(locmem.EmailBackend, 'send_messages', failing):
+			queue_mail(self.mail)
+		self.mail.refresh_from_db()
+		self.assertEqual((self.mail.status, self.mail.sent, self.mail.failed), (FAILED, 2, 1))
+		self.assertEqual(self.mail.error, 'connection reset')
+		# the messages before the failure are not sent twice
+		self.assertEqual(
+			[message.to for message in mail.outbox], [[self.users[0].email], [self.users[2].email]])
+
+	def test_interrupted_mail_is_resumed(self):
+		EmailMessage.objects.filter(pk=self.mail.pk).update(
+			status=SENDING, sent=1, progress_on=tz.now() - timedelta(minutes=30))
+		self.assertEqual(resume_stalled(minutes=10), 2)
+		self.assertEqual([message.to for message in mail.outbox], [[user.email] for user in self.users[1:]])
+		self.assertEqual(EmailMessage.objects.get(pk=self.mail.pk).status, DELIVERED)
+
+	def test_mail_in_progress_is_not_resumed(self):
+		EmailMessage.objects.filter(pk=self.mail.pk).update(status=SENDING, progress_on=tz.now())
+		self.assertEqual(resume_stalled(minutes=10), 0)
+		self.assertEqual(mail.outbox, [])
+
+
+class AcademicContextTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		Setting.objects.filter(pk=get_school_setting().pk).update(
+			st_begins=datetime.date(2027, 1, 5), st_ends=datetime.date(2027, 4, 1),
+			tt_begins=datetime.date(2027, 4, 20), tt_ends=datetime.date(2027, 7, 20))
+		invalidate_school_setting()
+
+	def test_term_of_the_day(self):
+		self.assertEqual(get_current_term(datetime.date(2026, 11, 2)), 'First')
+		self.assertEqual(get_current_term(datetime.date(2027, 1, 5)), 'Second')
+		self.assertEqual(get_current_term(datetime.date(2027, 7, 20)), 'Third')
+		# holidays count as the first term
+		self.assertEqual(get_current_term(datetime.date(2027, 4, 10)), 'First')
+
+	def test_context_is_resolved_once_per_request(self):
+		request = RequestFactory().get('/')
+		context = get_academic_context(request)
+		self.assertEqual(context.session, self.session)
+		with self.assertNumQueries(0):
+			self.assertIs(get_academic_context(request), context)
+
+	def test_current_session_follows_the_sessions(self):
+		self.assertEqual(get_current_session(), self.session)
+		Session.objects.filter(pk=self.session.pk).update(current_session=False)
+		session = Session.objects.create(name='2027 / 2028', current_session=True)
+		invalidate_sessions()
+		self.assertEqual(get_current_session(), session)
+
+
+def fake_pdf(html, base_url, css_string):
+	return 'PDF {}'.format(html).encode('utf-8')
+
+
+@override_settings(
+	PDF_WORKERS=0, REPORT_JOB_MAX_AGE=3600, MEDIA_ROOT=tempfile.mkdtemp(),
+	DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+@mock.patch('sms.pdf.render_pdf', fake_pdf)
+class ReportJobTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT, True)
+		self.request = RequestFactory().get('/reports/')
+		self.request.user = User.objects.create(username='admin', is_superuser=True)
+
+	def read(self, job):
+		with job.file.open('rb') as f:
+			return f.read()
+
+	def test_report_is_rendered_and_stored(self):
+		job = queue_report(self.request, 'Class members', 'members.pdf', '<p>JSS 1</p>')
+		self.assertEqual(job.status, JOB_DONE)
+		self.assertIsNotNone(job.finished_on)
+		self.assertEqual(self.read(job), b'PDF <p>JSS 1</p>')
+
+	def test_cached_report_is_stored_under_its_key(self):
+		key = report_key('class_members', self.clss.pk)
+		job = queue_report(self.request, 'Class members', 'members.pdf', '<p>JSS 1</p>', cache_key=key)
+		self.assertEqual(job.file.name, cached_report(key, 'members.pdf'))
+		# a second job of the same report shares the file
+		again = queue_report(self.request, 'Class members', 'members.pdf', '<p>JSS 1</p>', cache_key=key)
+		self.assertEqual(again.file.name, job.file.name)
+
+	def test_failed_rendering_fails_the_job(self):
+		with mock.patch('sms.pdf.render_pdf', side_effect=ValueError('bad markup')):
+			job = queue_report(self.request, 'Class members', 'members.pdf', '<p>JSS 1</p>')
+		self.assertEqual((job.status, job.error), (JOB_FAILED, 'bad markup'))
+		self.assertFalse(job.file)
+
+	def test_parts_are_merged_in_order(self):
+		parts = [(None, '<p>{}</p>'.format(number)) for number in range(3)]
+		with mock.patch('sms.pdf.merge_pdfs', side_effect=b'|'.join) as merge:
+			job = queue_report(self.request, 'Report sheets', 'reports.pdf', parts)
+		self.assertEqual(merge.call_count, 1)
+		self.assertEqual(self.read(job), b'PDF <p>0</p>|PDF <p>1</p>|PDF <p>2</p>')
+
+	def test_parts_are_bundled_in_a_zip(self):
+		parts = [('JSS1-001.pdf', '<p>Ada</p>'), ('JSS1-002.pdf', '<p>Bola</p>')]
+		job = queue_report(self.request, 'Report sheets', 'reports.zip', parts)
+		with zipfile.ZipFile(BytesIO(self.read(job))) as archive:
+			self.assertEqual(archive.namelist(), ['JSS1-001.pdf', 'JSS1-002.pdf'])
+			self.assertEqual(archive.read('JSS1-002.pdf'), b'PDF <p>Bola</p>')
+
+	def test_expired_jobs_are_purged_with_their_last_file(self):
+		key = report_key('class_members', self.clss.pk)
+		old = queue_report(self.request, 'Class members', 'members.pdf', '<p>JSS 1</p>', cache_key=key)
+		other = queue_report(self.request, 'Class members', 'members.pdf', '<p>JSS 1</p>', cache_key=key)
+		ReportJob.objects.filter(pk=old.pk).update(created_on=tz.now() - timedelta(hours=2))
+		purge_jobs()
+		self.assertFalse(ReportJob.objects.filter(pk=old.pk).exists())
+		# still used by the other job
+		self.assertTrue(default_storage.exists(other.file.name))
+		ReportJob.objects.filter(pk=other.pk).update(created_on=tz.now() - timedelta(hours=2))
+		purge_jobs()
+		self.assertFalse(default_storage.exists(other.file.name))
+
+
+class SyntheticSchoolTest(SchoolTestCase):
+	def test_school_of_the_given_volume(self):
+		session = generate_school(classes=2, subjects=3, students=5, terms=2, days=4)
+		self.assertEqual(get_current_session(), session)
+		students = Student.objects.filter(session=session)
+		self.assertEqual(students.count(), 5)
+		self.assertEqual(Grade.objects.filter(session=session).count(), 5 * 3 * 2)
+		self.assertEqual(Attendance.objects.filter(session=session).count(), 5 * 4 * 2)
+		self.assertEqual(Payment.objects.filter(session=session).count(), 5 * 2)
+		# two parents out of three have two children
+		self.assertEqual(
+			[parent.student.count() for parent in Parent.objects.order_by('pk')], [2, 2, 1])
+		self.assertEqual(Ranking.objects.filter(session=session, term='Second').count(), 5)
+		summaries = TermAttendance.objects.filter(session=session)
+		self.assertEqual(summaries.count(), 5 * 2)
+		self.assertTrue(all(summary.recorded_days == 4 for summary in summaries))
+
+	def test_school_days_are_weekdays(self):
+		days = school_days(1, 6)
+		self.assertEqual(days[0], datetime.date(2020, 12, 14))
+		self.assertEqual(len(days), 6)
+		self.assertTrue(all(day.weekday() < 5 for day in days))
+
+
+class TenantStatisticsTest(SchoolTestCase):
+	def setUp(self):
+		super().setUp()
+		for roll_number in range(1, 4):
+			self.add_student(roll_number)
+		User.objects.create(username='teacher', is_teacher=True)
+		Setting.objects.filter(pk=get_school_setting().pk).update(sms_unit=40)
+
+	def test_counts_of_the_school(self):
+		with self.assertNumQueries(2):
+			counts = statistics._counts()
+		self.assertEqual(counts, {'students': 3, 'teachers': 1, 'parents': 0, 'sms_unit': 40})
+
+	@skipUnless(connection.vendor == 'postgresql', 'the schools are PostgreSQL schemas')
+	def test_counts_are_rolled_up_in_the_public_schema(self):
+		schema_name = connection.schema_name
+		with schema_context(get_public_schema_name()):
+			statistics.refresh_counts(schema_name)
+			row = TenantStatistics.objects.get(tenant__schema_name=schema_name)
+			self.assertEqual((row.students, row.teachers, row.sms_unit), (3, 1, 40))
+			self.assertEqual(statistics.get_platform_totals()['students'], 3)
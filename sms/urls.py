@@ -34,6 +34,7 @@ urlpatterns = [
 	path('score/entry/', views.score_list, name="score_list"),
 	path('score/entry/add/', views.score_entry, name="score_entry"),
 	path('api/chart/', views.expenditure_graph, name="expense_graph_url"),
+	path('api/chart/trend/', views.finance_trend, name="finance_trend_url"),
 	path('system/administrators/', views.system_admin, name="system_admin"),
 	path('system/administrators/add/', views.add_system_admin, name="add_system_admin"),
 	path('profile/<int:user_id>/', views.profile, name="profile"),
@@ -63,6 +64,10 @@ urlpatterns = [
 	path('ajax/load/students/users/', views.load_student_users, name="ajax_load_student_users"),
 	path('report/student/', views.create_report_student, name="create_report_student"),
 	path('report/pdf/', views.report_student, name="report_student"),
+	path('report/job/<int:pk>/', views.report_job, name="report_job"),
+	path('report/job/<int:pk>/status/', views.report_job_status, name="report_job_status"),
+	path('report/job/<int:pk>/download/', views.report_job_download, name="report_job_download"),
+	path('report/cached/<str:key>/<str:filename>', views.report_cached, name="report_cached"),
 	path('grade-scale/', views.grade_scale, name="grade_scale"),
 	path('set-grade-scale/', views.set_grade_scale, name="set_grade_scale"),
 	path('promotion/', views.promotion, name="promotion_list"),
@@ -91,6 +96,10 @@ urlpatterns = [
 	path('subject/report/', views.subject_report, name="subject_report"),
 	path('broadsheet/report/view', views.broadsheet_report_view, name="broadsheet_report_view"),
 	path('broadsheet/report/', views.broadsheet_report, name="broadsheet_report"),
+	path('export/broadsheet/', views.export_broadsheet, name="export_broadsheet"),
+	path('export/scores/', views.export_score_sheet, name="export_score_sheet"),
+	path('export/payments/', views.export_payments, name="export_payments"),
+	path('export/attendance/', views.export_attendance, name="export_attendance"),
 	path('onlineadmission/applicant/<int:pk>/view/', views.view_detail_applicant, name='view_detail_applicant'),
 	path('ajax/classes/', views.ajax_get_all_classes, name='get_classes'),
 	path('ajax/users/', views.ajax_get_users_list, name='get_users_list'),
@@ -7,9 +7,10 @@ from django.core.mail import send_mail
 from django.contrib import messages
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.decorators import login_required
-from django.db.models import Avg, Count, Min, Sum, CharField, Value, Q
-from django.http import HttpResponse, JsonResponse, HttpResponseRedirect
-from django.urls import reverse_lazy
+from django.db.models import Avg, Count, Min, Q
+from django.http import Http404, HttpResponse, JsonResponse, HttpResponseRedirect
+from django.urls import reverse, reverse_lazy
+from django.utils.text import slugify
 
 from django.shortcuts import (
 	get_object_or_404, 
@@ -26,15 +27,22 @@ from .decorators import (teacher_required,
 						admin_required)
 from .models import *
 from constants import *
-from django.db import IntegrityError
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 
-from . sms_sender import send_sms
+from . sms_sender import queue_sms, send_sms
 
 from django.views.decorators.http import require_http_methods
 
-import asyncio
 
-from .remark import getRemark, getGrade
+from .reports import ClassReport
+from .attendance import AttendanceSheet, class_attendance, class_attendance_by_student, get_term_attendance
+from .dashboard import dashboard
+from .finance import get_ledger
+from .grading import ScoreSheet
+from . import exports
+from .pdf import PAGE_LANDSCAPE, cached_report, queue_report, report_key, serve_report
+from .school import get_academic_context, get_all_sessions
 from frontend.models import OnlineAdmission
 from .forms import (AddStudentForm,
 					AddParentForm,
@@ -66,36 +74,11 @@ from .forms import (AddStudentForm,
 					ProfilePictureForm,
 					EmailMessageForm,)
 
-from django.template.loader import render_to_string
 
 
-INDEX = lambda items, key, item: list(items.values_list(key, flat=True)).index(item)+1
-
-def get_item_index(items, key, item):
-	try:
-		return INDEX(items, key, item)
-	except Exception as e:
-		return 0
-
+from collections import OrderedDict
 import logging
 DB_LOGGER = logging.getLogger(__name__)
-def get_subject_report_data(grades, subjects, student, student_grades):
-	result = []
-	for subject in subjects:
-		sub_grades = grades.filter(subject=subject)
-		sub_student_grades = student_grades.filter(subject=subject)
-		if sub_student_grades.exists():
-			#DB_LOGGER.error('%r===%r='%(sub_grades.values_list('total',flat=True), student_grades.filter(subject=subject).first().total))
-
-			# print ('#'*10,sub_grades.values_list('total',flat=True), student_grades.filter(subject=subject).first().total)
-			sub_rank = get_item_index(sub_grades, 'total', student_grades.filter(subject=subject).first().total)
-			#DB_LOGGER.error('%r===%r='%(student, sub_rank))
-
-			# sub_rank = get_item_index(sub_grades, 'total', sub_student_grades.first().pk)
-			sub_student_grades = sub_student_grades.annotate(rank=Value(sub_rank, output_field=CharField()))
-			result+=sub_student_grades.values()
-	return result
-
 
 
 @admin_required
@@ -106,11 +89,18 @@ def report_student(request):
 	template ='sms/student/report_student.html'
 	class_id = data.get('class')
 	term = data.get('term')
+	# one merged PDF for the class, or a ZIP with a PDF per student
+	output = 'zip' if data.get('output') == 'zip' else 'pdf'
+	filename = 'report.{}'.format(output)
 	if not any([class_id, term]):
 		messages.success(request, 'Missing data class %s in term %r '%(class_id, term))
 		return redirect('create_report_student')
 	clss = get_object_or_404(Class, pk=class_id)
-	current_session = Session.objects.get(current_session=True)
+	current_session = get_academic_context(request).session
+	key = report_key('report_student', clss.pk, current_session.pk, term, output)
+	cached = cached_report_response(request, key, filename)
+	if cached is not None:
+		return cached
 	students = Student.objects.filter(in_class=clss, session=current_session)
 	if not students.exists():
 		messages.success(request, 'No students exists for class %s in term %r '%(clss, term))
@@ -122,163 +112,114 @@ def report_student(request):
 		messages.success(request, 'No subjects exists for class %s in term %r '%(clss, term))
 		return redirect('create_report_student')
 
-	grades = Grade.objects.filter(term=term, student__in_class=clss,session=current_session).order_by('-total')
-	if not grades.exists():
+	report = ClassReport(clss, current_session, term, subjects)
+	if not report.exists():
 		messages.success(request, 'No grades exists for class %s in term %r '%(clss, term))
 		return redirect('create_report_student')
 
-
-	grades_ordered= grades\
-	.values('student')\
-	.annotate(total_mark=Sum('total'))\
-	.order_by('-total_mark')
-	total_marks = [i.get('total_mark') for i in grades_ordered]
-	records = {}
-	highest = grades_ordered.first()['total_mark']
-	lowest = grades_ordered.last()['total_mark']
-	count = 0
-	for student in students:
-		try:
-			total_mark = (grades_ordered.get(student=student.pk)['total_mark'])
-			setattr(student, 'total_mark', total_mark)
-			student_rank = total_marks.index(total_mark)+1
-			setattr(student, 'student_rank', student_rank)
-			count += 1
-			student_grades = grades.filter(student=student)
-			data = get_subject_report_data(grades, subjects, student, student_grades)
-			records[student.id] = (student,data)
-
-		except Exception as e:
-			DB_LOGGER.error('=====================%r'%(e))
-	if not count:
+	records = report.records()
+	if not records:
 		messages.success(request, 'No reports exists for class %s in term %r '%(clss, term))
 		return redirect('create_report_student')
 
-	response = HttpResponse(content_type='application/pdf')
-	response['Content-Disposition'] = 'attachment; filename="report.pdf"'
-	# return render(request, template, context)
 	setting = Setting.objects.first()
 	scale = GradeScale.objects.all().order_by('grade')
-	se_tion = Session.objects.get(current_session=True)
-	context = {'results':records,'term':term,'setting':setting, 'highest':highest, 'lowest':lowest, 'number_of_student': grades_ordered.count(), 'gradeScale': scale, 'se_tion': se_tion}
+	context = {'results':records,'term':term,'setting':setting, 'highest':report.highest, 'lowest':report.lowest, 'number_of_student': report.number_of_students, 'gradeScale': scale, 'se_tion': current_session, 'report': report}
 
-	from weasyprint import HTML, CSS
+	# the cards are laid out by chunks of students in parallel, bounding
+	# the memory WeasyPrint needs for a whole class
 	template = get_template(template)
-	html = template.render(context)
+	records = list(records.items())
+	if output == 'zip':
+		parts = []
+		for pk, (student, rows) in records:
+			html = template.render(dict(context, results=OrderedDict([(pk, (student, rows))])))
+			parts.append(('{}.pdf'.format(student.roll_number.replace('/', '-')), html))
+	else:
+		size = settings.REPORT_CHUNK_SIZE
+		parts = [
+			(None, template.render(dict(context, results=OrderedDict(records[i:i + size]))))
+			for i in range(0, len(records), size)
+		]
+	job = queue_report(request, 'Report sheets of {} ({} term)'.format(clss, term), filename, parts, cache_key=key)
+	return report_job_response(request, job)
 
-	css_string = """@page {
-		size: a4 portrait;
-		margin: 1mm;
-		counter-increment: page;
-	}"""
 
-	pdf_file = HTML(string=html, base_url=request.build_absolute_uri()).write_pdf(
-			stylesheets=[CSS(string=css_string)],presentational_hints=True)
+def report_job_response(request, job):
+	""" JSON status for AJAX callers, otherwise the page polling the job """
+	if request.is_ajax():
+		return report_job_status(request, job.pk)
+	return redirect('report_job', pk=job.pk)
 
 
-	response = HttpResponse(pdf_file, content_type='application/pdf')
-	response['Content-Disposition'] = 'filename="home_page.pdf"'
-	return response
-	return HttpResponse(response.getvalue(), content_type='application/pdf')
+def cached_report_response(request, key, filename):
+	""" The cached PDF of a report, None when it has to be generated """
+	if cached_report(key, filename) is None:
+		return None
+	if request.is_ajax():
+		return JsonResponse({
+			'id': None,
+			'name': filename,
+			'status': JOB_DONE,
+			'error': None,
+			'url': reverse('report_cached', kwargs={'key': key, 'filename': filename}),
+		})
+	return report_cached(request, key, filename)
 
 
 @login_required
 @admin_required
-def create_report_student(request):
-	classes = Class.objects.all()
-	context = {"classes": classes}
-	return render(request, 'sms/student/create_report_student.html', context)
+def report_cached(request, key, filename):
+	path = cached_report(key, filename)
+	if path is None:
+		raise Http404('The report is no longer cached')
+	return serve_report(request, path, filename, etag=key)
+
 
 @login_required
-def home(request):
-	context = {}
-	no_classes = Class.objects.all().count()
-	no_subjects = Subject.objects.all().count()
-	no_parents = User.objects.filter(is_parent=True).count()
-	no_students = User.objects.filter(is_student=True).count()
-	no_teachers = User.objects.filter(is_teacher=True).count()
-	current_session = Session.objects.get(current_session=True)
-	
-	if request.user.is_superuser:
-		sms_unit = Setting.objects.first().sms_unit
-		target_income = 0
-		classes = Class.objects.all()
-		for clss in classes:
-			if clss.amount_to_pay is not None:
-				target_income += clss.amount_to_pay
-
-		context["no_students"] = no_students
-		context["no_parents"] = no_parents
-		context["no_subjects"] = no_subjects
-		context["no_classes"] = no_classes
-		context["no_teachers"] = no_teachers
-		context["target_income"] = int(target_income)
-		context['sms_unit'] = sms_unit
-		context['colxl'] = 2
+def report_job(request, pk):
+	job = get_object_or_404(ReportJob, pk=pk, user=request.user)
+	if request.is_ajax():
+		return report_job_status(request, pk)
+	if job.status == JOB_DONE:
+		return redirect('report_job_download', pk=job.pk)
+	return render(request, 'sms/reports/report_job.html', {'job': job})
 
-	elif request.user.is_student:
-		student = Student.objects.get(user__pk=request.user.pk, session=current_session)
-		p = Payment.objects.filter(student=student, session=current_session)
-		no_students = Student.objects.filter(in_class__pk=student.in_class.pk, session=current_session).count()
-		subjects_q = get_object_or_404(Class, pk=student.in_class.pk).subjects
-		subjects = subjects_q.all
-		no_subjects = subjects_q.count()
-		context = {
-		"no_students": no_students,
-		"no_parents": no_parents,
-		"no_subjects": no_subjects,
-		"no_classes": no_classes,
-		"no_teachers": no_teachers,
-		"subjects": subjects,
-		"student": student,
-		"p":p,
-		"colxl": 3,
-		}
-	elif request.user.is_teacher:
-		# Get all the subjects assigned to the teacher
-		subjects = SubjectAssign.objects.filter(teacher__id=request.user.id, session=current_session, term=get_terms())
-		
-		# show number of those students in any class that
-		# the teacher is being assigned a subject
 
-		# then, count the parents of those students
-		
-		no_students = 0
-		no_parents = 0
+@login_required
+def report_job_status(request, pk):
+	job = get_object_or_404(ReportJob, pk=pk, user=request.user)
+	data = {
+		'id': job.pk,
+		'name': job.name,
+		'status': job.status,
+		'error': job.error,
+		'url': None,
+	}
+	if job.status == JOB_DONE:
+		data['url'] = reverse('report_job_download', kwargs={'pk': job.pk})
+	return JsonResponse(data)
 
-		# also skip those students with no parent.
 
-		parent_ids = ()
-		for clss in subjects:
-			no_students += Student.objects.filter(in_class__pk=clss.clss.id, session=current_session).count()
-			
-			if Parent.objects.filter(student__in_class__pk=clss.clss.id).exists():
-				if not Parent.objects.filter(student__in_class__pk=clss.clss.id).first().id in parent_ids:
-					no_parents += Parent.objects.filter(student__in_class__pk=clss.clss.id).count()
-					parent_ids += (Parent.objects.filter(student__in_class__pk=clss.clss.id).first().id,)
+@login_required
+def report_job_download(request, pk):
+	job = get_object_or_404(ReportJob, pk=pk, user=request.user, status=JOB_DONE)
+	if not job.file or not job.file.storage.exists(job.file.name):
+		raise Http404('The report file no longer exists')
+	return serve_report(request, job.file.name, job.filename, etag=job.cache_key)
 
-		context = {
-		"no_students": no_students,
-		"no_parents": len(parent_ids),
-		"no_subjects": subjects.count(),
-		"no_teachers": no_teachers,
-		"allocated_subjects": subjects,
-		"colxl": 3,
-	}
-	elif request.user.is_parent:
-		no_classes = Class.objects.all().count()
-		no_subjects = Subject.objects.all().count()
-		no_teachers = User.objects.filter(is_teacher=True).count()
-		parent = Parent.objects.get(parent__pk=request.user.id)
-		context = {
-		"no_students": parent.student.filter(session=current_session).count(),
-		"no_parents": 1,
-		"no_subjects": no_subjects,
-		"no_classes": no_classes,
-		"no_teachers": no_teachers,
-		"students": parent.student.filter(session=current_session),
-		"colxl": 3,
-		}
+
+@login_required
+@admin_required
+def create_report_student(request):
+	classes = Class.objects.all()
+	context = {"classes": classes}
+	return render(request, 'sms/student/create_report_student.html', context)
+
+@login_required
+def home(request):
+	session, term = get_academic_context(request)
+	context = dashboard(request.user, session, term)
 	return render(request, 'sms/home.html', context)
 
 
@@ -287,36 +228,26 @@ def home(request):
 @admin_required
 @require_http_methods(["GET"])
 def expenditure_graph(request):
-	current_session = Session.objects.get(current_session=True)
-	
-	expenditures = Expense.objects.filter(session=current_session, term=get_terms())
-	expenditures_by_month = [0] * 12
-	for month in range(1, 13):
-		for expenditure in expenditures.filter(timestamp__month=month):
-			m = expenditure.timestamp.month
-			if expenditures_by_month[m-1] in expenditures_by_month:
-				expenditures_by_month[m-1] += expenditure.amount
-			else:
-				expenditures_by_month[m-1] = expenditure.amount
-
-	payments = Payment.objects.filter(session=current_session, term=get_terms())
-	payments_by_month = [0] * 12
-	for month in range(1, 13):
-		for payment in payments.filter(date_paid__month=month):
-			m = payment.date_paid.month
-			if payments_by_month[m-1] in payments_by_month:
-				payments_by_month[m-1] += payment.paid_amount
-			else:
-				payments_by_month[m-1] = payment.paid_amount
-
-	data = {
-		"expenditure": expenditures_by_month,
-		"income": payments_by_month,
-		"current_session": current_session.name,
-		}
+	current_session, term = get_academic_context(request)
+	data = get_ledger().monthly(current_session.pk, term)
+	data["current_session"] = current_session.name
 	return JsonResponse(data)
 
 
+@login_required
+@admin_required
+@require_http_methods(["GET"])
+def finance_trend(request):
+	""" Income and expenditure of every session, or of the sessions
+		given as ``session`` ids, to compare them.
+	"""
+	sessions = get_all_sessions()
+	ids = request.GET.getlist('session')
+	if ids:
+		sessions = [session for session in sessions if str(session.pk) in ids]
+	return JsonResponse({"sessions": get_ledger().trend(sessions)})
+
+
 
 @login_required
 @teacher_required
@@ -326,11 +257,11 @@ def students_view(request):
 	# that he/she is been assigned a subject in.
 	# for current academic year, and current term
 	if request.user.is_teacher:
-		current_session = Session.objects.get(current_session=True)
+		current_session = get_academic_context(request).session
 		classes = SubjectAssign.objects.filter(
 			teacher__id=request.user.id, 
 			session=current_session, 
-			term=get_terms())
+			term=get_academic_context(request).term)
 	context = {"classes": classes}
 	return render(request, 'sms/student/students.html', context)
 
@@ -342,7 +273,7 @@ def delete_user(request, id):
 	if user:
 		user_name = user.get_full_name()
 		if user.is_student:
-		    current_session = Session.objects.get(current_session=True)
+		    current_session = get_academic_context(request).session
 		    student = Student.objects.get(user__pk=user.pk, session=current_session)
 		    class_id = student.in_class.pk
 		    student.delete()
@@ -374,7 +305,7 @@ def delete_user(request, id):
 @login_required
 @teacher_required
 def students_list_view(request, id):
-    current_session = Session.objects.get(current_session=True)
+    current_session = get_academic_context(request).session
     students = Student.objects.filter(in_class__pk=id, session=current_session)
     selected_class = Class.objects.get(pk=id)
     classes = Class.objects.all()
@@ -384,11 +315,11 @@ def students_list_view(request, id):
 	# for current academic year, and current term
 
     if request.user.is_teacher:
-    	current_session = Session.objects.get(current_session=True)
+    	current_session = get_academic_context(request).session
     	classes = SubjectAssign.objects.filter(
     		teacher__id=request.user.id, 
 			session=current_session, 
-			term=get_terms())
+			term=get_academic_context(request).term)
     context = {
         "selected_class": selected_class,
         "students": students,
@@ -417,7 +348,7 @@ def assign_teacher_view(request):
 		return redirect('assign_teacher_list')
 	else:
 		term = request.GET.get('term')
-		current_session = Session.objects.get(current_session=True)
+		current_session = get_academic_context(request).session
 		assigned_teachers = SubjectAssign.objects.filter(term=term, session=current_session)
 		subjects = Subject.objects.all()
 		context = {
@@ -446,7 +377,7 @@ def add_assign_teacher(request):
 
 			class_id = Class.objects.get(pk=class_id)
 			teacher = User.objects.get(is_teacher=True, pk=teacher)
-			current_session = Session.objects.get(current_session=True)
+			current_session = get_academic_context(request).session
 
 			try:
 				record = SubjectAssign.objects.get(clss=class_id, session=current_session, term=term, teacher=teacher)
@@ -1125,7 +1056,7 @@ def attendance_view(request):
 @login_required
 @teacher_required
 def attendance_list(request):
-	session = Session.objects.get(current_session=True)
+	session = get_academic_context(request).session
 	all_class = Class.objects.all()
 	if request.method == "POST":
 		date = request.POST['date']
@@ -1138,17 +1069,18 @@ def attendance_list(request):
 			term = form.cleaned_data.get('selected_term')
 			selected_class = form.cleaned_data.get('selected_class')
 			students = Student.objects.filter(in_class=selected_class, session=session)
-			ids = ()
-			for i in students:
-				ids += (i.user.pk,)
-			q = Attendance.objects.filter(date=date, student__user__pk__in=ids, term=term, session=session)
+			q = Attendance.objects.filter(date=date, student__in=students, term=term, session=session)
 			context = {
 				"students": students,
 				"classes": all_class,
 				"attendance": q,
+				# the term figures come from the per-student bitmaps, not the daily rows
+				"term_totals": class_attendance(selected_class, session, term),
+				"term_attendance": class_attendance_by_student(selected_class, session, term),
 				"selected_class": selected_class,
 				"selected_term": term,
 				"selected_date": date,
+				"export_formats": exports.formats(),
 			}
 		else:
 			context =  {
@@ -1162,7 +1094,7 @@ def attendance_list(request):
 @login_required
 @teacher_required
 def add_attendance(request):
-	current_session = Session.objects.get(current_session=True)
+	current_session = get_academic_context(request).session
 	if request.method == "POST":
 		in_class = Class.objects.all()
 		data = request.POST.copy()
@@ -1197,52 +1129,14 @@ def add_attendance(request):
 @teacher_required
 def save_attendance(request):
 	if request.method == 'POST':
-		session = Session.objects.get(current_session=True)
-		term = request.POST.get('selected_term')
-		date = request.POST.get('selected_date')
-
-		stud_id = list(request.POST.getlist('student_id'))
-		status = list(request.POST.getlist('status'))
-		is_late = list(request.POST.getlist('is_late'))
-		duration = list(request.POST.getlist('duration'))
-
-		if len(is_late) < len(stud_id):
-			for i in range(0, len(stud_id)):
-				is_late.append(False)
-
-		if len(status) < len(stud_id):
-			for i in range(0, len(stud_id)):
-				status.append(False)
-
-		for i in range(0, len(stud_id)):
-			student = Student.objects.get(pk=stud_id[i])
-			d = duration[i]
-			if status[i] == 'on':
-				s = True
-			else:
-				s = False
-
-			if is_late[i] == 'on':
-				is_l = True
-			else:
-				is_l = False
-
-			try:
-				a = Attendance.objects.get(student=student, term=term, session=session, date=date)
-				a.is_late = is_l
-				a.is_present = s
-				a.is_late_for = d
-				a.save()
-			except Attendance.DoesNotExist:
-				Attendance(
-					student=student,
-					term=term,
-					session=session,
-					is_present=s,
-					is_late=is_l,
-					date=date,
-					is_late_for=d
-					).save()
+		session = get_academic_context(request).session
+		sheet = AttendanceSheet.from_post(session, request.POST)
+		try:
+			sheet.clean()
+			sheet.save()
+		except ValidationError as e:
+			messages.error(request, ' '.join(e.messages))
+			return redirect('add_attendance')
 		messages.success(request, "Successfully saved")
 		return redirect('add_attendance')
 	else:
@@ -1279,8 +1173,7 @@ def load_subjects(request):
 @login_required
 @teacher_required
 def score_list(request):
-	current_session = Session.objects.filter(current_session=True).first()
-	term=get_terms()
+	current_session, term = get_academic_context(request)
 	classes = Class.objects.all()
 	context = {"classes": classes, 'term': term}
 	if request.user.is_teacher:
@@ -1291,47 +1184,19 @@ def score_list(request):
 @login_required
 @teacher_required
 def score_entry(request):
-	session = Session.objects.get(current_session=True)
+	session, term = get_academic_context(request)
 	classes = Class.objects.all()
-	term = get_terms()
-	context = {"classes": classes, 'term':get_terms()}
+	context = {"classes": classes, 'term':term}
 
 	if request.method == 'POST':
-		term = request.POST.get('term')
-		subject = request.POST.get('subject')
-		subject = Subject.objects.get(pk=subject)
-		ca1 = list(request.POST.getlist('ca1'))
-		ca2 = list(request.POST.getlist('ca2'))
-		exam = list(request.POST.getlist('exam'))
-		stud_id = list(request.POST.getlist('student_id'))
-
-		for i in range(0, len(stud_id)):
-			student = Student.objects.get(pk=stud_id[i])
-			total = int(ca1[i] or '0') + int(ca2[i] or '0') + int(exam[i] or '0')
-			grade, created = Grade.objects.get_or_create(session=session, term=term, student=student, subject=subject)
-			if not created:
-					grade.fca=ca1[i]
-					grade.sca=ca2[i]
-					grade.exam=exam[i]
-					grade.total=total
-					grade.grade=getGrade(total)
-					grade.remark=getRemark(total)
-					grade.compute_position(term)
-					grade.save()
-			else:
-				a = Grade.objects.get(
-				session=session,
-				term=term,
-				student=student,
-				subject=subject)
-				a.fca=ca1[i]
-				a.sca=ca2[i]
-				a.exam=str(exam[i])
-				a.total=total
-				a.remark = getRemark(total)
-				a.grade = getGrade(total)
-				a.compute_position(term)
-				a.save()
+		subject = get_object_or_404(Subject, pk=request.POST.get('subject'))
+		sheet = ScoreSheet.from_post(session, subject, request.POST)
+		try:
+			sheet.clean()
+			sheet.save()
+		except ValidationError as e:
+			messages.error(request, ' '.join(e.messages))
+			return redirect('score_list')
 		messages.success(request, "Score Successfully Recorded !")
 		return redirect('score_list')
 
@@ -1371,7 +1236,7 @@ def score_entry(request):
 			selected_class_id = request.GET.get('scid')
 			selected_class = Class.objects.get(id=selected_class_id)
 			selected_class_name = selected_class.name
-			current_session = Session.objects.get(current_session=True)
+			current_session = get_academic_context(request).session
 			students = Student.objects.filter(in_class__name=selected_class, session=current_session)
 
 			subject = request.GET.get('subject')
@@ -1402,7 +1267,7 @@ def score_entry(request):
 
 @login_required
 def view_score(request):
-	session = Session.objects.get(current_session=True)
+	session, term = get_academic_context(request)
 	if request.user.is_parent:
 
 		# Get all the current sesssion students related 
@@ -1414,20 +1279,20 @@ def view_score(request):
 		
 		context = {
 			"students": students,
-			"term": get_terms(),
+			"term": term,
 		}
 		return render(request, 'sms/mark/parent_view_scores.html', context)
 	elif request.user.is_student:
 		student = Student.objects.get(user__pk=request.user.id, session=session)
 		#subjects = student.in_class.subjects.all()
-		scores = Grade.objects.filter(student=student.id, session=session, term=get_terms())
+		scores = Grade.objects.filter(student=student.id, session=session, term=term)
 		context = {
 			"scores": scores,
-			"term": get_terms(),
+			"term": term,
+			"attendance": get_term_attendance(student, session, term),
 		}
 		return render(request, 'sms/mark/student_view_score.html', context)
 	elif request.user.is_teacher:
-		term = get_terms()
 		teacher = User.objects.get(pk=request.user.id)
 		classes = SubjectAssign.objects.filter(teacher=teacher.pk, session=session, term=term)
 		context = {
@@ -1446,9 +1311,9 @@ def view_score(request):
 def load_score_table(request):
 	if request.is_ajax():
 		if request.user.is_parent:
-			current_session = Session.objects.get(current_session=True)
+			current_session = get_academic_context(request).session
 			stud_id = request.GET.get('stud_id')
-			grades = Grade.objects.filter(student__pk=stud_id, session=current_session, term=get_terms())
+			grades = Grade.objects.filter(student__pk=stud_id, session=current_session, term=get_academic_context(request).term)
 			context = {"grades": grades}
 			return render(request, 'sms/mark/load_view_score.html', context)
 		else:
@@ -1458,7 +1323,7 @@ def load_score_table(request):
 
 			clss = Class.objects.get(pk=class_id).pk
 			subject = Subject.objects.get(pk=subject_id)
-			current_session = Session.objects.get(current_session=True)
+			current_session = get_academic_context(request).session
 
 			grades = Grade.objects.filter(
 				student__in_class__pk=clss,
@@ -1476,7 +1341,7 @@ def add_expenditure(request):
 		form = ExpenseForm(request.POST)
 		if form.is_valid():
 			term = form.cleaned_data.get('term')
-			session = Session.objects.get(current_session=True)
+			session = get_academic_context(request).session
 			item = form.cleaned_data.get('item')
 			amount = form.cleaned_data.get('amount')
 			description = form.cleaned_data.get('description')
@@ -1522,7 +1387,7 @@ def add_payment(request):
 			student = form.cleaned_data.get('student')
 			student = Student.objects.get(pk=student)
 			payment_method = form.cleaned_data.get('payment_method')
-			session = Session.objects.get(current_session=True)
+			session = get_academic_context(request).session
 			term = form.cleaned_data.get('term')
 			paid_amount = form.cleaned_data.get('paid_amount')
 			teller_number = form.cleaned_data.get('tnumber')
@@ -1600,7 +1465,8 @@ def payment(request):
 	classes = Class.objects.all().order_by('name')
 	context = {
 		"classes": classes,
-		"payments": payments
+		"payments": payments,
+		"export_formats": exports.formats(),
 		}
 	return render(request, 'sms/payments/payment.html',context )
 
@@ -1641,7 +1507,7 @@ def delete_payment(request, id):
 @login_required
 @teacher_required
 def load_payment_table(request):
-	session = Session.objects.get(current_session=True)
+	session = get_academic_context(request).session
 	term = request.GET.get('term')
 	class_id = request.GET.get('class')
 	payments = Payment.objects.filter(
@@ -1653,7 +1519,7 @@ def load_payment_table(request):
 @login_required
 @teacher_required
 def load_students_of_class(request):
-    current_session = Session.objects.get(current_session=True)
+    current_session = get_academic_context(request).session
     class_id = request.GET.get('class')
     students = Student.objects.filter(in_class__pk=class_id, session=current_session)
     return render(request, 'sms/payments/ajax_load_students.html', {"students": students})
@@ -1661,7 +1527,7 @@ def load_students_of_class(request):
 @login_required
 @teacher_required
 def load_student_users(request):
-    current_session = Session.objects.get(current_session=True)
+    current_session = get_academic_context(request).session
     class_id = request.GET.get('class')
     students = Student.objects.filter(in_class__pk=class_id, session=current_session)
     return render(request, 'sms/ajax/ajax_load_student_users.html', {"students": students})
@@ -1708,11 +1574,18 @@ def del_session(request, id):
 		sessions = Session.objects.all()
 	return render(request, 'sms/academic_year/session.html', {"sessions":sessions})
 
+def sms_history():
+	""" Sent messages with their number of recipients, delivered and failed """
+	return Sms.objects.annotate(
+		recipients=Count('deliveries'),
+		delivered=Count('deliveries', filter=Q(deliveries__status=DELIVERED)),
+		failed=Count('deliveries', filter=Q(deliveries__status=FAILED))).order_by('-date_send')
+
+
 @login_required
 @admin_required
 def sms_list(request):
-	sms = Sms.objects.all()
-	return render(request, 'sms/sms/sms.html', {"sms":sms})
+	return render(request, 'sms/sms/sms.html', {"sms": sms_history()})
 
 @login_required
 @admin_required
@@ -1733,26 +1606,11 @@ def mail(request):
 				content=message,
 				admin=admin
 			)
-			mail.save()
-
-			# prepare html templates
-			template = 'email_template.html'
-			setting = Setting.objects.first()
-			context= {
-				'setting': setting,
-				'mail': mail
-				}
-
-			mail_message = render_to_string(template, context)
-			
-			# add recipients one after another
-			for i in recipients:
-				mail.recipients.add(i)
-				
+			mail.recipients.add(*recipients)
 
-			# send the actual email and redirect
-			asyncio.run(mail.deliver_mail(content=mail_message))
-			messages.success(request, 'Emails Successfully Send !')
+			# queued, a background worker sends the personalized messages
+			mail.deliver_mail()
+			messages.success(request, 'Emails are being sent !')
 			return redirect('mail')
 		else:
 			form = EmailMessageForm(request.POST)
@@ -1760,11 +1618,11 @@ def mail(request):
 			template = 'sms/mail/mail_view.html'
 			return render(request, template, context)
 
-	draft_mails = EmailMessage.objects.filter(status=PENDING)
-	delivered_emails = EmailMessage.objects.filter(status=DELIVERED)
+	draft_mails = EmailMessage.objects.filter(status__in=[PENDING, SENDING])
+	delivered_mails = EmailMessage.objects.filter(status__in=[DELIVERED, FAILED])
 	context = {
 		'draft_mails': draft_mails,
-		'delivered_emails': delivered_emails
+		'delivered_mails': delivered_mails
 	}
 	template = 'sms/mail/mail_view.html'
 	return render(request, template, context)
@@ -1772,7 +1630,6 @@ def mail(request):
 @login_required
 @admin_required
 def send_bulk_sms(request):
-	sms = Sms.objects.all()
 	if request.method == "POST":
 		form = SmsForm(request.POST)
 		if form.is_valid():
@@ -1788,25 +1645,25 @@ def send_bulk_sms(request):
 			elif to_user == "Teacher":
 				users = User.objects.filter(is_teacher=True)
 
-			for user in users:
-				asyncio.run(send_sms(user.phone, '{}, {}'.format(title, sms_body)))
-
-			Sms.objects.create(title=title, body=body, to_user=to_user)
+			phones = users.exclude(phone__isnull=True).exclude(phone='').values_list('phone', flat=True)
+			with transaction.atomic():
+				sms = Sms.objects.create(title=title, body=sms_body, to_user=to_user)
+				deliveries = queue_sms(phones, '{}, {}'.format(title, sms_body), sms=sms)
 			context = {
-				"sms": sms,
+				"sms": sms_history(),
 				"title": title,
-				"body": body,
+				"body": sms_body,
 				"to_user": to_user
 			}
-			messages.success(request, ' Messages delivered successfully')
-			return render(request, 'sms/mail_and_sms/sms.html', context)
+			messages.success(request, ' Messages queued for {} recipients'.format(len(deliveries)))
+			return render(request, 'sms/sms/sms.html', context)
 		else:
 			form = SmsForm(request.POST)
-			context = {"form": form}
-			return render(request, 'sms/mail_and_sms/sms.html', context)
+			context = {"form": form, "sms": sms_history()}
+			return render(request, 'sms/sms/sms.html', context)
 	else:
-		context = {"sms":sms}
-		return render(request, 'sms/mail_and_sms/sms.html', context)
+		context = {"sms": sms_history()}
+		return render(request, 'sms/sms/sms.html', context)
 
 
 @login_required
@@ -1980,13 +1837,17 @@ def load_promotion_list(request):
 	if request.is_ajax():
 		from_class_id = request.GET.get('from_class_id')
 		to_class_id = request.GET.get('to_class_id')
-		current_session = Session.objects.get(current_session=True)
+		current_session = get_academic_context(request).session
 		to_session = request.GET.get('to_session')
-		ranking = Student.objects.filter(in_class__pk=from_class_id, session=current_session)
+		term = get_academic_context(request).term
+		ranking = Student.objects.filter(
+			in_class__pk=from_class_id, session=current_session).select_related('user')
+		from_class = Class.objects.filter(pk=from_class_id).first()
 		context = {
-			'term': get_terms(),
+			'term': term,
 			'current_session': current_session,
 			'ranking': ranking,
+			'report': from_class and ClassReport(from_class, current_session, term, subjects=()),
  			'to_session': to_session,
           	'from_class_id': from_class_id,
           	'to_class_id': to_class_id,
@@ -1997,7 +1858,7 @@ def load_promotion_list(request):
 @login_required
 @admin_required
 def promote(request, stud_id,  to_class_id, to_session_id):
-	from_session = Session.objects.get(current_session=True)
+	from_session = get_academic_context(request).session
 	to_session = Session.objects.get(id=to_session_id)
 	to_class = Class.objects.get(id=to_class_id)
 
@@ -2254,7 +2115,7 @@ def update_section(request, id):
 @login_required
 @admin_required
 def online_admission_list(request):
-	current_session = get_object_or_404(Session, current_session=True)
+	current_session = get_academic_context(request).session
 	applications = OnlineAdmission.objects.filter(session=current_session)
 	context = {
 			'applications': applications
@@ -2378,7 +2239,7 @@ def set_parent(request):
 			for student in parent.student.all():
 				stud_ids += (student.id,)
 		
-		current_session = Session.objects.get(current_session=True)
+		current_session = get_academic_context(request).session
 		students = Student.objects.filter(session=current_session).exclude(id__in=stud_ids)
 		parents = User.objects.filter(is_parent=True)
 		return render(request, 'sms/parent/set_parent.html', {'students': students, 'parents': parents})
@@ -2416,17 +2277,20 @@ def class_member_report_view(request):
 @login_required
 @admin_required
 def class_member_report(request):
-	from weasyprint import HTML, CSS
 	class_id = request.GET.get('class')
 	session = request.GET.get('session')
 	if not session:
-		session = Session.objects.get(current_session=True)
+		session = get_academic_context(request).session
 	else:
 		session = Session.objects.get(pk=session)
+	term = get_academic_context(request).term
+	_class = get_object_or_404(Class, id=class_id) 
+	key = report_key('class_members', _class.pk, session.pk, term)
+	cached = cached_report_response(request, key, 'class_members.pdf')
+	if cached is not None:
+		return cached
 	class_members = Student.objects.filter(in_class__pk=class_id, session=session.pk)
 	setting = Setting.objects.first()
-	term = get_terms()
-	_class = get_object_or_404(Class, id=class_id) 
 	context = {
 		"session": session,
 		"term": term,
@@ -2437,21 +2301,8 @@ def class_member_report(request):
 	template = "sms/reports/class_members.html"
 	template = get_template(template)
 	html = template.render(context)
-
-	css_string = """@page {
-		size: a4 portrait;
-		margin: 1mm;
-		counter-increment: page;
-	}"""
-
-	pdf_file = HTML(string=html, base_url=request.build_absolute_uri()).write_pdf(
-			stylesheets=[CSS(string=css_string)],presentational_hints=True)
-
-
-	response = HttpResponse(pdf_file, content_type='application/pdf')
-	response['Content-Disposition'] = 'filename="class_members.pdf"'
-	return response
-	return HttpResponse(response.getvalue(), content_type='application/pdf')
+	job = queue_report(request, 'Members of {} ({})'.format(_class, session), 'class_members.pdf', html, cache_key=key)
+	return report_job_response(request, job)
 
 @login_required
 @admin_required
@@ -2467,7 +2318,6 @@ def subject_allocation_report_view(request):
 @login_required
 @admin_required
 def subject_allocation_report(request):
-	from weasyprint import HTML, CSS
 	setting = Setting.objects.first()
 	if not request.GET.get('term') in ['First', 'Second', 'Third']:
 		messages.error(request, ' ERROR: please select a term !')
@@ -2483,6 +2333,10 @@ def subject_allocation_report(request):
 		clss = request.GET.get('class')
 		session = request.GET.get('session')
 		session = get_object_or_404(Session, pk=session)
+		key = report_key('subject_allocation', clss, session.pk, term)
+		cached = cached_report_response(request, key, 'subject_allocation.pdf')
+		if cached is not None:
+			return cached
 		context = {}
 		default = []
 		if clss == "All":
@@ -2515,21 +2369,8 @@ def subject_allocation_report(request):
 	template = "sms/reports/subject_allocation_report.html"
 	template = get_template(template)
 	html = template.render(context)
-
-	css_string = """@page {
-		size: a4 portrait;
-		margin: 1mm;
-		counter-increment: page;
-	}"""
-
-	pdf_file = HTML(string=html, base_url=request.build_absolute_uri()).write_pdf(
-			stylesheets=[CSS(string=css_string)],presentational_hints=True)
-
-
-	response = HttpResponse(pdf_file, content_type='application/pdf')
-	response['Content-Disposition'] = 'filename="subject_allocation.pdf"'
-	return response
-	return HttpResponse(response.getvalue(), content_type='application/pdf')
+	job = queue_report(request, 'Subject allocation ({} term, {})'.format(term, session), 'subject_allocation.pdf', html, cache_key=key)
+	return report_job_response(request, job)
 
 
 @login_required
@@ -2538,6 +2379,7 @@ def subject_report_view(request):
 	classes = Class.objects.all()
 	context = {
 		"classes": classes,
+		"export_formats": exports.formats(),
 	}
 	return render(request, 'sms/reports_view/subject_report_view.html', context)
 
@@ -2545,7 +2387,6 @@ def subject_report_view(request):
 @login_required
 @admin_required
 def subject_report(request):
-	from weasyprint import HTML, CSS
 	setting = Setting.objects.first()
 	if not request.GET.get('term') in ['First', 'Second', 'Third']:
 		messages.error(request, ' ERROR: please select a term !')
@@ -2557,10 +2398,14 @@ def subject_report(request):
 		messages.error(request, ' ERROR: please select a class !')
 		return redirect('subject_report_view')
 	else:
-		session = Session.objects.get(current_session=True)
+		session = get_academic_context(request).session
 		term = request.GET.get('term')
 		class_id = request.GET.get('class')
 		subject = request.GET.get('subject')
+		key = report_key('subject_report', class_id, subject, session.pk, term)
+		cached = cached_report_response(request, key, 'subject_report.pdf')
+		if cached is not None:
+			return cached
 		subjects = Subject.objects.filter(pk=subject)
 		s = get_object_or_404(Subject, id=subject)
 		subject_teacher = SubjectAssign.objects.filter(
@@ -2572,31 +2417,23 @@ def subject_report(request):
 				if sub == s:
 					subject_teacher = i.teacher
 		clss = get_object_or_404(Class, pk=class_id)
-		current_session = Session.objects.get(current_session=True)
+		current_session = get_academic_context(request).session
 		students = Student.objects.filter(in_class=clss, 
 			session=current_session)
 		if not students.exists():
 			messages.success(request, 'No students exists for class {} in {} term'.format(clss, term))
 			return redirect('subject_report_view')
 
-		grades = Grade.objects.filter(term=term, student__in_class=clss,session=current_session).order_by('-total')
-		class_avg = grades.filter(subject=subject)
-		class_avg = class_avg.aggregate(class_avg=Sum('total')).get('class_avg') / class_avg.count()
-		if not grades.exists():
+		report = ClassReport(clss, current_session, term, subjects)
+		if not report.exists():
 			messages.success(request, 'No grades exists for class {} in {} term'.format(clss, term))
 			return redirect('subject_report_view')
+		class_avg = report.subject_average(s.pk)
+		statistics = Grade.objects.filter(
+			session=current_session, term=term, subject=s, student__in_class=clss).component_statistics().first()
 
-		records = ()
-		count = 0
-		for student in students:
-			try:
-				count += 1
-				student_grades = grades.filter(student=student)
-				data = get_subject_report_data(grades, subjects, student, student_grades)
-				records += (data,)
-			except Exception as e:
-				DB_LOGGER.error('====================={}'.format(e))
-		if not count:
+		records = tuple(report.subject_rows(student.pk) for student in students)
+		if not records:
 			messages.success(request, '	Report for class {} in {} term does not exists'.format(clss, term))
 			return redirect('subject_report_view')
 		
@@ -2607,24 +2444,13 @@ def subject_report(request):
 		context['subject'] = s
 		context['subject_teacher'] = subject_teacher
 		context['class_avg'] = class_avg
+		context['statistics'] = statistics
+		context['report'] = report
 		template = "sms/reports/subject_report.html"
 		template = get_template(template)
 		html = template.render(context)
-
-		css_string = """@page {
-			size: a4 portrait;
-			margin: 1mm;
-			counter-increment: page;
-		}"""
-
-		pdf_file = HTML(string=html, base_url=request.build_absolute_uri()).write_pdf(
-				stylesheets=[CSS(string=css_string)],presentational_hints=True)
-
-
-		response = HttpResponse(pdf_file, content_type='application/pdf')
-		response['Content-Disposition'] = 'filename="subject_allocation.pdf"'
-		return response
-		return HttpResponse(response.getvalue(), content_type='application/pdf')
+		job = queue_report(request, '{} report of {} ({} term)'.format(s, clss, term), 'subject_report.pdf', html, cache_key=key)
+		return report_job_response(request, job)
 
 @login_required
 @admin_required
@@ -2634,13 +2460,13 @@ def broadsheet_report_view(request):
 	context = {
 		"session": session,
 		"classes": classes,
+		"export_formats": exports.formats(),
 	}
 	return render(request, 'sms/reports_view/broadsheet_report_view.html', context)
 
 @login_required
 @admin_required
 def broadsheet_report(request):
-	from weasyprint import HTML, CSS
 	setting = Setting.objects.first()
 	if not request.GET.get('term') in ['First', 'Second', 'Third']:
 		messages.error(request, ' ERROR: please select a term !')
@@ -2657,42 +2483,24 @@ def broadsheet_report(request):
 		class_id = request.GET.get('class')
 		clss = get_object_or_404(Class, pk=class_id)
 		session = get_object_or_404(Session, pk=session)
-		subjects = get_object_or_404(Class, pk=class_id).subjects.all()
-		grades = Grade.objects.filter(term=term, student__in_class=clss.pk, session=session.pk).order_by('-total')
-		if not grades.exists():
+		key = report_key('broadsheet', clss.pk, session.pk, term)
+		cached = cached_report_response(request, key, 'broadsheet.pdf')
+		if cached is not None:
+			return cached
+		subjects = clss.subjects.all()
+		report = ClassReport(clss, session, term, subjects)
+		if not report.exists():
 			messages.success(request, 'No grades exists for class {} in term {} '.format(clss, term))
 			return redirect('broadsheet_report_view')
 
-		grades_ordered= grades\
-		.values('student')\
-		.annotate(total_mark=Sum('total'))\
-		.order_by('-total_mark')
-		total_marks = [i.get('total_mark') for i in grades_ordered]
-		records = ()
-		highest = grades_ordered.first()['total_mark']
-		lowest = grades_ordered.last()['total_mark']
-		students = Student.objects.filter(in_class=clss, session=session)
-		count = 0
-		for student in students:
-			try:
-				total_mark = (grades_ordered.get(student=student.pk)['total_mark'])
-				setattr(student, 'total_mark', total_mark)
-				student_rank = total_marks.index(total_mark)+1
-				setattr(student, 'student_rank', student_rank)
-				count += 1
-				student_grades = grades.filter(student=student)
-				data = get_subject_report_data(grades, subjects, student, student_grades)
-				records += (data,)
-
-			except Exception as e:
-				DB_LOGGER.error('====================={}'.format(e))
-		if not count:
+		records = tuple(rows for student, rows in report.records().values())
+		if not records:
 			messages.success(request, 'No reports exists for class %s in term %r '%(clss, term))
 			return redirect('broadsheet_report_view')
 		additional_td = None
 		for item in records:
-			if len(item) < subjects.count():
-				additional_td = subjects.count() - len(item)
+			if len(item) < len(report.subjects):
+				additional_td = len(report.subjects) - len(item)
 		context = {
 			"results": records,
 			"term": term,
@@ -2701,25 +2509,79 @@ def broadsheet_report(request):
 			"setting": setting,
 			"subjects": subjects,
 			"additional_td": additional_td,
+			"report": report,
 		}
 		template = "sms/reports/broadsheet_report.html"
 		template = get_template(template)
 		html = template.render(context)
+		job = queue_report(request, 'Broadsheet of {} ({} term, {})'.format(clss, term, session), 'broadsheet.pdf', html, PAGE_LANDSCAPE, cache_key=key)
+		return report_job_response(request, job)
 
-		css_string = """@page {
-			size: a4 landscape;
-			margin: 1mm;
-			counter-increment: page;
-		}"""
 
-		pdf_file = HTML(string=html, base_url=request.build_absolute_uri()).write_pdf(
-				stylesheets=[CSS(string=css_string)],presentational_hints=True)
+def export_output(request):
+	""" The export format asked for with ?output=, 404 when it is not available """
+	output = request.GET.get('output', exports.CSV)
+	if output not in exports.formats():
+		raise Http404('Unknown export format')
+	return output
 
+def export_filename(*parts):
+	return '-'.join(slugify(str(part)) for part in parts)
 
-		response = HttpResponse(pdf_file, content_type='application/pdf')
-		response['Content-Disposition'] = 'filename="subject_allocation.pdf"'
-		return response
-		return HttpResponse(response.getvalue(), content_type='application/pdf')
+@login_required
+@admin_required
+def export_broadsheet(request):
+	output = export_output(request)
+	term = request.GET.get('term')
+	if term not in dict(TERM) or not request.GET.get('session') or not request.GET.get('class'):
+		messages.error(request, ' ERROR: please select a class, a session and a term !')
+		return redirect('broadsheet_report_view')
+	clss = get_object_or_404(Class, pk=request.GET.get('class'))
+	session = get_object_or_404(Session, pk=request.GET.get('session'))
+	rows = exports.broadsheet_rows(clss, session, term)
+	return exports.export_response(rows, export_filename('broadsheet', clss, term, session), output)
+
+@login_required
+@admin_required
+def export_score_sheet(request):
+	output = export_output(request)
+	term = request.GET.get('term')
+	if term not in dict(TERM) or not request.GET.get('subject') or not request.GET.get('class'):
+		messages.error(request, ' ERROR: please select a class, a subject and a term !')
+		return redirect('subject_report_view')
+	clss = get_object_or_404(Class, pk=request.GET.get('class'))
+	subject = get_object_or_404(Subject, pk=request.GET.get('subject'))
+	session = get_academic_context(request).session
+	rows = exports.score_sheet_rows(clss, session, term, subject)
+	return exports.export_response(rows, export_filename('scores', clss, subject, term, session), output)
+
+@login_required
+@admin_required
+def export_payments(request):
+	output = export_output(request)
+	term = request.GET.get('term') or None
+	if term is not None and term not in dict(TERM):
+		messages.error(request, ' ERROR: please select a valid term !')
+		return redirect('view_payments')
+	if request.GET.get('session'):
+		session = get_object_or_404(Session, pk=request.GET.get('session'))
+	else:
+		session = get_academic_context(request).session
+	rows = exports.payment_rows(session, term)
+	return exports.export_response(rows, export_filename('payments', session, term or 'all terms'), output)
+
+@login_required
+@admin_required
+def export_attendance(request):
+	output = export_output(request)
+	term = request.GET.get('term')
+	if term not in dict(TERM) or not request.GET.get('class'):
+		messages.error(request, ' ERROR: please select a class and a term !')
+		return redirect('attendance_list')
+	clss = get_object_or_404(Class, pk=request.GET.get('class'))
+	session = get_academic_context(request).session
+	rows = exports.attendance_rows(clss, session, term)
+	return exports.export_response(rows, export_filename('attendance', clss, term, session), output)
 
 @login_required
 @admin_required